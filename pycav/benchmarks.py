@@ -0,0 +1,285 @@
+"""
+Benchmarks of typical workloads of the mechanics module, each run at several numbers of particles.
+Run them from the command line, writing the results as JSON to compare against later runs:
+
+    python -m pycav.benchmarks --output results.json
+
+or pick workloads and sizes:
+
+    python -m pycav.benchmarks --workloads ideal_gas gravity --sizes 100 1000 --steps 50
+"""
+from __future__ import division, print_function
+import argparse
+import json
+import platform
+import sys
+import timeit
+
+import numpy as np
+
+from pycav import mechanics
+from pycav.mechanics import Container, Particle, SimulationStats, Spring, System
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def ideal_gas(number, random_state):
+    """
+    Hard spheres colliding in a cubic container, at a volume fraction of 5% whatever the number of particles.
+    """
+    radius = 0.5
+    dimension = (number * 4. / 3. * np.pi * radius**3 / 0.05)**(1. / 3.)
+    system = System(collides=True, interacts=False, visualize=False, container=Container(dimension), record_pressure=True)
+    system.create_particles_in_container(number, speed=1., radius=radius, random_state=random_state)
+    return system
+
+
+def gravity(number, random_state):
+    """
+    Particles in a ball attracting each other gravitationally, with forces found by direct summation.
+    """
+    return _cluster(number, random_state, 'direct')
+
+
+def gravity_barnes_hut(number, random_state):
+    """
+    The same as gravity, with forces found with the Barnes-Hut tree.
+    """
+    return _cluster(number, random_state, 'barnes_hut')
+
+
+def _cluster(number, random_state, force_engine):
+    pos = random_state.normal(0., 10., (number, 3))
+    v = random_state.normal(0., 0.1, (number, 3))
+    particles = [Particle(pos=pos[index], v=v[index], radius=0.1, inv_mass=1., visualize=False) for index in range(number)]
+    return System(collides=False, interacts=True, visualize=False, particles=particles, force_engine=force_engine)
+
+
+def spring_chain(number, random_state):
+    """
+    A chain of particles joined by springs with fixed ends, set oscillating by a random displacement of each particle.
+    """
+    particles = [Particle(pos=np.array([float(index), 0., 0.]) + random_state.normal(0., 0.1, 3), radius=0.2, inv_mass=1.,
+                          fixed=index in (0, number - 1), visualize=False) for index in range(number)]
+    springs = [Spring(particles[index], particles[index + 1], k=10., l0=1., visualize=False) for index in range(number - 1)]
+    return System(collides=False, interacts=False, visualize=False, particles=particles, springs=springs)
+
+
+def spring_lattice(number, random_state):
+    """
+    A cubic lattice of roughly number particles, each joined by springs to its neighbours along each axis.
+    """
+    side = max(2, int(round(number**(1. / 3.))))
+    sites = np.indices((side, side, side)).reshape(3, -1).T
+    particles = [Particle(pos=site + random_state.normal(0., 0.1, 3), radius=0.2, inv_mass=1., visualize=False)
+                 for site in sites.astype(float)]
+    index = np.arange(len(sites)).reshape(side, side, side)
+    springs = []
+    for axis in range(3):
+        first = np.take(index, np.arange(side - 1), axis=axis).ravel()
+        second = np.take(index, np.arange(1, side), axis=axis).ravel()
+        springs += [Spring(particles[i], particles[j], k=10., l0=1., visualize=False) for i, j in zip(first, second)]
+    return System(collides=False, interacts=False, visualize=False, particles=particles, springs=springs)
+
+
+def _downwards(particle, time):
+    return np.array([0., -1., 0.])
+
+
+def display_forces(number, random_state):
+    """
+    Particles falling under an applied force in a container, with arrows showing the forces on them.
+    """
+    system = System(collides=True, interacts=False, visualize=False, container=Container(20.), display_forces=True)
+    system.create_particles_in_container(number, speed=1., radius=0.2, random_state=random_state)
+    for particle in system.particles:
+        particle.applied_force = _downwards
+    return system
+
+
+# Workloads by name, with the time step and numbers of particles each one is run with by default.
+WORKLOADS = {'ideal_gas': (ideal_gas, 0.01, [100, 300, 1000, 3000]),
+             'gravity': (gravity, 0.01, [100, 300, 1000]),
+             'gravity_barnes_hut': (gravity_barnes_hut, 0.01, [300, 1000, 3000]),
+             'spring_chain': (spring_chain, 0.001, [100, 1000, 10000]),
+             'spring_lattice': (spring_lattice, 0.001, [125, 1000, 8000]),
+             'display_forces': (display_forces, 0.01, [10, 30, 100])}
+
+
+def run_benchmark(workload, number, steps=100, warmup=5, seed=0, threads=1, memory=True):
+    """
+    Times steps of one workload, giving a dictionary of the results.
+    Parameters
+    ----------
+    workload: string
+        Name of a workload in WORKLOADS
+    number: integer
+        Number of particles
+    steps: integer
+        Number of steps timed, after warmup steps which aren't
+    warmup: integer
+        Number of steps taken before timing, so that arrays have been allocated
+    seed: integer
+        Seed of the random numbers used to set up the workload, so that every run sets it up the same way
+    threads: integer
+        Number of threads the system uses
+    memory: boolean
+        Whether to find the peak memory used, with tracemalloc, by running the workload a second time
+    """
+    make_system, dt, __ = WORKLOADS[workload]
+    start = timeit.default_timer()
+    system = make_system(number, np.random.RandomState(seed))
+    setup_time = timeit.default_timer() - start
+    system.threads = threads
+    for __ in range(warmup):
+        system.simulate(dt)
+    system.stats = SimulationStats(every=steps + 1, conservation=False)
+    start = timeit.default_timer()
+    for __ in range(steps):
+        system.simulate(dt)
+    elapsed = timeit.default_timer() - start
+    stats = system.stats
+    result = {'workload': workload, 'n': len(system.particles), 'springs': len(system.springs), 'steps': steps, 'dt': dt,
+              'threads': threads, 'setup_seconds': setup_time, 'seconds': elapsed, 'steps_per_second': steps / elapsed,
+              'phase_seconds_per_step': dict((phase, stats.times[phase] * 1e-9 / steps) for phase in stats.phases),
+              'pair_checks_per_step': stats.pair_checks / steps, 'collisions_per_step': stats.collisions / steps,
+              'peak_memory_bytes': None}
+    if memory and tracemalloc is not None:
+        result['peak_memory_bytes'] = _peak_memory(make_system, number, seed, threads, dt, warmup + steps)
+    return result
+
+
+def _peak_memory(make_system, number, seed, threads, dt, steps):
+    """
+    Gives the largest memory allocated in setting up and running a workload, in bytes.
+    Memory is traced in a separate run, as tracing slows down allocation.
+    """
+    tracemalloc.start()
+    try:
+        system = make_system(number, np.random.RandomState(seed))
+        system.threads = threads
+        for __ in range(steps):
+            system.simulate(dt)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def particle_memory(number=10000):
+    """
+    Measures the memory taken by each particle of a system which isn't visualized, in bytes,
+    counting the Particle object and its rows of the system's ParticleStore. None if tracemalloc isn't available.
+    Parameters
+    ----------
+    number: integer
+        Number of particles created to measure the memory of
+    """
+    if tracemalloc is None:
+        return None
+    pos = np.random.RandomState(0).uniform(0., 100., (number, 3))
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        particles = [Particle(pos=pos[index], radius=0.1, inv_mass=1., visualize=False) for index in range(number)]
+        system = System(collides=False, interacts=False, visualize=False, particles=particles)
+        system.store
+        return (tracemalloc.get_traced_memory()[0] - start) / number
+    finally:
+        tracemalloc.stop()
+
+
+def scaling_exponents(results):
+    """
+    Fits the time per step of each workload to a power of the number of particles, giving a dictionary from each workload
+    to the exponent, e.g. close to 2 for direct summation of gravity. Workloads run at fewer than two sizes are left out.
+    """
+    exponents = {}
+    for workload in sorted(set(result['workload'] for result in results)):
+        runs = [result for result in results if result['workload'] == workload]
+        if len(set(result['n'] for result in runs)) < 2:
+            continue
+        n = np.log([result['n'] for result in runs])
+        seconds_per_step = np.log([1. / result['steps_per_second'] for result in runs])
+        exponents[workload] = float(np.polyfit(n, seconds_per_step, 1)[0])
+    return exponents
+
+
+def run_benchmarks(workloads=None, sizes=None, steps=100, seed=0, threads=1, memory=True, verbose=True):
+    """
+    Runs each workload at each size, giving a dictionary of the machine the benchmarks ran on,
+    the results of every run, the scaling exponent of each workload and the memory taken by each particle.
+    Parameters
+    ----------
+    workloads: array of strings
+        Names of the workloads to run, by default all of WORKLOADS
+    sizes: array of integers
+        Numbers of particles to run every workload with, by default the sizes given in WORKLOADS for each workload
+    steps, seed, threads, memory:
+        Passed on to run_benchmark
+    verbose: boolean
+        Whether to print each result as it is found
+    """
+    if workloads is None:
+        workloads = sorted(WORKLOADS)
+    for workload in workloads:
+        if workload not in WORKLOADS:
+            raise ValueError("Unknown workload '{0}', choose from {1}".format(workload, sorted(WORKLOADS)))
+    results = []
+    if verbose:
+        print(_format_row(('workload', 'n', 'steps/s', 'peak MB', 'hottest phase')))
+    for workload in workloads:
+        for number in (sizes if sizes is not None else WORKLOADS[workload][2]):
+            result = run_benchmark(workload, number, steps, seed=seed, threads=threads, memory=memory)
+            results.append(result)
+            if verbose:
+                phases = result['phase_seconds_per_step']
+                hottest = max(phases, key=phases.get)
+                peak = result['peak_memory_bytes']
+                print(_format_row((workload, result['n'], '{0:.1f}'.format(result['steps_per_second']),
+                                   '-' if peak is None else '{0:.1f}'.format(peak / 2.**20),
+                                   '{0} {1:.0%}'.format(hottest, phases[hottest] * result['steps_per_second']))))
+    return {'machine': machine_info(), 'steps': steps, 'seed': seed, 'results': results,
+            'scaling_exponents': scaling_exponents(results), 'bytes_per_particle': particle_memory() if memory else None}
+
+
+def _format_row(columns):
+    return '{0:<20}{1:>8}{2:>12}{3:>10}  {4}'.format(*columns)
+
+
+def machine_info():
+    """
+    Gives a dictionary describing the machine and the versions of python, numpy and pycav, to store with results.
+    """
+    import multiprocessing
+    import pycav
+    return {'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': multiprocessing.cpu_count(),
+            'python': sys.version.split()[0], 'numpy': np.__version__, 'pycav': pycav.__version__,
+            'mechanics': mechanics.__file__}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the pycav mechanics module")
+    parser.add_argument('--workloads', nargs='+', choices=sorted(WORKLOADS), help="workloads to run, by default all of them")
+    parser.add_argument('--sizes', nargs='+', type=int, help="numbers of particles, by default a few for each workload")
+    parser.add_argument('--steps', type=int, default=100, help="number of steps timed")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random set up of the workloads")
+    parser.add_argument('--threads', type=int, default=1, help="number of threads the systems use")
+    parser.add_argument('--no-memory', action='store_true', help="don't find the peak memory, which runs everything twice")
+    parser.add_argument('--output', help="file to write the results to as JSON")
+    args = parser.parse_args(argv)
+    report = run_benchmarks(args.workloads, args.sizes, args.steps, args.seed, args.threads, not args.no_memory)
+    for workload, exponent in sorted(report['scaling_exponents'].items()):
+        print("{0} time per step grows as N^{1:.2f}".format(workload, exponent))
+    if report['bytes_per_particle'] is not None:
+        print("Each particle takes {0:.0f} bytes".format(report['bytes_per_particle']))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,12 @@
 An object oriented library to allow quick prototyping of simulations.
 """
 from __future__ import division, print_function
+cimport cython
+from libc.math cimport sqrt, floor
+from cython.parallel cimport prange
+import heapq
+import time
+import timeit
 import numpy as np
 import NotificationCenter as nc
 from random import *
@@ -70,13 +76,6 @@ def normalized(arr):
     return arr / np.sqrt(np.inner(arr, arr))
 
 
-def _duplicate_vector(arr):
-    """
-    Duplicates a vector and returns it. Faster than copy.deepcopy
-    """
-    return np.array([arr[0], arr[1], arr[2]])
-
-
 def _perpendicular_vector(vec):
     """
     Gets an arbitary vector that is perpendicular to the vector given
@@ -107,7 +106,278 @@ def _cross(vec1, vec2):
     return (np.array([x, y, z]))
 
 
+# Compiled kernels for the hot loops of a simulation, working directly on the arrays of a ParticleStore.
+# They run without the GIL, on typed memoryviews, and are called by the vectorized Python code below.
+# Loops over particles, springs and pairs are split between num_threads threads with OpenMP where the module is built with it.
+# Every thread writes to its own rows, and sums are taken in a fixed order, so results don't depend on the number of threads.
+# box is the side of a periodic container, whose separations are taken to the nearest image, or 0 for no periodic container.
+
+@cython.cdivision(True)
+cdef inline double _nearest_image(double separation, double box) noexcept nogil:
+    """
+    Component of a separation wrapped to the nearest periodic image, as in Container.minimum_image.
+    """
+    if box > 0:
+        return separation - box * floor(separation / box + 0.5)
+    return separation
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _verlet_kernel(double[:, ::1] pos, double[:, ::1] v, double[:, ::1] force, double[:, ::1] prev_force,
+                         unsigned char[::1] has_prev_force, unsigned char[::1] movable, double[::1] w,
+                         double dt, double previous_dt, int num_threads) noexcept nogil:
+    """
+    One velocity Verlet step of every particle in a single pass, with the same arithmetic as VelocityVerlet.step.
+    w is the inverse mass of each particle, 0 for fixed particles.
+    """
+    cdef Py_ssize_t i, k
+    cdef double f, f_prev
+    cdef double kick = 0.5 * previous_dt
+    cdef double drift = 0.5 * dt * dt
+    for i in prange(pos.shape[0], num_threads=num_threads, schedule='static'):
+        for k in range(3):
+            f = force[i, k]
+            if has_prev_force[i]:
+                f_prev = prev_force[i, k]
+            else:
+                f_prev = f
+            v[i, k] = v[i, k] + (f + f_prev) * w[i] * kick
+            pos[i, k] = pos[i, k] + f * w[i] * drift
+            pos[i, k] = pos[i, k] + v[i, k] * movable[i] * dt
+            prev_force[i, k] = f
+        has_prev_force[i] = 1
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline bint _touching(double[:, ::1] pos, double[::1] radius, double[::1] w, Py_ssize_t i, Py_ssize_t j,
+                           double box) noexcept nogil:
+    """
+    Whether particles i and j overlap, and at least one of them can move.
+    """
+    cdef Py_ssize_t k
+    cdef double diff
+    cdef double distance_squared = 0.
+    cdef double contact = radius[i] + radius[j]
+    for k in range(3):
+        diff = _nearest_image(pos[i, k] - pos[j, k], box)
+        distance_squared += diff * diff
+    return 0 < distance_squared <= contact * contact and w[i] + w[j] > 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline Py_ssize_t _resolve_pair(double[:, ::1] pos, double[:, ::1] v, double[::1] radius, double[::1] w,
+                                     Py_ssize_t i, Py_ssize_t j, double box, double* virial) noexcept nogil:
+    """
+    If particles i and j overlap and are moving towards each other, changes their velocities as in an elastic collision,
+    separating them so they no longer overlap. Returns 1 if they collided, 0 otherwise.
+    Sets virial to the separation of the particles dotted with the momentum given to particle i, 0 if they didn't collide.
+    """
+    cdef Py_ssize_t k
+    cdef double diff[3]
+    cdef double distance_squared = 0.
+    cdef double distance, contact, total_w, u_1, u_2, z, overlap, axis
+    virial[0] = 0.
+    for k in range(3):
+        diff[k] = _nearest_image(pos[i, k] - pos[j, k], box)
+        distance_squared += diff[k] * diff[k]
+    contact = radius[i] + radius[j]
+    if distance_squared > contact * contact:
+        return 0
+    distance = sqrt(distance_squared)
+    total_w = w[i] + w[j]
+    if distance <= 0 or total_w <= 0:
+        return 0
+    u_1 = 0.
+    u_2 = 0.
+    for k in range(3):
+        u_1 += v[i, k] * diff[k]
+        u_2 += v[j, k] * diff[k]
+    # Only pairs which are moving towards each other collide.
+    if not u_1 < u_2:
+        return 0
+    u_1 /= distance
+    u_2 /= distance
+    # Velocity of the centre of mass along the axis of collision
+    z = (u_1 * w[j] + u_2 * w[i]) / total_w
+    overlap = max(contact - distance, 0.) / total_w
+    for k in range(3):
+        axis = diff[k] / distance
+        v[i, k] += axis * 2 * (z - u_1)
+        v[j, k] += axis * 2 * (z - u_2)
+        pos[i, k] += axis * overlap * w[i]
+        pos[j, k] -= axis * overlap * w[j]
+    # The momentum given to particle i is 2 (u_2 - u_1) / total_w along the axis.
+    virial[0] = distance * 2 * (u_2 - u_1) / total_w
+    return 1
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _touching_kernel(double[:, ::1] pos, double[::1] radius, double[::1] w,
+                           Py_ssize_t[::1] first, Py_ssize_t[::1] second, double box, unsigned char[::1] touching,
+                           int num_threads) noexcept nogil:
+    """
+    Marks which of the candidate pairs overlap.
+    """
+    cdef Py_ssize_t pair
+    for pair in prange(first.shape[0], num_threads=num_threads, schedule='static'):
+        touching[pair] = _touching(pos, radius, w, first[pair], second[pair], box)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _collision_rounds(Py_ssize_t[::1] first, Py_ssize_t[::1] second, Py_ssize_t[::1] next_round,
+                                  Py_ssize_t[::1] rounds) noexcept nogil:
+    """
+    Splits the pairs into rounds in which no particle appears twice, each pair going in the round after the last one
+    holding either of its particles. Handling the rounds one after another then gives exactly the same result as handling
+    the pairs one after another, while the pairs of a round can be handled at the same time.
+    next_round should be zero for every particle. Returns the number of rounds.
+    """
+    cdef Py_ssize_t pair, i, j, r
+    cdef Py_ssize_t n_rounds = 0
+    for pair in range(first.shape[0]):
+        i = first[pair]
+        j = second[pair]
+        r = max(next_round[i], next_round[j])
+        rounds[pair] = r
+        next_round[i] = r + 1
+        next_round[j] = r + 1
+        n_rounds = max(n_rounds, r + 1)
+    return n_rounds
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _collision_kernel(double[:, ::1] pos, double[:, ::1] v, double[::1] radius, double[::1] w,
+                                  Py_ssize_t[::1] first, Py_ssize_t[::1] second, Py_ssize_t[::1] round_start,
+                                  double box, double[::1] virial, int num_threads) noexcept nogil:
+    """
+    Responds to the collisions of the pairs, which are sorted into rounds by _collision_rounds,
+    with round r holding pairs round_start[r] to round_start[r + 1]. w is the inverse mass of each particle, 0 for fixed particles.
+    Sets the virial of each pair, as given by _resolve_pair. Returns the number of collisions.
+    """
+    cdef Py_ssize_t r, pair, start, end
+    cdef Py_ssize_t collisions = 0
+    for r in range(round_start.shape[0] - 1):
+        start = round_start[r]
+        end = round_start[r + 1]
+        for pair in prange(start, end, num_threads=num_threads, schedule='static'):
+            collisions += _resolve_pair(pos, v, radius, w, first[pair], second[pair], box, &virial[pair])
+    return collisions
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef Py_ssize_t _plane_wall_kernel(double[:, ::1] pos, double[:, ::1] v, double[::1] radius, unsigned char[::1] movable,
+                                   double[::1] mass, double[::1] point, double[::1] normal, double[::1] impulse,
+                                   int num_threads) noexcept nogil:
+    """
+    Reflects the particles overlapping a plane wall and moving into it, reversing the component of their velocity along its normal
+    and mirroring their position in the plane at a distance of their radius from the wall, as if they had bounced off it during the step.
+    Sets impulse to the momentum each particle gives the wall. Returns the number of particles reflected.
+    """
+    cdef Py_ssize_t i, k
+    cdef double distance, normal_v
+    cdef Py_ssize_t reflected = 0
+    for i in prange(pos.shape[0], num_threads=num_threads, schedule='static'):
+        impulse[i] = 0.
+        if not movable[i]:
+            continue
+        distance = 0.
+        normal_v = 0.
+        for k in range(3):
+            distance = distance + (pos[i, k] - point[k]) * normal[k]
+            normal_v = normal_v + v[i, k] * normal[k]
+        if distance < radius[i] and normal_v < 0:
+            for k in range(3):
+                v[i, k] = v[i, k] - 2 * normal_v * normal[k]
+                pos[i, k] = pos[i, k] + 2 * (radius[i] - distance) * normal[k]
+            impulse[i] = -2 * normal_v * mass[i]
+            reflected += 1
+    return reflected
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline void _spring_force(double[:, ::1] pos, double[:, ::1] v, Py_ssize_t i, Py_ssize_t j,
+                               double k, double l0, double damping, double box, double[::1] out) noexcept nogil:
+    """
+    Force of a spring between particles i and j on particle i.
+    """
+    cdef Py_ssize_t c
+    cdef double axis[3]
+    cdef double length_squared = 0.
+    cdef double length, magnitude
+    cdef double relative_v = 0.
+    for c in range(3):
+        axis[c] = _nearest_image(pos[j, c] - pos[i, c], box)
+        length_squared += axis[c] * axis[c]
+    length = sqrt(length_squared)
+    if length > 0:
+        for c in range(3):
+            axis[c] /= length
+    for c in range(3):
+        relative_v += (v[j, c] - v[i, c]) * axis[c]
+    magnitude = k * (length - l0) + damping * relative_v
+    for c in range(3):
+        out[c] = axis[c] * magnitude
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _spring_kernel(double[:, ::1] pos, double[:, ::1] v, Py_ssize_t[::1] first, Py_ssize_t[::1] second,
+                         double[::1] k, double[::1] l0, double[::1] damping, double box, double[:, ::1] spring_force,
+                         int num_threads) noexcept nogil:
+    """
+    Finds the force of each spring on the particle at its first end, the same as SpringNetwork.add_forces.
+    """
+    cdef Py_ssize_t s
+    for s in prange(first.shape[0], num_threads=num_threads, schedule='static'):
+        _spring_force(pos, v, first[s], second[s], k[s], l0[s], damping[s], box, spring_force[s])
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline double _ordered_sum(double[:, ::1] values, Py_ssize_t[::1] rows, Py_ssize_t start, Py_ssize_t end,
+                                Py_ssize_t column) noexcept nogil:
+    """
+    Sum of values[rows[start:end], column], in order.
+    """
+    cdef Py_ssize_t e
+    cdef double total = 0.
+    for e in range(start, end):
+        total += values[rows[e], column]
+    return total
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _gather_kernel(double[:, ::1] pair_force, Py_ssize_t[::1] plus_start, Py_ssize_t[::1] plus,
+                         Py_ssize_t[::1] minus_start, Py_ssize_t[::1] minus, double[:, ::1] force, int num_threads) noexcept nogil:
+    """
+    Adds to each particle i the forces pair_force[plus[plus_start[i]:plus_start[i + 1]]],
+    less the forces pair_force[minus[minus_start[i]:minus_start[i + 1]]], summing each in order.
+    """
+    cdef Py_ssize_t i, c
+    for i in prange(force.shape[0], num_threads=num_threads, schedule='static'):
+        for c in range(3):
+            force[i, c] = force[i, c] + (_ordered_sum(pair_force, plus, plus_start[i], plus_start[i + 1], c)
+                                         - _ordered_sum(pair_force, minus, minus_start[i], minus_start[i + 1], c))
+
+
 class _BaseObject(object):
+    # Attributes are kept in slots rather than a dictionary, so that subclasses with slots of their own, such as Particle, stay small.
+    __slots__ = ('notification_center', '_pending_changes', '_changes', '_color', '_alpha')
+
     # Getters and setters for certain properties so that visualization is only updated if it has changed.
     @property
     def color(self):
@@ -115,8 +385,7 @@ class _BaseObject(object):
     @color.setter
     def color(self, color):
         self._color = color
-        self.notification_center.post_notification(sender=self,
-                                                  with_name="color_changed")
+        self._post_change("color_changed")
 
     @property
     def alpha(self):
@@ -124,39 +393,128 @@ class _BaseObject(object):
     @alpha.setter
     def alpha(self, alpha):
         self._alpha = alpha
-        self.notification_center.post_notification(sender=self,
-                                                  with_name="alpha_changed")
+        self._post_change("alpha_changed")
 
-    def __init__(self):
-        self.notification_center = nc.NotificationCenter()
+    def __init__(self, visualize=True):
+        # Objects which aren't visualized have no notification center, and don't tell anything when their properties change.
+        self.notification_center = nc.NotificationCenter() if visualize else None
+        # List of the system that batches this object's changes, None to post them straight away,
+        # and the names of the changes made since they were last dispatched.
+        self._pending_changes = None
+        self._changes = None
+
+    def _post_change(self, name):
+        """
+        Tells observers that a property has changed, straight away, or when the next frame is drawn if the object's changes are batched.
+        Parameters
+        ----------
+        name: string
+            Name of the notification, e.g. "color_changed"
+        """
+        if self.notification_center is None:
+            return
+        if self._pending_changes is None:
+            self.notification_center.post_notification(sender=self, with_name=name)
+        elif self._changes is None:
+            self._changes = [name]
+            self._pending_changes.append(self)
+        elif name not in self._changes:
+            self._changes.append(name)
+
+
+def _store_backed(field, doc, convert=None):
+    """
+    Creates a property for a quantity that lives in a row of an array of a store (a ParticleStore for particles,
+    a SpringNetwork for springs) when the object is bound to one, and in a private attribute of the object otherwise.
+    Parameters
+    ----------
+    field: string
+        Name of the store's array holding the quantity
+    doc: string
+        Docstring of the property
+    convert: function
+        Converts values stored in the private attribute, by default ParticleStore._convert for the field
+    """
+    private = '_' + field
+    if convert is None:
+        convert = lambda value: ParticleStore._convert(field, value)
+
+    def getter(self):
+        if self._store is not None:
+            return getattr(self._store, field)[self._index]
+        return getattr(self, private)
+
+    def setter(self, value):
+        if self._store is not None:
+            getattr(self._store, field)[self._index] = value
+        else:
+            setattr(self, private, convert(value))
+
+    return property(getter, setter, doc=doc)
 
 
 class Particle(_BaseObject):
     """
     Class representing a particle, which can be attached to a spring.
     Not tied to any visualisation method.
+    Once the particle is part of a System, its state is held in the system's ParticleStore,
+    and properties such as pos and v return views onto rows of the store's arrays.
+    Particles keep their attributes in slots, so new attributes can only be added to subclasses.
     """
+    __slots__ = ('_store', '_index', '_pos', '_v', '_force', '_prev_force', '_inv_mass', '_radius', '_q', '_fixed', '_make_trail',
+                 'applied_force', '_visualized', '_pointer_assigned',
+                 'initial_v', 'initial_pos', 'prev_pos', 'prev_v', 'max_point', 'min_point')
+
+    pos = _store_backed('pos', "Position of the particle as a 3 element numpy array")
+    v = _store_backed('v', "Velocity of the particle as a 3 element numpy array")
+    total_force = _store_backed('force', "Total force felt by the particle in the current step")
+    inv_mass = _store_backed('inv_mass', "Inverse mass of the particle")
+    q = _store_backed('q', "Charge on the particle")
+    fixed = _store_backed('fixed', "Whether the particle can move or not")
+
+    @property
+    def prev_force(self):
+        """Total force felt by the particle in the previous step, None if no step has been taken yet."""
+        if self._store is not None:
+            if not self._store.has_prev_force[self._index]:
+                return None
+            return self._store.prev_force[self._index]
+        return self._prev_force
+    @prev_force.setter
+    def prev_force(self, prev_force):
+        if self._store is not None:
+            self._store.has_prev_force[self._index] = prev_force is not None
+            if prev_force is not None:
+                self._store.prev_force[self._index] = prev_force
+        elif prev_force is not None:
+            self._prev_force = ParticleStore._convert('prev_force', prev_force)
+        else:
+            self._prev_force = None
+
     @property
     def make_trail(self):
         return self._make_trail
     @make_trail.setter
     def make_trail(self, make_trail):
         self._make_trail = make_trail
-        self.notification_center.post_notification(sender=self,
-                                                  with_name="make_trail_changed")
+        self._post_change("make_trail_changed")
 
     @property
     def radius(self):
+        if self._store is not None:
+            return self._store.radius[self._index]
         return self._radius
     @radius.setter
     def radius(self, radius):
-        self._radius = radius
-        self.notification_center.post_notification(sender=self,
-                                                  with_name="radius_changed")
+        if self._store is not None:
+            self._store.radius[self._index] = radius
+        else:
+            self._radius = radius
+        self._post_change("radius_changed")
 
     def __init__(self, pos=None, v=None, radius=1.,
         inv_mass=0., color=None, alpha=1., fixed=False, applied_force=no_force,
-        q = 0., make_trail=False):
+        q = 0., make_trail=False, visualize=True):
         """
         Parameters
         ----------
@@ -180,16 +538,21 @@ class Particle(_BaseObject):
             Charge on particle
         make_trail: boolean
             Whether the particle will make a trail or not
+        visualize: boolean
+            Whether the particle may be visualized. If False, it has no notification center, so changes to its properties aren't shown.
         """
-        _BaseObject.__init__(self)
+        _BaseObject.__init__(self, visualize)
+        # Store and row this particle is a view of, None until a System binds it.
+        self._store = None
+        self._index = None
         if pos is not None:
             self.pos = pos
         else:
-            self.pos = np.array([0, 0, 0])
+            self.pos = np.array([0., 0., 0.])
         if v is not None:
             self.v = v
         else:
-            self.v = np.array([0, 0, 0])
+            self.v = np.array([0., 0., 0.])
         self.inv_mass = inv_mass
         self._radius = radius
         if color is not None:
@@ -200,17 +563,18 @@ class Particle(_BaseObject):
         self._alpha = alpha
         self.fixed = fixed
         self.applied_force = applied_force
-        self.total_force = np.array([0, 0, 0])
-        self.prev_force = None
-        self.max_point = np.array([None])
-        self.min_point = np.array([None])
+        self.total_force = np.array([0., 0., 0.])
+        self._prev_force = None
         self._visualized = False  # Used in visualisation
         self._pointer_assigned = False  # Used when looking at forces using pointers
         self.q = q
-        self.initial_v = _duplicate_vector(self.v)
-        self.initial_pos = _duplicate_vector(self.pos)
-        self.prev_pos = _duplicate_vector(self.pos)
-        self.prev_v = _duplicate_vector(self.v)
+        # Views of the state used to find cycles and amplitudes of oscillation, set when a system follows its oscillations
+        self.initial_v = None
+        self.initial_pos = None
+        self.prev_pos = None
+        self.prev_v = None
+        self.max_point = None
+        self.min_point = None
 
     def update(self, dt):
         """
@@ -226,7 +590,8 @@ class Particle(_BaseObject):
         else:
             self.v += (dt * (self.total_force)) * self.inv_mass
             self.pos += (self.v * dt) + ((0.5 * self.total_force * self.inv_mass) * (dt**2))
-        self.prev_force = _duplicate_vector(self.total_force)
+        # The setter copies the force, into the store's prev_force row if the particle is bound to one.
+        self.prev_force = self.total_force
 
     def force_on(self, other, if_at=None):
         """
@@ -240,7 +605,7 @@ class Particle(_BaseObject):
         if_at: numpy array
             If this parameter is used, the function gives the force the 'other' particle would feel if it were at this position
         """
-        if not if_at:
+        if if_at is None:
             if_at = other.pos
         position_difference = if_at - self.pos
         determinant = np.sqrt(np.inner(position_difference, position_difference))
@@ -255,15 +620,309 @@ class Particle(_BaseObject):
         """
         Property which gives the amplitude of oscillation. Depends on external thing to set max_point and min_point.
         """
-        if self.max_point.any() and self.min_point.any():
+        if self.max_point is not None and self.min_point is not None and not np.isnan(self.max_point[0]):
             _amplitude = np.linalg.norm(self.max_point - self.min_point)
             return _amplitude
         return None
 
 
+class ParticleStore(object):
+    """
+    Structure-of-arrays storage for the state of a collection of particles.
+    Each quantity is held in one contiguous array with a row per particle, so that a whole system
+    can be advanced with vectorized operations instead of looping over Particle objects.
+    Particles bound to a store become lightweight views onto their rows.
+    """
+    # dtype and per-particle shape of each of the arrays held in a store
+    _fields = {'pos': (float, (3,)),
+               'v': (float, (3,)),
+               'force': (float, (3,)),
+               'prev_force': (float, (3,)),
+               'inv_mass': (float, ()),
+               'radius': (float, ()),
+               'q': (float, ()),
+               'fixed': (bool, ())}
+
+    @property
+    def n(self):
+        """Number of particles in the store."""
+        return len(self.particles)
+
+    @property
+    def movable(self):
+        """Boolean mask of the particles that are not fixed."""
+        return np.logical_not(self.fixed)
+
+    def __init__(self, particles=None):
+        """
+        Parameters
+        ----------
+        particles: array of Particles
+            Particles whose state is moved into this store, which then become views of rows of the store.
+        """
+        self.particles = []
+        self._allocate(0)
+        if particles is not None:
+            self.bind(particles)
+
+    def __len__(self):
+        return self.n
+
+    @staticmethod
+    def _convert(field, value):
+        """
+        Converts a value to the type the store uses for the given field,
+        used for the private copies of particles that are not bound to a store.
+        """
+        dtype, shape = ParticleStore._fields[field]
+        if shape:
+            return np.array(value, dtype=dtype)
+        return dtype(value)
+
+    def _allocate(self, n):
+        """
+        Allocates zeroed arrays for n particles.
+        """
+        for field, (dtype, shape) in self._fields.items():
+            setattr(self, field, np.zeros((n,) + shape, dtype=dtype))
+        # Whether prev_force holds a force yet, as Particle.update treats the first step differently
+        self.has_prev_force = np.zeros(n, dtype=bool)
+
+    def bind(self, particles):
+        """
+        Copies the state of the given particles into the store, replacing whatever it held before,
+        and makes each particle a view of its row.
+        Parameters
+        ----------
+        particles: array of Particles
+            Particles to bind, row i of every array belongs to particles[i]
+        """
+        particles = list(particles)
+        self._allocate(len(particles))
+        # Gather first, as particles may currently be views of another store.
+        for index, particle in enumerate(particles):
+            self.pos[index] = particle.pos
+            self.v[index] = particle.v
+            self.force[index] = particle.total_force
+            if particle.prev_force is not None:
+                self.prev_force[index] = particle.prev_force
+                self.has_prev_force[index] = True
+            self.inv_mass[index] = particle.inv_mass
+            self.radius[index] = particle.radius
+            self.q[index] = particle.q
+            self.fixed[index] = particle.fixed
+        for index, particle in enumerate(particles):
+            particle._store = self
+            particle._index = index
+            for field in self._fields:
+                setattr(particle, '_' + field, None)
+        self.particles = particles
+
+    def release(self):
+        """
+        Detaches the particles still bound to this store, giving each one its own copy of its state.
+        """
+        for index, particle in enumerate(self.particles):
+            if particle._store is self:
+                particle._store = None
+                particle._index = None
+                for field in self._fields:
+                    setattr(particle, '_' + field, self._convert(field, getattr(self, field)[index]))
+                if not self.has_prev_force[index]:
+                    particle._prev_force = None
+        self.particles = []
+        self._allocate(0)
+
+
+class Wall(object):
+    """
+    Base class of the walls of containers, described by the signed distance of points from the wall.
+    Subclass and override signed_distance to make walls of other shapes.
+    """
+    def __init__(self, area=None):
+        """
+        Parameters
+        ----------
+        area: float
+            Area of the wall, used to find the pressure on it. None if not known.
+        """
+        self.area = area
+
+    def signed_distance(self, pos):
+        """
+        Gives the distance of each point from the wall, positive on the side particles are kept on and negative past the wall,
+        and the unit normal of the wall nearest each point, pointing towards the side particles are kept on.
+        Parameters
+        ----------
+        pos: numpy array
+            N x 3 array of positions
+        """
+        raise NotImplementedError
+
+    def reflect(self, pos, v, radius, movable, mass, threads=1):
+        """
+        Reflects the particles overlapping the wall and moving into it, reversing the component of their velocity along its normal
+        and mirroring their position so they are as far from the wall as if they had bounced off it. Changes pos and v in place.
+        Returns the momentum given to the wall and the number of particles reflected.
+        Parameters
+        ----------
+        pos, v: numpy array
+            N x 3 arrays of the positions and velocities of the particles
+        radius, mass: numpy array
+            Radii and masses of the particles
+        movable: numpy array of booleans
+            Which particles can move, the others are left alone
+        threads: integer
+            Number of threads walls with compiled loops may use
+        """
+        distance, normal = self.signed_distance(pos)
+        normal_v = np.einsum('ij,ij->i', v, normal)
+        hit = np.flatnonzero(movable & (distance < radius) & (normal_v < 0))
+        if not len(hit):
+            return 0., 0
+        normal = normal[hit]
+        v[hit] -= 2 * normal_v[hit, np.newaxis] * normal
+        pos[hit] += 2 * (radius[hit] - distance[hit])[:, np.newaxis] * normal
+        return -2 * np.dot(normal_v[hit], mass[hit]), len(hit)
+
+
+class PlaneWall(Wall):
+    """
+    Flat wall through a point, keeping particles on the side its normal points towards.
+    """
+    def __init__(self, point, normal, area=None):
+        """
+        Parameters
+        ----------
+        point: numpy array
+            A point on the wall
+        normal: numpy array
+            Normal of the wall, pointing towards the side particles are kept on
+        area: float
+            Area of the wall
+        """
+        Wall.__init__(self, area)
+        self.point = np.asarray(point, dtype=float)
+        self.normal = normalized(np.asarray(normal, dtype=float))
+
+    def signed_distance(self, pos):
+        distance = np.dot(pos - self.point, self.normal)
+        return distance, np.broadcast_to(self.normal, (len(distance), 3))
+
+    def reflect(self, pos, v, radius, movable, mass, threads=1):
+        cdef double[:, ::1] pos_view = pos
+        cdef double[:, ::1] v_view = v
+        cdef double[::1] radius_view = radius
+        cdef unsigned char[::1] movable_view = movable.view(np.uint8)
+        cdef double[::1] mass_view = mass
+        cdef double[::1] point = np.ascontiguousarray(self.point)
+        cdef double[::1] normal = np.ascontiguousarray(self.normal)
+        impulse = np.empty(len(pos))
+        cdef double[::1] impulse_view = impulse
+        cdef int num_threads = threads
+        cdef Py_ssize_t reflected
+        with nogil:
+            reflected = _plane_wall_kernel(pos_view, v_view, radius_view, movable_view, mass_view, point, normal, impulse_view, num_threads)
+        return impulse.sum(), reflected
+
+
+class SphereWall(Wall):
+    """
+    Wall of a sphere, keeping particles inside it.
+    """
+    def __init__(self, centre, radius):
+        """
+        Parameters
+        ----------
+        centre: numpy array
+            Centre of the sphere
+        radius: float
+            Radius of the sphere
+        """
+        Wall.__init__(self, 4 * np.pi * radius**2)
+        self.centre = np.asarray(centre, dtype=float)
+        self.radius = radius
+
+    def signed_distance(self, pos):
+        outwards = pos - self.centre
+        length = np.sqrt(np.einsum('ij,ij->i', outwards, outwards))
+        # Points at the centre are given any normal
+        normal = -outwards / np.where(length > 0, length, 1.)[:, np.newaxis]
+        normal[length == 0, 0] = 1.
+        return self.radius - length, normal
+
+
+class CylinderWall(Wall):
+    """
+    Curved wall of a cylinder, keeping particles inside it. The cylinder is infinitely long, so is closed with plane walls.
+    """
+    def __init__(self, centre, axis, radius, length=None):
+        """
+        Parameters
+        ----------
+        centre: numpy array
+            A point on the axis of the cylinder
+        axis: numpy array
+            Direction of the axis
+        radius: float
+            Radius of the cylinder
+        length: float
+            Length of the cylinder, used for the area of the wall
+        """
+        Wall.__init__(self, None if length is None else 2 * np.pi * radius * length)
+        self.centre = np.asarray(centre, dtype=float)
+        self.axis = normalized(np.asarray(axis, dtype=float))
+        self.radius = radius
+
+    def signed_distance(self, pos):
+        outwards = pos - self.centre
+        outwards -= np.outer(np.dot(outwards, self.axis), self.axis)
+        length = np.sqrt(np.einsum('ij,ij->i', outwards, outwards))
+        # Points on the axis are given any normal perpendicular to it
+        normal = -outwards / np.where(length > 0, length, 1.)[:, np.newaxis]
+        normal[length == 0] = normalized(_perpendicular_vector(self.axis))
+        return self.radius - length, normal
+
+
+class Partition(Wall):
+    """
+    Flat wall inside a container, which particles bounce off from either side, with an optional circular hole they can pass through.
+    """
+    def __init__(self, point, normal, area=None, hole_radius=0.):
+        """
+        Parameters
+        ----------
+        point: numpy array
+            A point on the partition, the centre of the hole if there is one
+        normal: numpy array
+            Normal of the partition
+        area: float
+            Area of the partition, counting one side
+        hole_radius: float
+            Radius of the hole around point. Particles whose centres are over the hole pass through the partition.
+        """
+        Wall.__init__(self, area)
+        self.point = np.asarray(point, dtype=float)
+        self.normal = normalized(np.asarray(normal, dtype=float))
+        self.hole_radius = hole_radius
+
+    def signed_distance(self, pos):
+        relative_pos = pos - self.point
+        height = np.dot(relative_pos, self.normal)
+        # Particles are on the side of the partition their centres are on
+        normal = np.where((height < 0)[:, np.newaxis], -self.normal, self.normal)
+        distance = np.abs(height)
+        if self.hole_radius > 0:
+            lateral = relative_pos - np.outer(height, self.normal)
+            over_hole = np.einsum('ij,ij->i', lateral, lateral) < self.hole_radius**2
+            distance[over_hole] = np.inf
+        return distance, normal
+
+
 class Container(_BaseObject):
     """
     Class describing a cubic box which particles can be in.
+    Particles bounce off its walls, or if it is periodic, leave through one side to come back in through the opposite side.
     """
     @property
     def dimension(self):
@@ -274,8 +933,7 @@ class Container(_BaseObject):
     def dimension(self, dimension):
         """Setter so that we know when dimensions have changed"""
         self._dimension = dimension
-        self.notification_center.post_notification(sender=self,
-                                                  with_name="dimension_changed")
+        self._post_change("dimension_changed")
 
 
     # Getters and setters for certain properties so that visualization is only updated if it has changed.
@@ -294,7 +952,32 @@ class Container(_BaseObject):
         """Property which describes the total surface area of the container"""
         return 6 * (self.dimension)**2
 
-    def __init__(self, dimension, pos=None, color=None, alpha=0.3):
+    @property
+    def volume(self):
+        """Property which describes the volume of the container"""
+        return self.dimension**3
+
+    @property
+    def walls(self):
+        """
+        Property which gives the walls bounding the container, as a list of Wall.
+        The walls of a cube are the planes at the lower and upper ends of each axis in turn, so wall index // 2 is the axis.
+        A periodic container has no walls.
+        """
+        if self.periodic:
+            return []
+        key = (self.dimension, tuple(self.pos))
+        if self._walls_key != key:
+            lower = self._origin_pos
+            upper = lower + self.dimension
+            area = self.dimension**2
+            self._walls = []
+            for axis in np.eye(3):
+                self._walls += [PlaneWall(lower, axis, area), PlaneWall(upper, -axis, area)]
+            self._walls_key = key
+        return self._walls
+
+    def __init__(self, dimension, pos=None, color=None, alpha=0.3, periodic=False, partitions=None, visualize=True):
         """
         Parameters
         ----------
@@ -306,13 +989,25 @@ class Container(_BaseObject):
             Color of particle, given in form [R G B], default 1,1,1
         alpha: float
             Alpha of particle, 1 is completely opaque, 0 is completely transparent, used in visualisation
+        periodic: boolean
+            Whether the container has periodic boundaries instead of walls. Particles leaving it come back in on the opposite side,
+            and particles interact with the nearest periodic image of each other, so a small system behaves like part of a bulk one.
+        partitions: array of Partition
+            Walls inside the container which particles bounce off from either side, e.g. to divide it in two
+        visualize: boolean
+            Whether the container may be visualized. If False, it has no notification center, so changes to its properties aren't shown.
         """
-        _BaseObject.__init__(self)
+        _BaseObject.__init__(self, visualize)
         if pos is not None:
             self.pos = pos
         else:
             self.pos = np.array([0, 0, 0])
         self._dimension = dimension
+        self.periodic = periodic
+        if periodic and partitions:
+            raise ValueError("Periodic containers can't have partitions")
+        self.partitions = list(partitions) if partitions else []
+        self._walls_key = None
         if color is not None:
             self._color = color
         else:
@@ -324,87 +1019,275 @@ class Container(_BaseObject):
         """
         Returns True if is inside container.
         Returns the index of the axis along which it is outside the container if it is outside the container
+        Particles are always inside periodic containers.
         Parameters
         ----------
         particle: Particle
             Particle which is being checked to see if inside container or not
         """
+        if self.periodic:
+            return True
         relative_pos = particle.pos - self._origin_pos
         for i in range(0, 3):
             if relative_pos[i] > self.dimension - particle.radius or relative_pos[i] < particle.radius:
                 return i
         return True
 
+    def fits(self, pos, radius):
+        """
+        Returns a boolean array of whether spheres of the given radius at each position are inside the container,
+        without overlapping its walls or partitions.
+        Parameters
+        ----------
+        pos: numpy array
+            N x 3 array of positions
+        radius: float or numpy array
+            Radius of the spheres
+        """
+        pos = np.atleast_2d(pos)
+        inside = np.ones(len(pos), dtype=bool)
+        for wall in self.walls + self.partitions:
+            inside &= wall.signed_distance(pos)[0] >= radius
+        return inside
+
+    def minimum_image(self, separation):
+        """
+        Gives the separations wrapped to the nearest periodic image, so each component is between -dimension/2 and dimension/2.
+        Separations are returned unchanged if the container isn't periodic.
+        Parameters
+        ----------
+        separation: numpy array
+            Separation, or N x 3 array of separations, between pairs of points
+        """
+        if not self.periodic:
+            return separation
+        return separation - self.dimension * np.floor(separation / self.dimension + 0.5)
 
-class _Domain(Container):
-    def __init__(self, pos, dimension):
+    def wrap(self, pos):
         """
-        Class used for collision detection, by splitting up containers into small domains.
+        Moves the points outside a periodic container back into it, by whole multiples of its dimension along each axis.
+        Changes pos in place. Does nothing if the container isn't periodic.
         Parameters
         ----------
         pos: numpy array
-            Position of 'origin' of domain, i.e. lower left corner of domain.
-        dimension : float
-            The length of each side of a domain.
+            N x 3 array of positions
         """
-        l2 = dimension / 2
-        Container.__init__(self, dimension, pos=pos + np.array([l2, l2, l2]), alpha=0.)
-        self.particles = []
+        if not self.periodic:
+            return
+        origin = self._origin_pos
+        pos -= self.dimension * np.floor((pos - origin) / self.dimension)
+
+
+class _ShapedContainer(Container):
+    """
+    Base class of containers which aren't cubes. Their dimension is the side of the smallest cube around them,
+    centred on pos, which is used to search for collisions and to place particles.
+    """
+    def __init__(self, dimension, pos=None, color=None, alpha=0.3, partitions=None, visualize=True):
+        Container.__init__(self, dimension, pos, color, alpha, partitions=partitions, visualize=visualize)
 
     def contains(self, particle):
         """
         Returns True if is inside container.
-        Returns the index of the axis along which it is outside the container if it is outside the container
+        Returns the index in walls of the first wall it overlaps if it is outside the container.
         Parameters
         ----------
         particle: Particle
             Particle which is being checked to see if inside container or not
         """
-        relative_pos = particle.pos - self._origin_pos
-        for i in range(0, 3):
-            if relative_pos[i] > self.dimension or relative_pos[i] < 0:
-                return i
+        pos = np.asarray(particle.pos, dtype=float)[np.newaxis]
+        for index, wall in enumerate(self.walls):
+            if wall.signed_distance(pos)[0][0] < particle.radius:
+                return index
         return True
 
 
-class Spring(_BaseObject):
+class SphericalContainer(_ShapedContainer):
     """
-    Class representing a spring. Not tied to any visualisation method.
+    Class describing a spherical container which particles can be in, and bounce off the inside of.
     """
+    @property
+    def radius(self):
+        """Property which stores the radius of the sphere"""
+        return self.dimension / 2.
+
+    @radius.setter
+    def radius(self, radius):
+        self.dimension = 2 * radius
 
     @property
-    def axis(self):
-        """
-        Property giving the axis, i.e. the vector showing the orientation and length of the spring.
-        """
-        return (self.particle_2.pos - self.particle_1.pos)
+    def surface_area(self):
+        """Property which describes the total surface area of the container"""
+        return 4 * np.pi * self.radius**2
 
     @property
-    def pos(self):
+    def volume(self):
+        """Property which describes the volume of the container"""
+        return 4. / 3. * np.pi * self.radius**3
+
+    @property
+    def walls(self):
+        """Property which gives the wall of the sphere, as a list of one SphereWall"""
+        key = (self.radius, tuple(self.pos))
+        if self._walls_key != key:
+            self._walls = [SphereWall(self.pos, self.radius)]
+            self._walls_key = key
+        return self._walls
+
+    def __init__(self, radius, pos=None, color=None, alpha=0.3, partitions=None, visualize=True):
         """
-        Property giving the position of one of the ends of the spring.
+        Parameters
+        ----------
+        radius: float
+            Radius of the sphere
+        pos: numpy array
+            Position of centre of sphere, default 0,0,0
+        color: array
+            Color of container, given in form [R G B], default 1,1,1
+        alpha: float
+            Alpha of container, 1 is completely opaque, 0 is completely transparent, used in visualisation
+        partitions: array of Partition
+            Walls inside the container which particles bounce off from either side
+        visualize: boolean
+            Whether the container may be visualized. If False, it has no notification center, so changes to its properties aren't shown.
         """
-        return self.particle_1.pos
+        _ShapedContainer.__init__(self, 2 * radius, pos, color, alpha, partitions, visualize)
 
+
+class CylindricalContainer(_ShapedContainer):
+    """
+    Class describing a closed cylindrical container which particles can be in, and bounce off the inside of.
+    """
     @property
     def radius(self):
+        """Property which stores the radius of the cylinder"""
         return self._radius
+
     @radius.setter
     def radius(self, radius):
         self._radius = radius
-        self.notification_center.post_notification(sender=self,
-                                                  with_name="radius_changed")
+        self._post_change("dimension_changed")
+
+    @property
+    def length(self):
+        """Property which stores the length of the cylinder"""
+        return self._length
+
+    @length.setter
+    def length(self, length):
+        self._length = length
+        self._post_change("dimension_changed")
+
+    @property
+    def axis(self):
+        """Property which stores the unit vector along the axis of the cylinder"""
+        return self._axis
+
+    @axis.setter
+    def axis(self, axis):
+        self._axis = normalized(np.asarray(axis, dtype=float))
+        self._post_change("dimension_changed")
+
+    @property
+    def dimension(self):
+        """Property which gives the side of the smallest cube, aligned with the axes, around the cylinder"""
+        extent = self.length * np.abs(self.axis) + 2 * self.radius * np.sqrt(np.clip(1 - self.axis**2, 0., 1.))
+        return extent.max()
+
+    @property
+    def surface_area(self):
+        """Property which describes the total surface area of the container"""
+        return 2 * np.pi * self.radius * (self.length + self.radius)
+
+    @property
+    def volume(self):
+        """Property which describes the volume of the container"""
+        return np.pi * self.radius**2 * self.length
 
-    def __init__(self, particle_1, particle_2, k, l0=None, radius=0.5, color=None, alpha=1.):
+    @property
+    def walls(self):
+        """Property which gives the walls of the cylinder, the curved CylinderWall followed by the PlaneWall at each end"""
+        key = (self.radius, self.length, tuple(self.axis), tuple(self.pos))
+        if self._walls_key != key:
+            end = self.axis * self.length / 2.
+            end_area = np.pi * self.radius**2
+            self._walls = [CylinderWall(self.pos, self.axis, self.radius, self.length),
+                           PlaneWall(self.pos - end, self.axis, end_area), PlaneWall(self.pos + end, -self.axis, end_area)]
+            self._walls_key = key
+        return self._walls
+
+    def __init__(self, radius, length, pos=None, axis=None, color=None, alpha=0.3, partitions=None, visualize=True):
         """
         Parameters
         ----------
-        particle_1: Particle object
-            Particle on one end of spring
-        particle_2: Particle object
-            Particle on other end of spring
-        k: float
-            The spring constant of the spring (F = kx)
+        radius: float
+            Radius of the cylinder
+        length: float
+            Length of the cylinder
+        pos: numpy array
+            Position of centre of cylinder, default 0,0,0
+        axis: numpy array
+            Direction of the axis of the cylinder, default 0,0,1
+        color: array
+            Color of container, given in form [R G B], default 1,1,1
+        alpha: float
+            Alpha of container, 1 is completely opaque, 0 is completely transparent, used in visualisation
+        partitions: array of Partition
+            Walls inside the container which particles bounce off from either side
+        visualize: boolean
+            Whether the container may be visualized. If False, it has no notification center, so changes to its properties aren't shown.
+        """
+        self._radius = radius
+        self._length = length
+        self._axis = normalized(np.array([0., 0., 1.]) if axis is None else np.asarray(axis, dtype=float))
+        _ShapedContainer.__init__(self, None, pos, color, alpha, partitions, visualize)
+
+
+class Spring(_BaseObject):
+    """
+    Class representing a spring. Not tied to any visualisation method.
+    Once the spring is part of a System, its constants are held in the system's SpringNetwork,
+    and k, l0 and damping read and write rows of the network's arrays.
+    Springs keep their attributes in slots, so new attributes can only be added to subclasses.
+    """
+    __slots__ = ('_store', '_index', 'particle_1', 'particle_2', '_k', '_l0', '_damping', '_radius', '_visualized')
+
+    k = _store_backed('k', "The spring constant of the spring (F = kx)", float)
+    l0 = _store_backed('l0', "Original length of the spring", float)
+    damping = _store_backed('damping', "Damping coefficient, giving a force along the spring proportional to the rate the spring stretches", float)
+
+    @property
+    def axis(self):
+        """
+        Property giving the axis, i.e. the vector showing the orientation and length of the spring.
+        """
+        return (self.particle_2.pos - self.particle_1.pos)
+
+    @property
+    def pos(self):
+        """
+        Property giving the position of one of the ends of the spring.
+        """
+        return self.particle_1.pos
+
+    @property
+    def radius(self):
+        return self._radius
+    @radius.setter
+    def radius(self, radius):
+        self._radius = radius
+        self._post_change("radius_changed")
+
+    def __init__(self, particle_1, particle_2, k, l0=None, radius=0.5, color=None, alpha=1., damping=0., visualize=True):
+        """
+        Parameters
+        ----------
+        particle_1: Particle object
+            Particle on one end of spring
+        particle_2: Particle object
+            Particle on other end of spring
+        k: float
+            The spring constant of the spring (F = kx)
         l0: float
             Original length of the spring
         radius: float
@@ -413,83 +1296,2264 @@ class Spring(_BaseObject):
             Color of particle, given in form [R G B]
         alpha: float
             Alpha of particle, 1 is completely opaque, 0 is completely transparent, used in visualisation
+        damping: float
+            Damping coefficient, giving a force along the spring proportional to the rate the spring stretches
+        visualize: boolean
+            Whether the spring may be visualized. If False, it has no notification center, so changes to its properties aren't shown.
+        """
+        _BaseObject.__init__(self, visualize)
+        # Network and row this spring is a view of, None until a System binds it.
+        self._store = None
+        self._index = None
+        self.particle_1 = particle_1
+        self.particle_2 = particle_2
+        self.k = k
+        self.damping = damping
+        self._alpha = alpha
+        if color is not None:
+            self._color = color
+        else:
+            self._color = [1, 1, 1]
+        self._visualized = False
+        self._radius = radius
+        if l0:
+            self.l0 = l0
+        else:
+            self.l0 = np.linalg.norm(self.particle_1.pos - self.particle_2.pos)
+
+    def force_on(self, particle, if_at=np.array([None])):
+        """
+        Given an arbitary particle, gives the force on that particle. No force if the spring isn't connected to that particle.
+        Parameters
+        ----------
+        particle: Particle object
+            Particle which feels the force
+        if_at: NumPy Array
+            If this parameter is used, this gives the force felt if the particle were at this position.
+        """
+        if not if_at.any():
+            if_at = particle.pos
+        if particle == self.particle_1:
+            other = self.particle_2
+        elif particle == self.particle_2:
+            other = self.particle_1
+        else:
+            return np.array([0, 0, 0])
+        x = np.linalg.norm(if_at - other.pos) - self.l0
+        axis = normalized(other.pos - if_at)
+        return axis * (self.k * x + self.damping * np.inner(other.v - particle.v, axis))
+
+
+class SpringNetwork(object):
+    """
+    Edge list storage for a collection of springs, holding the indices of the two particles of each spring in a ParticleStore,
+    and the constants of each spring, in arrays. This lets the forces of all the springs be computed at once.
+    Springs bound to a network read and write their constants from its rows.
+    If container is a periodic Container, each spring joins the nearest periodic images of its particles.
+    """
+    # Arrays held per spring, as well as first and second, the indices of the particles at either end
+    _fields = ('k', 'l0', 'damping')
+
+    @property
+    def n(self):
+        """Number of springs in the network."""
+        return len(self.springs)
+
+    def __init__(self, springs=None, store=None):
+        """
+        Parameters
+        ----------
+        springs: array of Springs
+            Springs to bind to the network
+        store: ParticleStore
+            Store holding the particles the springs are attached to
+        """
+        self.springs = []
+        self.store = None
+        self.container = None
+        self._allocate(0)
+        if springs is not None:
+            self.bind(springs, store)
+
+    def __len__(self):
+        return self.n
+
+    def _allocate(self, n):
+        """
+        Allocates zeroed arrays for n springs.
+        """
+        self.first = np.zeros(n, dtype=np.intp)
+        self.second = np.zeros(n, dtype=np.intp)
+        for field in self._fields:
+            setattr(self, field, np.zeros(n))
+        self._spring_force = np.zeros((n, 3))
+        self._incidence = None
+
+    def bind(self, springs, store):
+        """
+        Copies the constants of the springs into the network, and makes each spring a view of its row.
+        Parameters
+        ----------
+        springs: array of Springs
+            Springs to bind, row i of every array belongs to springs[i]
+        store: ParticleStore
+            Store holding the particles the springs are attached to, which all need to be bound to it
+        """
+        springs = list(springs)
+        self._allocate(len(springs))
+        for index, spring in enumerate(springs):
+            for end, particle in (('first', spring.particle_1), ('second', spring.particle_2)):
+                if particle._store is not store:
+                    raise ValueError("Spring is attached to a particle which isn't part of the system")
+                getattr(self, end)[index] = particle._index
+            for field in self._fields:
+                getattr(self, field)[index] = getattr(spring, field)
+        for index, spring in enumerate(springs):
+            spring._store = self
+            spring._index = index
+            for field in self._fields:
+                setattr(spring, '_' + field, None)
+        self.springs = springs
+        self.store = store
+
+    def release(self):
+        """
+        Detaches the springs still bound to this network, giving each one its own copy of its constants.
+        """
+        for index, spring in enumerate(self.springs):
+            if spring._store is self:
+                spring._store = None
+                spring._index = None
+                for field in self._fields:
+                    setattr(spring, '_' + field, float(getattr(self, field)[index]))
+        self.springs = []
+        self.store = None
+        self._allocate(0)
+
+    def add_forces(self, force, threads=1):
+        """
+        Computes the forces of all the springs at once, and adds them onto the particles at both ends of each spring.
+        Parameters
+        ----------
+        force: numpy array
+            N x 3 array of the total force on each particle of the store, to which the spring forces are added
+        threads: integer
+            Number of threads the springs and particles are split between. The result is the same for any number of threads.
+        """
+        if not self.n:
+            return
+        store = self.store
+        plus_start, plus, minus_start, minus = self._particle_springs()
+        cdef double[:, ::1] pos = store.pos
+        cdef double[:, ::1] v = store.v
+        cdef Py_ssize_t[::1] first = self.first
+        cdef Py_ssize_t[::1] second = self.second
+        cdef double[::1] k = np.ascontiguousarray(self.k)
+        cdef double[::1] l0 = np.ascontiguousarray(self.l0)
+        cdef double[::1] damping = np.ascontiguousarray(self.damping)
+        cdef double[:, ::1] spring_force = self._spring_force
+        cdef Py_ssize_t[::1] plus_start_view = plus_start
+        cdef Py_ssize_t[::1] plus_view = plus
+        cdef Py_ssize_t[::1] minus_start_view = minus_start
+        cdef Py_ssize_t[::1] minus_view = minus
+        cdef double[:, ::1] force_view = force
+        cdef double box = self._box()
+        cdef int num_threads = threads
+        with nogil:
+            _spring_kernel(pos, v, first, second, k, l0, damping, box, spring_force, num_threads)
+            _gather_kernel(spring_force, plus_start_view, plus_view, minus_start_view, minus_view, force_view, num_threads)
+
+    def _box(self):
+        """
+        Gives the side of the periodic container, or 0 if there isn't one.
+        """
+        if self.container is not None and self.container.periodic:
+            return float(self.container.dimension)
+        return 0.
+
+    def _axes(self):
+        """
+        Gives the vector from the first to the second end of each spring.
+        """
+        axis = self.store.pos[self.second] - self.store.pos[self.first]
+        if self.container is not None:
+            axis = self.container.minimum_image(axis)
+        return axis
+
+    def _particle_springs(self):
+        """
+        Gives, for each particle, the springs whose first end it is and the springs whose second end it is,
+        as offsets into arrays of spring indices sorted by particle. Kept until the network is rebound.
+        """
+        n = self.store.n
+        if self._incidence is None or len(self._incidence[0]) != n + 1:
+            incidence = []
+            for end in (self.first, self.second):
+                start = np.zeros(n + 1, dtype=np.intp)
+                start[1:] = np.cumsum(np.bincount(end, minlength=n))
+                incidence += [start, np.argsort(end, kind='mergesort').astype(np.intp)]
+            self._incidence = tuple(incidence)
+        return self._incidence
+
+    def potential_energy(self):
+        """
+        Gives the total elastic potential energy stored in all the springs.
+        """
+        if not self.n:
+            return 0.
+        axis = self._axes()
+        length = np.sqrt(np.einsum('ij,ij->i', axis, axis))
+        return 0.5 * np.sum(self.k * (length - self.l0)**2)
+
+    def jacobians(self):
+        """
+        Gives the derivatives of the spring forces on all the particles with respect to their positions and velocities,
+        as two sparse 3N x 3N matrices, where rows and columns 3i, 3i + 1, 3i + 2 belong to particle i of the store.
+        The small change of the direction of the damping force as a spring rotates is neglected.
+        """
+        import scipy.sparse
+        size = 3 * self.store.n
+        if not self.n:
+            empty = scipy.sparse.csr_matrix((size, size))
+            return empty, empty
+        axis = self._axes()
+        length = np.sqrt(np.einsum('ij,ij->i', axis, axis))
+        stretched = length > 0
+        axis[stretched] /= length[stretched, np.newaxis]
+        ratio = np.zeros(self.n)
+        ratio[stretched] = self.l0[stretched] / length[stretched]
+        projection = axis[:, :, np.newaxis] * axis[:, np.newaxis, :]
+        identity = np.eye(3)[np.newaxis, :, :]
+        # Derivative of the force on the first particle with respect to the position of the second, and the damping equivalent
+        stiffness = self.k[:, np.newaxis, np.newaxis] * (projection + (1 - ratio)[:, np.newaxis, np.newaxis] * (identity - projection))
+        damping = self.damping[:, np.newaxis, np.newaxis] * projection
+        return self._assemble(stiffness, size), self._assemble(damping, size)
+
+    def _assemble(self, blocks, size):
+        """
+        Assembles a sparse matrix from the 3 x 3 block of each spring, giving the derivative of the force on one end of the spring
+        with respect to the other end. The derivatives with respect to the same end are the negative of this.
+        """
+        import scipy.sparse
+        rows = []
+        columns = []
+        data = []
+        offsets = np.arange(3)
+        for row_particle, column_particle, sign in ((self.first, self.second, 1.), (self.second, self.first, 1.),
+                                                    (self.first, self.first, -1.), (self.second, self.second, -1.)):
+            rows.append(np.broadcast_to(3 * row_particle[:, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis], blocks.shape).ravel())
+            columns.append(np.broadcast_to(3 * column_particle[:, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :], blocks.shape).ravel())
+            data.append(sign * blocks.ravel())
+        return scipy.sparse.coo_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(columns))),
+                                       shape=(size, size)).tocsr()
+
+
+class PointerArrow(_BaseObject):
+    """
+    Class representing an arrow/pointer, that isn't tied to any specific visualization method/library.
+    """
+
+    @property
+    def shaftwidth(self):
+        return self._shaftwidth
+    @shaftwidth.setter
+    def shaftwidth(self, shaftwidth):
+        self._shaftwidth = shaftwidth
+        self._post_change("shaftwidth_changed")
+
+    def __init__(self, pos, axis, shaftwidth=1, color=None, alpha=1, visualize=True):
+        """
+        Parameters
+        ----------
+        pos: numpy array
+            Location of tail end of pointer
+        axis: numpy array
+            A vector giving the length and orientation of the pointer
+        shaftwidth: float
+            The width of the pointer's shaft
+        color: array
+            Color of particle, given in form [R G B], default 1, 1, 1
+        alpha: float
+            Alpha of particle, 1 is completely opaque, 0 is completely transparent, used in visualisation
+        visualize: boolean
+            Whether the pointer may be visualized. If False, it has no notification center, so changes to its properties aren't shown.
+        """
+        _BaseObject.__init__(self, visualize)
+        self.pos = pos
+        self.axis = axis
+        self._shaftwidth = shaftwidth
+        self._alpha = alpha
+        if color is not None:
+            self._color = color
+        else:
+            self._color = [1, 1, 1]
+        self._visualized = False
+
+
+class _CellList(object):
+    """
+    Uniform grid broad phase for finding pairs of particles that are close to each other.
+    Particles are binned by integer cell index with a single sort,
+    and candidate pairs are taken from each cell and its 26 neighbouring cells.
+    In a periodic box, the cells on opposite faces of the grid are neighbours.
+    """
+    # The cell itself and half of its 26 neighbours, so that each pair of neighbouring cells is only visited once.
+    _offsets = np.array([[0, 0, 0]] + [[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)
+                                       if (i, j, k) > (0, 0, 0)])
+
+    def pairs(self, pos, cell_size, lower=None, upper=None, periodic=False):
+        """
+        Returns two arrays of indices i, j of all the pairs of points in the same or neighbouring cells, each pair once.
+        Any pair of points closer than cell_size is guaranteed to be among them, or closer than cell_size
+        to a periodic image of each other if periodic.
+        Parameters
+        ----------
+        pos: numpy array
+            N x 3 array of positions
+        cell_size: float
+            Smallest length of the sides of the cells. Larger cells are used when there are many more cells than points.
+        lower: numpy array
+            Lower corner of the grid, by default the lower corner of the bounding box of the points
+        upper: numpy array
+            Upper corner of the grid, by default the upper corner of the bounding box of the points
+        periodic: boolean
+            Whether the grid is a periodic box from lower to upper, which must then be given
+        """
+        n = len(pos)
+        if n < 2:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        if lower is None:
+            lower = pos.min(axis=0)
+        if upper is None:
+            upper = pos.max(axis=0)
+        extent = np.maximum(np.asarray(upper, dtype=float) - lower, 0.)
+        # Keep the number of cells small enough for the cell keys to fit into 64 bit integers,
+        # and not much more than the number of points, so that a table of cells can be used.
+        cell_size = max(cell_size, extent.max() / 2**20, (np.prod(extent) / (4. * n))**(1. / 3))
+        if periodic:
+            # Cells fit a whole number of times into the box. With fewer than 3 cells along an axis,
+            # neighbouring cells would be counted twice, and every pair is close anyway.
+            dims = np.maximum((extent // cell_size).astype(np.int64), 1)
+            if (dims < 3).any():
+                return np.triu_indices(n, 1)
+            cells = ((pos - lower) // (extent / dims)).astype(np.int64) % dims
+        else:
+            dims = (extent // cell_size).astype(np.int64) + 1
+            cells = np.clip(((pos - lower) // cell_size).astype(np.int64), 0, dims - 1)
+        keys = self._keys(cells, dims)
+        order = np.argsort(keys, kind='mergesort')
+        sorted_keys = keys[order]
+        rank = np.empty(n, dtype=np.intp)
+        rank[order] = np.arange(n)
+        n_cells = int(np.prod(dims))
+        if n_cells <= 8 * n:
+            # Few enough cells for a table of where each cell starts in the sorted order, which is much faster than searching.
+            cell_counts = np.bincount(keys, minlength=n_cells)
+            cell_start = np.cumsum(cell_counts) - cell_counts
+        else:
+            cell_start = None
+
+        first = []
+        second = []
+        for offset in self._offsets:
+            if not offset.any():
+                # Pairs within the same cell, taking only the particles after this one in the sorted order
+                start = rank + 1
+                if cell_start is not None:
+                    end = cell_start[keys] + cell_counts[keys]
+                else:
+                    end = np.searchsorted(sorted_keys, keys, side='right')
+                owners = np.arange(n)
+            else:
+                neighbours = cells + offset
+                if periodic:
+                    owners = np.arange(n)
+                    neighbour_keys = self._keys(neighbours % dims, dims)
+                else:
+                    valid = np.all((neighbours >= 0) & (neighbours < dims), axis=1)
+                    owners = np.flatnonzero(valid)
+                    neighbour_keys = self._keys(neighbours[owners], dims)
+                if cell_start is not None:
+                    start = cell_start[neighbour_keys]
+                    end = start + cell_counts[neighbour_keys]
+                else:
+                    start = np.searchsorted(sorted_keys, neighbour_keys, side='left')
+                    end = np.searchsorted(sorted_keys, neighbour_keys, side='right')
+            counts = end - start
+            total = counts.sum()
+            if total == 0:
+                continue
+            # For each owner, the sorted positions start, start + 1, ..., end - 1
+            repeated_start = np.repeat(start - np.cumsum(counts) + counts, counts)
+            first.append(np.repeat(owners, counts))
+            second.append(order[repeated_start + np.arange(total)])
+        if not first:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        return np.concatenate(first), np.concatenate(second)
+
+    @staticmethod
+    def _keys(cells, dims):
+        """
+        Gives a unique integer key for each integer cell coordinate.
+        """
+        return (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+
+class ForceEngine(object):
+    """
+    Base class for engines which compute the forces particles exert on each other via the fields they emit,
+    used by a System when interacts is True.
+    Subclass and override add_forces to implement other ways of computing these forces.
+    """
+    def add_forces(self, system, force):
+        """
+        Adds the forces the particles of the system exert on each other onto the given force array.
+        Parameters
+        ----------
+        system: System
+            System whose particles interact
+        force: numpy array
+            N x 3 array of the total force on each particle, to which the interaction forces are added
+        """
+        raise NotImplementedError
+
+    def potential_energy(self, system):
+        """
+        Gives the total potential energy of the interactions between the particles of the system.
+        Parameters
+        ----------
+        system: System
+            System whose particles interact
+        """
+        raise NotImplementedError
+
+
+class PairwiseForces(ForceEngine):
+    """
+    Calls Particle.force_on for every ordered pair of particles.
+    Slow, but works with any subclass of Particle which overrides force_on.
+    In a periodic container, each particle feels the force of the nearest periodic image of every other particle.
+    """
+    def add_forces(self, system, force):
+        container = system.container
+        periodic = container is not None and container.periodic
+        for index, particle in enumerate(system.particles):
+            if not particle.fixed:
+                for other_particle in system.particles:
+                    if particle is not other_particle:
+                        if periodic:
+                            if_at = other_particle.pos + container.minimum_image(particle.pos - other_particle.pos)
+                            force[index] += other_particle.force_on(particle, if_at=if_at)
+                        else:
+                            force[index] += other_particle.force_on(particle)
+
+
+def _masses(inv_mass):
+    """
+    Gives masses from inverse masses, which are infinite where the inverse mass is 0.
+    """
+    with np.errstate(divide='ignore'):
+        return 1. / inv_mass
+
+
+def gravity(separation, distance, q_1, q_2, inv_mass_1, inv_mass_2, G=1.):
+    """
+    Pair force kernel giving the gravitational force, the same force as the default Particle.force_on.
+    Like all pair force kernels, takes arrays describing a list of pairs of particles, and returns the force on the first particle of each pair
+    from the second, as an array with a row per pair.
+    Parameters
+    ----------
+    separation: numpy array
+        Position of the first particle minus the position of the second particle of each pair
+    distance: numpy array
+        Distance between the particles of each pair
+    q_1, q_2: numpy array
+        Charges of the first and second particles of each pair
+    inv_mass_1, inv_mass_2: numpy array
+        Inverse masses of the first and second particles of each pair
+    G: float
+        Gravitational constant
+    """
+    with np.errstate(divide='ignore'):
+        scale = -G / (inv_mass_1 * inv_mass_2 * distance**3)
+    return separation * scale[:, np.newaxis]
+
+
+def coulomb(separation, distance, q_1, q_2, inv_mass_1, inv_mass_2, k=1.):
+    """
+    Pair force kernel giving the electrostatic force between the charges q of the particles.
+    Parameters
+    ----------
+    k: float
+        Coulomb's constant
+    """
+    return separation * (k * q_1 * q_2 / distance**3)[:, np.newaxis]
+
+
+def lennard_jones(separation, distance, q_1, q_2, inv_mass_1, inv_mass_2, epsilon=1., sigma=1.):
+    """
+    Pair force kernel giving the force from the Lennard-Jones potential 4 epsilon ((sigma/r)^12 - (sigma/r)^6).
+    Parameters
+    ----------
+    epsilon: float
+        Depth of the potential well
+    sigma: float
+        Distance at which the potential is zero
+    """
+    ratio_6 = (sigma / distance)**6
+    return separation * (24 * epsilon * (2 * ratio_6**2 - ratio_6) / distance**2)[:, np.newaxis]
+
+
+def yukawa(separation, distance, q_1, q_2, inv_mass_1, inv_mass_2, coupling=1., screening_length=1.):
+    """
+    Pair force kernel giving the force from the screened Coulomb (Yukawa) potential coupling q_1 q_2 exp(-r/screening_length) / r.
+    Parameters
+    ----------
+    coupling: float
+        Strength of the interaction
+    screening_length: float
+        Length over which the interaction is screened
+    """
+    scale = coupling * q_1 * q_2 * np.exp(-distance / screening_length) * (1 + distance / screening_length) / distance**3
+    return separation * scale[:, np.newaxis]
+
+
+def gravity_potential(distance, q_1, q_2, inv_mass_1, inv_mass_2, G=1.):
+    """
+    Potential energy of each pair for the gravity kernel.
+    Like all pair potentials, takes the same arguments as its kernel apart from the separations, and returns an array with a value per pair.
+    """
+    with np.errstate(divide='ignore'):
+        return -G / (inv_mass_1 * inv_mass_2 * distance)
+
+
+def coulomb_potential(distance, q_1, q_2, inv_mass_1, inv_mass_2, k=1.):
+    """
+    Potential energy of each pair for the coulomb kernel.
+    """
+    return k * q_1 * q_2 / distance
+
+
+def lennard_jones_potential(distance, q_1, q_2, inv_mass_1, inv_mass_2, epsilon=1., sigma=1.):
+    """
+    Potential energy of each pair for the lennard_jones kernel.
+    """
+    ratio_6 = (sigma / distance)**6
+    return 4 * epsilon * (ratio_6**2 - ratio_6)
+
+
+def yukawa_potential(distance, q_1, q_2, inv_mass_1, inv_mass_2, coupling=1., screening_length=1.):
+    """
+    Potential energy of each pair for the yukawa kernel.
+    """
+    return coupling * q_1 * q_2 * np.exp(-distance / screening_length) / distance
+
+
+# Vectorized pair force kernels which can be referred to by name when creating a PairForce.
+PAIR_FORCES = {}
+# Potentials of the kernels which have one, keyed by kernel function.
+PAIR_POTENTIALS = {}
+
+
+def register_pair_force(name, kernel, potential=None):
+    """
+    Registers a pair force kernel so that it can be referred to by name when creating a PairForce.
+    Parameters
+    ----------
+    name: string
+        Name of the kernel
+    kernel: function taking arguments of: separation, distance, q_1, q_2, inv_mass_1, inv_mass_2 and any parameters as keyword arguments
+        Vectorized function giving the force on the first particle of each pair from the second, as an array with a row per pair.
+    potential: function taking arguments of: distance, q_1, q_2, inv_mass_1, inv_mass_2 and the same parameters as the kernel
+        Vectorized function giving the potential energy of each pair, None if the kernel has no potential.
+    """
+    PAIR_FORCES[name] = kernel
+    if potential is not None:
+        PAIR_POTENTIALS[kernel] = potential
+    return kernel
+
+
+register_pair_force('gravity', gravity, gravity_potential)
+register_pair_force('coulomb', coulomb, coulomb_potential)
+register_pair_force('lennard_jones', lennard_jones, lennard_jones_potential)
+register_pair_force('yukawa', yukawa, yukawa_potential)
+
+
+class PairForce(object):
+    """
+    A pair force kernel together with its parameters and an optional cutoff radius.
+    """
+    def __init__(self, kernel, cutoff=None, **parameters):
+        """
+        Parameters
+        ----------
+        kernel: string or function
+            Name of a kernel in PAIR_FORCES, or a kernel function
+        cutoff: float
+            Distance beyond which the force is ignored, None for no cutoff.
+            Forces with a cutoff are found using neighbour lists, so are much faster to compute.
+        parameters:
+            Keyword arguments passed on to the kernel, e.g. epsilon and sigma for "lennard_jones"
+        """
+        if not callable(kernel):
+            if kernel not in PAIR_FORCES:
+                raise ValueError("Unknown pair force '{0}', choose one of {1}".format(kernel, sorted(PAIR_FORCES)))
+            kernel = PAIR_FORCES[kernel]
+        self.kernel = kernel
+        self.cutoff = cutoff
+        self.parameters = parameters
+
+    def __call__(self, separation, distance, q_1, q_2, inv_mass_1, inv_mass_2):
+        return self.kernel(separation, distance, q_1, q_2, inv_mass_1, inv_mass_2, **self.parameters)
+
+    def potential(self, distance, q_1, q_2, inv_mass_1, inv_mass_2):
+        """
+        Gives the potential energy of each pair, raising NotImplementedError if the kernel has no registered potential.
+        """
+        if self.kernel not in PAIR_POTENTIALS:
+            raise NotImplementedError("Pair force kernel {0} has no potential".format(self.kernel.__name__))
+        return PAIR_POTENTIALS[self.kernel](distance, q_1, q_2, inv_mass_1, inv_mass_2, **self.parameters)
+
+
+_thread_pools = {}
+
+
+def _thread_pool(threads):
+    """
+    Gives a pool of the given number of threads, shared by all systems using that many threads.
+    """
+    if threads not in _thread_pools:
+        import atexit
+        from multiprocessing.pool import ThreadPool
+        _thread_pools[threads] = ThreadPool(threads)
+        atexit.register(_thread_pools[threads].terminate)
+    return _thread_pools[threads]
+
+
+def _add_block_forces(system, force, blocks, add_block):
+    """
+    Adds the forces from each block of work onto the force array, calling add_block(block, force) for each block,
+    split between system.threads threads. If system.deterministic, the forces of each block are summed into their own array,
+    and these are added onto the force array in the order of the blocks, so the result is the same for any number of threads.
+    Otherwise, blocks are added on as soon as they are done, which is slightly faster.
+    """
+    threads = system.threads
+    if threads <= 1 and not system.deterministic:
+        for block in blocks:
+            add_block(block, force)
+        return
+
+    def block_forces(block):
+        partial_force = np.zeros_like(force)
+        add_block(block, partial_force)
+        return partial_force
+
+    if threads <= 1:
+        for block in blocks:
+            force += block_forces(block)
+        return
+    pool = _thread_pool(threads)
+    blocks = iter(blocks)
+    while True:
+        # A few blocks at a time, to limit the memory used
+        wave = [block for __, block in zip(range(threads), blocks)]
+        if not wave:
+            break
+        if system.deterministic:
+            partial_forces = pool.map(block_forces, wave)
+        else:
+            partial_forces = pool.imap_unordered(block_forces, wave)
+        for partial_force in partial_forces:
+            force += partial_force
+
+
+def _scatter_pair_forces(force, i, j, pair_force):
+    """
+    Adds the force on the first particle of each pair, and the opposite force on the second one, to the force array.
+    """
+    n = len(force)
+    for k in range(3):
+        force[:, k] += np.bincount(i, pair_force[:, k], n) - np.bincount(j, pair_force[:, k], n)
+
+
+class DirectSummation(ForceEngine):
+    """
+    Forces between pairs of particles given by vectorized pair force kernels, gravity by default.
+    Each pair is only computed once, with Newton's third law giving the force on the other particle.
+    Forces without a cutoff are computed for every pair in blocks, and forces with a cutoff are computed using a neighbour list.
+    In a periodic container, separations are taken to the nearest periodic image, so forces without a cutoff
+    only count the nearest image of each particle.
+    """
+    def __init__(self, pair_forces=None, softening=0., block_size=2**20, skin=0.):
+        """
+        Parameters
+        ----------
+        pair_forces: array of PairForces or kernel names
+            Forces acting between every pair of particles, by default just gravity
+        softening: float
+            Softening length added in quadrature to the separations, to avoid infinite forces in close encounters
+        block_size: integer
+            Rough number of pairs computed at once, which limits the memory used
+        skin: float
+            Extra distance beyond the cutoff kept in the neighbour list, which is then only rebuilt
+            once some particle has moved more than half of this distance
+        """
+        if pair_forces is None:
+            pair_forces = ['gravity']
+        self.pair_forces = [pair_force if isinstance(pair_force, PairForce) else PairForce(pair_force)
+                            for pair_force in pair_forces]
+        self.softening = softening
+        self.block_size = block_size
+        self.skin = skin
+        self._cell_list = _CellList()
+        self._neighbours = None
+
+    def add_forces(self, system, force):
+        store = system.store
+        container = system.container
+        long_range = [pair_force for pair_force in self.pair_forces if pair_force.cutoff is None]
+        short_range = [pair_force for pair_force in self.pair_forces if pair_force.cutoff is not None]
+        if long_range:
+            _add_block_forces(system, force, self._all_pairs(store.n),
+                              lambda pairs, block_force: self.add_pair_forces(store, pairs[0], pairs[1], block_force,
+                                                                              long_range, container))
+        if short_range:
+            i, j = self.neighbour_list(store, max(pair_force.cutoff for pair_force in short_range), container)
+            blocks = ((i[start:start + self.block_size], j[start:start + self.block_size])
+                      for start in range(0, len(i), self.block_size))
+            _add_block_forces(system, force, blocks,
+                              lambda pairs, block_force: self.add_pair_forces(store, pairs[0], pairs[1], block_force,
+                                                                              short_range, container))
+
+    def potential_energy(self, system):
+        store = system.store
+        container = system.container
+        energy = 0.
+        long_range = [pair_force for pair_force in self.pair_forces if pair_force.cutoff is None]
+        short_range = [pair_force for pair_force in self.pair_forces if pair_force.cutoff is not None]
+        if long_range:
+            for i, j in self._all_pairs(store.n):
+                energy += self.pair_potential_energy(store, i, j, long_range, container)
+        if short_range:
+            i, j = self.neighbour_list(store, max(pair_force.cutoff for pair_force in short_range), container)
+            energy += self.pair_potential_energy(store, i, j, short_range, container)
+        return energy
+
+    def pair_potential_energy(self, store, i, j, pair_forces=None, container=None):
+        """
+        Gives the total potential energy of the given pairs of particles. Forces with a cutoff only count pairs within the cutoff.
+        Parameters
+        ----------
+        store: ParticleStore
+            Store holding the particles
+        i, j: numpy array of integers
+            Indices of the first and second particle of each pair, each pair should only be given once
+        pair_forces: array of PairForces
+            Forces whose potentials are summed, by default all of the forces of this engine
+        container: Container
+            Container of the particles, separations are taken to the nearest periodic image if it is periodic
+        """
+        if pair_forces is None:
+            pair_forces = self.pair_forces
+        separation = store.pos[i] - store.pos[j]
+        if container is not None:
+            separation = container.minimum_image(separation)
+        distance = np.sqrt(np.einsum('ij,ij->i', separation, separation) + self.softening**2)
+        apart = distance > 0
+        if not apart.all():
+            i, j, distance = i[apart], j[apart], distance[apart]
+        energy = 0.
+        for pair_force in pair_forces:
+            if pair_force.cutoff is not None:
+                within = distance < pair_force.cutoff
+                pair_i, pair_j, pair_distance = i[within], j[within], distance[within]
+            else:
+                pair_i, pair_j, pair_distance = i, j, distance
+            energy += np.sum(pair_force.potential(pair_distance, store.q[pair_i], store.q[pair_j],
+                                                  store.inv_mass[pair_i], store.inv_mass[pair_j]))
+        return energy
+
+    def add_pair_forces(self, store, i, j, force, pair_forces=None, container=None):
+        """
+        Adds the forces between the given pairs of particles to the force array.
+        Parameters
+        ----------
+        store: ParticleStore
+            Store holding the particles
+        i, j: numpy array of integers
+            Indices of the first and second particle of each pair, each pair should only be given once
+        force: numpy array
+            N x 3 array of the total force on each particle, to which the forces are added
+        pair_forces: array of PairForces
+            Forces to compute, by default all of the forces of this engine
+        container: Container
+            Container of the particles, separations are taken to the nearest periodic image if it is periodic
+        """
+        if pair_forces is None:
+            pair_forces = self.pair_forces
+        separation = store.pos[i] - store.pos[j]
+        if container is not None:
+            separation = container.minimum_image(separation)
+        distance = np.sqrt(np.einsum('ij,ij->i', separation, separation) + self.softening**2)
+        apart = distance > 0
+        if not apart.all():
+            i, j, separation, distance = i[apart], j[apart], separation[apart], distance[apart]
+        for pair_force in pair_forces:
+            if pair_force.cutoff is not None:
+                within = distance < pair_force.cutoff
+                pair_i, pair_j = i[within], j[within]
+                pair_separation, pair_distance = separation[within], distance[within]
+            else:
+                pair_i, pair_j, pair_separation, pair_distance = i, j, separation, distance
+            pair_force_values = pair_force(pair_separation, pair_distance, store.q[pair_i], store.q[pair_j],
+                                           store.inv_mass[pair_i], store.inv_mass[pair_j])
+            _scatter_pair_forces(force, pair_i, pair_j, pair_force_values)
+
+    def neighbour_list(self, store, cutoff, container=None):
+        """
+        Gives all the pairs of particles closer than cutoff + skin, as two arrays of indices, using a cell list.
+        The list is reused until some particle has moved more than half of the skin distance.
+        Parameters
+        ----------
+        store: ParticleStore
+            Store holding the particles
+        cutoff: float
+            Largest cutoff of the forces the list is used for
+        container: Container
+            Container of the particles. If it is periodic, pairs closer than cutoff + skin to a periodic image of each other are given.
+        """
+        periodic = container is not None and container.periodic
+        if self._neighbours is not None:
+            reference_store, reference_cutoff, reference_pos, reference_container, pairs = self._neighbours
+            if (reference_store is store and reference_cutoff == cutoff and reference_container is container
+                    and len(reference_pos) == store.n > 0):
+                displacement = store.pos - reference_pos
+                if container is not None:
+                    displacement = container.minimum_image(displacement)
+                if np.einsum('ij,ij->i', displacement, displacement).max() <= (self.skin / 2)**2:
+                    return pairs
+        reach = cutoff + self.skin
+        if periodic:
+            lower = container._origin_pos
+            i, j = self._cell_list.pairs(store.pos, reach, lower, lower + container.dimension, periodic=True)
+        else:
+            i, j = self._cell_list.pairs(store.pos, reach)
+        separation = store.pos[i] - store.pos[j]
+        if container is not None:
+            separation = container.minimum_image(separation)
+        close = np.einsum('ij,ij->i', separation, separation) < reach**2
+        pairs = (i[close], j[close])
+        self._neighbours = (store, cutoff, store.pos.copy(), container, pairs)
+        return pairs
+
+    def _all_pairs(self, n):
+        """
+        Generates every pair of indices i < j, in blocks of roughly block_size pairs.
+        """
+        rows = max(1, self.block_size // max(n, 1))
+        for start in range(0, n, rows):
+            i = np.arange(start, min(start + rows, n))
+            counts = n - 1 - i
+            total = counts.sum()
+            # For each i, the indices i + 1, ..., n - 1
+            j = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(i + 1, counts)
+            yield np.repeat(i, counts), j
+
+
+def _part_1_by_2(x):
+    """
+    Spreads out the lowest 21 bits of each integer so that there are two zero bits between each of them,
+    used to interleave coordinates into Morton codes.
+    """
+    x = x & np.uint64(0x1fffff)
+    x = (x | x << np.uint64(32)) & np.uint64(0x1f00000000ffff)
+    x = (x | x << np.uint64(16)) & np.uint64(0x1f0000ff0000ff)
+    x = (x | x << np.uint64(8)) & np.uint64(0x100f00f00f00f00f)
+    x = (x | x << np.uint64(4)) & np.uint64(0x10c30c30c30c30c3)
+    x = (x | x << np.uint64(2)) & np.uint64(0x1249249249249249)
+    return x
+
+
+class BarnesHut(ForceEngine):
+    """
+    Gravitational forces between particles, approximated using an octree.
+    A cell of the tree whose size is less than opening_angle times its distance from a particle
+    acts on that particle as a single body at the centre of mass of the cell, which makes computing the forces O(N log(N)).
+    The tree is built and walked with vectorized operations over all the particles at once.
+    """
+    # Number of levels of the tree, the most that fit in a 64 bit Morton code
+    _depth = 21
+
+    def __init__(self, opening_angle=0.5, softening=0., chunk_size=4096):
+        """
+        Parameters
+        ----------
+        opening_angle: float
+            Largest ratio of size to distance of a cell that is treated as a single body. 0 gives direct summation.
+        softening: float
+            Softening length added in quadrature to the separations, to avoid infinite forces in close encounters
+        chunk_size: integer
+            Number of particles whose forces are found at once, which limits the memory used
+        """
+        self.opening_angle = opening_angle
+        self.softening = softening
+        self.chunk_size = chunk_size
+
+    def _build(self, pos, mass):
+        """
+        Builds the octree. Particles are sorted along a Morton curve, so that each cell holds a contiguous range of the sorted particles.
+        Cells of each level are listed in order, so the children of a cell are a contiguous range of the cells of the next level.
+        """
+        n = len(pos)
+        lower = pos.min(axis=0)
+        size = (pos.max(axis=0) - lower).max()
+        if size <= 0:
+            size = 1.
+        size *= 1. + 1e-9
+        cells = np.minimum(((pos - lower) * (2**self._depth / size)).astype(np.uint64), np.uint64(2**self._depth - 1))
+        codes = (_part_1_by_2(cells[:, 0]) << np.uint64(2)) | (_part_1_by_2(cells[:, 1]) << np.uint64(1)) | _part_1_by_2(cells[:, 2])
+        order = np.argsort(codes, kind='mergesort')
+        codes = codes[order]
+        sorted_mass = mass[order]
+        sorted_weighted_pos = pos[order] * sorted_mass[:, np.newaxis]
+
+        starts, ends, levels = [], [], []
+        level_starts = np.zeros(1, dtype=np.intp)
+        for level in range(self._depth + 1):
+            if level > 0:
+                prefix = codes >> np.uint64(3 * (self._depth - level))
+                level_starts = np.concatenate(([0], np.flatnonzero(prefix[1:] != prefix[:-1]) + 1))
+            level_ends = np.append(level_starts[1:], n)
+            starts.append(level_starts)
+            ends.append(level_ends)
+            levels.append(np.full(len(level_starts), level))
+            if (level_ends - level_starts).max() == 1:
+                break
+        # Children of the cells of each level, as indices into the list of all cells
+        offsets = np.cumsum([0] + [len(level_starts) for level_starts in starts])
+        first_child, child_count = [], []
+        for level, (level_starts, level_ends) in enumerate(zip(starts, ends)):
+            if level + 1 < len(starts):
+                first = np.searchsorted(starts[level + 1], level_starts)
+                last = np.searchsorted(starts[level + 1], level_ends)
+                first_child.append(first + offsets[level + 1])
+                child_count.append(np.where(level_ends - level_starts > 1, last - first, 0))
+            else:
+                first_child.append(np.zeros(len(level_starts), dtype=np.intp))
+                child_count.append(np.zeros(len(level_starts), dtype=np.intp))
+
+        self._start = np.concatenate(starts)
+        self._end = np.concatenate(ends)
+        self._first_child = np.concatenate(first_child)
+        self._child_count = np.concatenate(child_count)
+        self._size = size / 2.**np.concatenate(levels)
+        self._mass = np.add.reduceat(sorted_mass, self._start)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._com = np.add.reduceat(sorted_weighted_pos, self._start, axis=0) / self._mass[:, np.newaxis]
+        self._rank = np.empty(n, dtype=np.intp)
+        self._rank[order] = np.arange(n)
+
+    def add_forces(self, system, force):
+        if system.container is not None and system.container.periodic:
+            raise ValueError("BarnesHut doesn't support periodic containers, use DirectSummation")
+        store = system.store
+        if store.n < 2:
+            return
+        pos = store.pos
+        mass = _masses(store.inv_mass)
+        self._build(pos, mass)
+        targets = np.flatnonzero(store.movable)
+        chunks = [targets[chunk_start:chunk_start + self.chunk_size] for chunk_start in range(0, len(targets), self.chunk_size)]
+        # Each chunk only adds onto the forces of its own particles, so chunks can be walked at the same time.
+        if system.threads > 1:
+            _thread_pool(system.threads).map(lambda chunk: self._walk(chunk, pos, mass, force), chunks)
+        else:
+            for chunk in chunks:
+                self._walk(chunk, pos, mass, force)
+
+    def potential_energy(self, system):
+        """
+        Gives the exact gravitational potential energy, by summing over every pair of particles.
+        """
+        return DirectSummation(softening=self.softening).potential_energy(system)
+
+    def _walk(self, targets, pos, mass, force):
+        """
+        Walks down the tree for all the given particles at once, keeping a list of (particle, cell) pairs still to be considered.
+        The forces are summed for the given particles, then added onto their rows of the force array.
+        """
+        n = len(targets)
+        target_force = np.zeros((n, 3))
+        bodies = targets
+        # Index of each body in targets
+        local = np.arange(n)
+        cells = np.zeros(len(targets), dtype=np.intp)
+        theta_squared = self.opening_angle**2
+        while len(bodies):
+            diff = self._com[cells] - pos[bodies]
+            distance_squared = np.einsum('ij,ij->i', diff, diff) + self.softening**2
+            rank = self._rank[bodies]
+            inside = (rank >= self._start[cells]) & (rank < self._end[cells])
+            leaf = self._child_count[cells] == 0
+            accept = ~inside & (leaf | (self._size[cells]**2 < theta_squared * distance_squared)) & (distance_squared > 0)
+            if accept.any():
+                accepted = bodies[accept]
+                scale = mass[accepted] * self._mass[cells[accept]] * distance_squared[accept]**-1.5
+                pair_force = diff[accept] * scale[:, np.newaxis]
+                for k in range(3):
+                    target_force[:, k] += np.bincount(local[accept], pair_force[:, k], n)
+            opened = ~accept & ~leaf
+            counts = self._child_count[cells[opened]]
+            first = self._first_child[cells[opened]]
+            bodies = np.repeat(bodies[opened], counts)
+            local = np.repeat(local[opened], counts)
+            cells = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        force[targets] += target_force
+
+
+# Force engines which can be chosen by name with the force_engine argument of System.
+FORCE_ENGINES = {'pairwise': PairwiseForces,
+                 'direct': DirectSummation,
+                 'barnes_hut': BarnesHut}
+
+
+def _make_force_engine(force_engine):
+    """
+    Returns a ForceEngine instance given either an instance, the name of one in FORCE_ENGINES, or None.
+    """
+    if force_engine is None or isinstance(force_engine, ForceEngine):
+        return force_engine
+    if force_engine not in FORCE_ENGINES:
+        raise ValueError("Unknown force engine '{0}', choose one of {1}".format(force_engine, sorted(FORCE_ENGINES)))
+    return FORCE_ENGINES[force_engine]()
+
+
+class Integrator(object):
+    """
+    Base class for integrators, which advance every particle in a System in one batched operation
+    using the arrays of the system's ParticleStore.
+    Subclass and override step to implement other integration schemes.
+    """
+    def __init__(self):
+        self._size = -1
+        # Size of the last step taken, for schemes which need it when the step size changes
+        self._previous_dt = None
+
+    def _scratch(self, store):
+        """
+        Reallocates the scratch arrays if the number of particles has changed, so that steps don't allocate.
+        Parameters
+        ----------
+        store: ParticleStore
+            Store holding the particles being integrated
+        """
+        if store.n != self._size:
+            self._size = store.n
+            self._allocate(store.n)
+        # Effective inverse mass, zero for fixed particles, and a mask of the particles which can move.
+        np.logical_not(store.fixed, out=self._movable[:, 0])
+        np.multiply(store.inv_mass, self._movable[:, 0], out=self._w[:, 0])
+
+    def _allocate(self, n):
+        """
+        Allocates the scratch arrays used by step, extend this to allocate more.
+        Parameters
+        ----------
+        n: integer
+            Number of particles
+        """
+        self._movable = np.zeros((n, 1), dtype=bool)
+        self._w = np.zeros((n, 1))
+        self._tmp = np.zeros((n, 3))
+
+    def step(self, system, dt):
+        """
+        Advances the positions and velocities of all the particles in the system by one time step,
+        given that store.force holds the forces at the start of the step.
+        Parameters
+        ----------
+        system: System
+            System whose particles are advanced
+        dt: float
+            Size of time step taken
+        """
+        raise NotImplementedError
+
+
+class VelocityVerlet(Integrator):
+    """
+    Velocity Verlet integrator, using the same averaging of the forces of this step and the previous one as Particle.update.
+    The velocity update with the averaged forces completes the previous step, so it uses the size of the previous step,
+    which lets the step size change from one step to the next.
+    """
+    def step(self, system, dt):
+        store = system.store
+        self._scratch(store)
+        # v += 0.5 * dt_prev * (F + F_prev) / m, then x += v * dt + 0.5 * F / m * dt^2, in a compiled loop.
+        # Particles which haven't taken a step yet use their current force as the previous one.
+        cdef double previous_dt = dt if self._previous_dt is None else self._previous_dt
+        cdef double step_dt = dt
+        cdef double[:, ::1] pos = store.pos
+        cdef double[:, ::1] v = store.v
+        cdef double[:, ::1] force = store.force
+        cdef double[:, ::1] prev_force = store.prev_force
+        cdef unsigned char[::1] has_prev_force = store.has_prev_force.view(np.uint8)
+        cdef unsigned char[::1] movable = self._movable[:, 0].view(np.uint8)
+        cdef double[::1] w = self._w[:, 0]
+        cdef int num_threads = system.threads
+        with nogil:
+            _verlet_kernel(pos, v, force, prev_force, has_prev_force, movable, w, step_dt, previous_dt, num_threads)
+        self._previous_dt = dt
+
+
+class SymplecticEuler(Integrator):
+    """
+    Semi-implicit Euler integrator, which updates velocities first and then moves particles with the new velocities.
+    """
+    def step(self, system, dt):
+        store = system.store
+        self._scratch(store)
+        tmp = self._tmp
+        np.multiply(store.force, self._w, out=tmp)
+        tmp *= dt
+        store.v += tmp
+        np.multiply(store.v, self._movable, out=tmp)
+        tmp *= dt
+        store.pos += tmp
+        store.prev_force[...] = store.force
+        store.has_prev_force[...] = True
+
+
+class Leapfrog(Integrator):
+    """
+    Leapfrog integrator, with velocities held half a time step behind positions.
+    The first step a particle takes kicks its velocity by half a step, and later steps kick it by the mean of the sizes
+    of this step and the previous one, so the step size can change from one step to the next.
+    """
+    def step(self, system, dt):
+        store = system.store
+        self._scratch(store)
+        tmp = self._tmp
+        previous_dt = dt if self._previous_dt is None else self._previous_dt
+        np.multiply(store.force, self._w, out=tmp)
+        if store.has_prev_force.all():
+            tmp *= 0.5 * (previous_dt + dt)
+        else:
+            tmp *= np.where(store.has_prev_force, 0.5 * (previous_dt + dt), 0.5 * dt)[:, np.newaxis]
+        store.v += tmp
+        np.multiply(store.v, self._movable, out=tmp)
+        tmp *= dt
+        store.pos += tmp
+        store.prev_force[...] = store.force
+        store.has_prev_force[...] = True
+        self._previous_dt = dt
+
+
+class RungeKutta4(Integrator):
+    """
+    Classical fourth order Runge-Kutta integrator.
+    Calls System.compute_forces three more times per step, at the intermediate positions and velocities.
+    """
+    def _allocate(self, n):
+        Integrator._allocate(self, n)
+        self._pos_0 = np.zeros((n, 3))
+        self._v_0 = np.zeros((n, 3))
+        self._force_0 = np.zeros((n, 3))
+        self._dpos = np.zeros((n, 3))
+        self._dv = np.zeros((n, 3))
+
+    def _stage(self, store, weight, dt):
+        """
+        Adds a stage to the running weighted sums of the derivatives, then sets the particles to the state of the next stage.
+        Parameters
+        ----------
+        store: ParticleStore
+            Store holding the particles being integrated
+        weight: float
+            Weight of this stage in the final sum
+        dt: float
+            Time from the start of the step to the next stage, 0 if this is the last one
+        """
+        tmp = self._tmp
+        # dx/dt = v, dv/dt = F / m, summed with the weights of this stage
+        np.multiply(store.v, weight, out=tmp)
+        self._dpos += tmp
+        np.multiply(store.force, self._w, out=tmp)
+        tmp *= weight
+        self._dv += tmp
+        if dt:
+            # Next stage is at x_0 + dt * v_stage, v_0 + dt * F_stage / m
+            np.multiply(store.v, self._movable, out=tmp)
+            tmp *= dt
+            np.multiply(store.force, self._w, out=store.v)
+            store.v *= dt
+            store.v += self._v_0
+            np.add(self._pos_0, tmp, out=store.pos)
+
+    def step(self, system, dt):
+        store = system.store
+        self._scratch(store)
+        time = system.time
+        self._pos_0[...] = store.pos
+        self._v_0[...] = store.v
+        self._force_0[...] = store.force
+        self._dpos[...] = 0.
+        self._dv[...] = 0.
+        self._stage(store, 1., 0.5 * dt)
+        system.compute_forces(time + 0.5 * dt)
+        self._stage(store, 2., 0.5 * dt)
+        system.compute_forces(time + 0.5 * dt)
+        self._stage(store, 2., dt)
+        system.compute_forces(time + dt)
+        self._stage(store, 1., 0.)
+        # x = x_0 + dt / 6 * (k1 + 2 k2 + 2 k3 + k4), likewise for v
+        self._dpos *= self._movable
+        self._dpos *= dt / 6.
+        np.add(self._pos_0, self._dpos, out=store.pos)
+        self._dv *= dt / 6.
+        np.add(self._v_0, self._dv, out=store.v)
+        store.force[...] = self._force_0
+        store.prev_force[...] = store.force
+        store.has_prev_force[...] = True
+
+
+class ImplicitEuler(Integrator):
+    """
+    Linearly implicit (backward) Euler integrator for stiff spring systems.
+    Spring forces are treated implicitly, by building the sparse Jacobian of the spring forces from the spring network
+    and solving a sparse linear system each step. All other forces are treated explicitly.
+    Stable for stiff springs at much larger time steps than the explicit integrators, at the cost of damping the oscillations.
+    """
+    def step(self, system, dt):
+        import scipy.sparse
+        import scipy.sparse.linalg
+        store = system.store
+        self._scratch(store)
+        network = system.spring_network
+        stiffness, damping = network.jacobians()
+        inv_mass = scipy.sparse.diags(np.repeat(self._w[:, 0], 3))
+        # (I - dt W df/dv - dt^2 W df/dx) dv = dt W (F + dt df/dx v), with W the inverse masses
+        matrix = scipy.sparse.identity(3 * store.n, format='csr') - inv_mass.dot(dt * damping + dt**2 * stiffness)
+        rhs = dt * inv_mass.dot(store.force.ravel() + dt * stiffness.dot(store.v.ravel()))
+        dv = scipy.sparse.linalg.spsolve(matrix.tocsc(), rhs)
+        store.v += dv.reshape(-1, 3)
+        tmp = self._tmp
+        np.multiply(store.v, self._movable, out=tmp)
+        tmp *= dt
+        store.pos += tmp
+        store.prev_force[...] = store.force
+        store.has_prev_force[...] = True
+
+
+# Integrators which can be chosen by name with the integrator argument of System.
+INTEGRATORS = {'verlet': VelocityVerlet,
+               'velocity_verlet': VelocityVerlet,
+               'leapfrog': Leapfrog,
+               'symplectic_euler': SymplecticEuler,
+               'rk4': RungeKutta4,
+               'implicit_euler': ImplicitEuler,
+               'backward_euler': ImplicitEuler}
+
+
+def _make_integrator(integrator):
+    """
+    Returns an Integrator instance given either an instance or the name of one in INTEGRATORS.
+    """
+    if isinstance(integrator, Integrator):
+        return integrator
+    if integrator not in INTEGRATORS:
+        raise ValueError("Unknown integrator '{0}', choose one of {1}".format(integrator, sorted(INTEGRATORS)))
+    return INTEGRATORS[integrator]()
+
+
+class EventDriven(object):
+    """
+    Event-driven dynamics for hard spheres, which move in straight lines between collisions with each other and with
+    the walls of the container. The time of the next collision of each particle is predicted exactly, and collisions
+    are taken from a priority queue in the order in which they happen, so none are missed whatever the density.
+    Only for systems without springs, applied forces or interactions between particles, and with no container or a cubic one
+    which isn't periodic and has no partitions.
+    """
+    def __init__(self):
+        self.particle_collisions = 0    # Number of collisions between particles
+        self.wall_collisions = 0        # Number of collisions with the walls of the container
+        self.wall_impulse = 0.          # Total momentum given to the walls of the container
+
+    def run(self, system, time, frame_dt=None, on_frame=None):
+        """
+        Runs the system until its time reaches the given time.
+        Parameters
+        ----------
+        system: System
+            System of hard spheres to run
+        time: float
+            Time of the system at which to stop
+        frame_dt: float
+            Interval of the system's time between frames, at which the positions of all the particles are brought up to date,
+            the visualisation is updated and on_frame is called. If None, there is a single frame at the end.
+        on_frame: function taking one unnamed argument of System
+            This system is passed to the function at every frame. It must not change the particles.
+        """
+        if len(system.springs) or system.interacts or any(particle.applied_force is not no_force for particle in system.particles):
+            raise ValueError("Event-driven dynamics needs particles which move freely between collisions")
+        if system.container and system.container.periodic:
+            raise ValueError("Event-driven dynamics doesn't support periodic containers")
+        if system.container and (isinstance(system.container, _ShapedContainer) or system.container.partitions):
+            raise ValueError("Event-driven dynamics only supports cubic containers without partitions")
+        store = system.store
+        self._store = store
+        self._system = system
+        self._movable = movable = store.movable
+        self._w = store.inv_mass * movable
+        self._v = store.v * movable[:, np.newaxis]
+        self._t_local = np.full(store.n, float(system.time))
+        self._counts = np.zeros(store.n, dtype=np.intp)
+        self._queue = []
+        if system.container:
+            lower = system.container._origin_pos
+            self._lower = lower + store.radius[:, np.newaxis]
+            self._upper = lower + system.container.dimension - store.radius[:, np.newaxis]
+        for i in np.flatnonzero(movable):
+            self._predict(i, system.time)
+        frame_time = system.time
+        while system.time < time:
+            frame_time = time if frame_dt is None else min(frame_time + frame_dt, time)
+            impulse = self.wall_impulse
+            self._process_events(frame_time)
+            # Bring every particle up to the time of the frame
+            store.pos += self._v * (frame_time - self._t_local)[:, np.newaxis]
+            self._t_local[...] = frame_time
+            store.v[movable] = self._v[movable]
+            if system.record_pressure and system.container and frame_time > system.time:
+                system._update_pressure((self.wall_impulse - impulse) / (frame_time - system.time) / system.container.surface_area)
+            system.time = frame_time
+            system.steps += 1
+            system._record_step()
+            if system.visualize:
+                system.update_vis()
+            if on_frame is not None:
+                on_frame(system)
+
+    def _process_events(self, until):
+        """
+        Carries out all the collisions which happen up to the given time.
+        Each event records the number of collisions each of its particles had had when it was predicted,
+        and is discarded if either particle has collided since.
+        """
+        queue = self._queue
+        counts = self._counts
+        while queue and queue[0][0] <= until:
+            t, i, j, count_i, count_j = heapq.heappop(queue)
+            if counts[i] != count_i:
+                continue
+            if j >= 0 and counts[j] != count_j:
+                # The partner changed course, so the particle needs a new prediction.
+                self._predict(i, t)
+                continue
+            self._advance(i, t)
+            if j >= 0:
+                self._advance(j, t)
+                self._collide(i, j)
+                counts[j] += 1
+            else:
+                self._bounce(i, -1 - j)
+            counts[i] += 1
+            self._predict(i, t)
+            if j >= 0 and self._movable[j]:
+                self._predict(j, t)
+
+    def _advance(self, i, t):
+        """
+        Moves particle i along its straight path to time t.
+        """
+        self._store.pos[i] += self._v[i] * (t - self._t_local[i])
+        self._t_local[i] = t
+
+    def _predict(self, i, t):
+        """
+        Finds the first collision of particle i after time t, with another particle or with a wall, and queues it.
+        Walls are numbered -1, -2, -3 for the walls normal to each axis.
+        """
+        store = self._store
+        v = self._v
+        w = self._w
+        pos_i = store.pos[i] + v[i] * (t - self._t_local[i])
+        first = np.inf
+        partner = None
+        if self._system.collides and store.n > 1:
+            separation = store.pos + v * (t - self._t_local)[:, np.newaxis] - pos_i
+            relative_v = v - v[i]
+            b = np.einsum('ij,ij->i', separation, relative_v)
+            speed_squared = np.einsum('ij,ij->i', relative_v, relative_v)
+            contact = store.radius + store.radius[i]
+            discriminant = b**2 - speed_squared * (np.einsum('ij,ij->i', separation, separation) - contact**2)
+            # Only pairs moving towards each other whose paths come within contact distance collide.
+            candidates = (b < 0) & (discriminant >= 0) & (w + w[i] > 0)
+            candidates[i] = False
+            candidates = np.flatnonzero(candidates)
+            if len(candidates):
+                times = -(b[candidates] + np.sqrt(discriminant[candidates])) / speed_squared[candidates]
+                k = np.argmin(times)
+                first = max(times[k], 0.)
+                partner = candidates[k]
+        if self._system.container:
+            for axis in range(3):
+                if v[i, axis] > 0:
+                    wall_time = (self._upper[i, axis] - pos_i[axis]) / v[i, axis]
+                elif v[i, axis] < 0:
+                    wall_time = (self._lower[i, axis] - pos_i[axis]) / v[i, axis]
+                else:
+                    continue
+                if wall_time < first:
+                    first = max(wall_time, 0.)
+                    partner = -1 - axis
+        if partner is not None:
+            count = self._counts[partner] if partner >= 0 else 0
+            heapq.heappush(self._queue, (t + first, i, partner, self._counts[i], count))
+
+    def _collide(self, i, j):
+        """
+        Elastic collision between particles i and j, which are in contact.
+        """
+        pos = self._store.pos
+        v = self._v
+        w = self._w
+        axis = normalized(pos[j] - pos[i])
+        impulse = 2 * np.inner(v[j] - v[i], axis) / (w[i] + w[j])
+        v[i] += impulse * w[i] * axis
+        v[j] -= impulse * w[j] * axis
+        self.particle_collisions += 1
+
+    def _bounce(self, i, axis):
+        """
+        Elastic collision of particle i with a wall normal to the given axis.
+        """
+        if self._w[i] > 0:
+            self.wall_impulse += 2 * abs(self._v[i, axis]) / self._w[i]
+        self._v[i, axis] = -self._v[i, axis]
+        self.wall_collisions += 1
+
+
+class TrajectoryRecorder(object):
+    """
+    Records the state of a System every few steps into preallocated arrays, without growing memory as the run goes on.
+    Frames are kept in a ring buffer holding the last capacity frames, or if a path is given,
+    written to a directory of .npy files of capacity frames each, through memory maps, so a run of any length can be kept on disk.
+    """
+    # Fields which can be recorded, with the number of values per particle, or None for one value per frame
+    FIELDS = {'pos': 3, 'v': 3, 'kinetic_energy': None, 'potential_energy': None, 'pressure': None}
+
+    @property
+    def n_frames(self):
+        """Number of frames recorded so far, including any which have been overwritten in the ring buffer."""
+        return self._count
+
+    def __init__(self, capacity=1000, stride=1, particles=None,
+                 fields=('pos', 'v', 'kinetic_energy', 'potential_energy', 'pressure'), dtype=np.float64, path=None):
+        """
+        Parameters
+        ----------
+        capacity: integer
+            Number of frames held in memory, or in each file if path is given
+        stride: integer
+            A frame is recorded every stride steps
+        particles: slice or array of integers
+            Indices of the particles whose positions and velocities are recorded, None for all of them.
+            For example slice(None, None, 10) records every tenth particle.
+        fields: tuple of strings
+            Fields to record, any of the keys of TrajectoryRecorder.FIELDS. The time of each frame is always recorded.
+        dtype: numpy dtype
+            Type in which the values are stored, for example np.float32 to halve the memory needed
+        path: string
+            Directory to write the frames to. If None, frames are kept in memory
+        """
+        for field in fields:
+            if field not in self.FIELDS:
+                raise ValueError("Unknown field '{0}', choose from {1}".format(field, sorted(self.FIELDS)))
+        self.capacity = capacity
+        self.stride = stride
+        self.particles = particles
+        self.fields = ('time',) + tuple(fields)
+        self.dtype = np.dtype(dtype)
+        self.path = path
+        self._count = 0
+        self._chunk = 0
+        self._n = None
+        self._buffers = None
+        if path is not None:
+            import os
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def _shape(self, field):
+        """
+        Shape of one frame of a field.
+        """
+        width = self.FIELDS.get(field)
+        if width is None:
+            return ()
+        return (self._n, width)
+
+    def _open_chunk(self):
+        """
+        Allocates the arrays which the next capacity frames are written into.
+        On disk, the metadata is rewritten to describe the frames recorded so far, so that the files can be read back at any time.
+        """
+        self._buffers = {}
+        for field in self.fields:
+            shape = (self.capacity,) + self._shape(field)
+            dtype = np.float64 if field == 'time' else self.dtype
+            if self.path is None:
+                self._buffers[field] = np.zeros(shape, dtype=dtype)
+            else:
+                import os
+                file_name = os.path.join(self.path, '{0}.{1:05d}.npy'.format(field, self._chunk))
+                self._buffers[field] = np.lib.format.open_memmap(file_name, mode='w+', dtype=dtype, shape=shape)
+        if self.path is not None:
+            self._write_metadata()
+
+    def record(self, system):
+        """
+        Called by the system after every step, records a frame if the step is a multiple of the stride.
+        Parameters
+        ----------
+        system: System
+            System being recorded
+        """
+        if system.steps % self.stride:
+            return
+        store = system.store
+        if self.particles is None:
+            rows = slice(None)
+        else:
+            rows = self.particles
+        if self._n is None:
+            self._n = len(np.arange(store.n)[rows])
+            self._open_chunk()
+        slot = self._count % self.capacity
+        if slot == 0 and self._count and self.path is not None:
+            self.flush()
+            self._chunk += 1
+            self._open_chunk()
+        for field in self.fields:
+            if field in ('pos', 'v'):
+                values = getattr(store, field)[rows]
+                if len(values) != self._n:
+                    raise ValueError("Number of particles recorded has changed from {0} to {1}".format(self._n, len(values)))
+            else:
+                values = getattr(system, field)
+            self._buffers[field][slot] = values
+        self._count += 1
+
+    def flush(self):
+        """
+        Writes the frames recorded so far to disk, and the metadata describing them to trajectory.json in the directory.
+        Does nothing if frames are kept in memory.
+        """
+        if self.path is None or self._buffers is None:
+            return
+        for buffer in self._buffers.values():
+            buffer.flush()
+        self._write_metadata()
+
+    def _write_metadata(self):
+        """
+        Writes the metadata describing the frames recorded so far to trajectory.json in the directory.
+        """
+        import json
+        import os
+        with open(os.path.join(self.path, 'trajectory.json'), 'w') as metadata:
+            json.dump({'fields': self.fields, 'capacity': self.capacity, 'n_frames': self._count,
+                       'stride': self.stride, 'dtype': self.dtype.str}, metadata)
+
+    def __getitem__(self, field):
+        """
+        Gives the recorded frames of a field, oldest first, e.g. recorder['pos'] is an array of shape (frames, particles, 3).
+        """
+        if field not in self.fields:
+            raise KeyError(field)
+        if self._buffers is None:
+            return np.zeros((0,) + self._shape(field))
+        if self.path is not None:
+            self.flush()
+            return load_trajectory(self.path)[field]
+        buffer = self._buffers[field]
+        if self._count <= self.capacity:
+            return buffer[:self._count]
+        slot = self._count % self.capacity
+        return np.concatenate((buffer[slot:], buffer[:slot]))
+
+
+def load_trajectory(path, mmap_mode='r'):
+    """
+    Loads a trajectory written by a TrajectoryRecorder with a path, as a dictionary from the name of each field
+    to an array of all its frames. A trajectory which fits in one file is memory mapped rather than read.
+    Parameters
+    ----------
+    path: string
+        Directory the trajectory was written to
+    mmap_mode: string
+        Memory map mode passed to numpy.load, None to read the files into memory
+    """
+    import json
+    import os
+    with open(os.path.join(path, 'trajectory.json')) as metadata:
+        metadata = json.load(metadata)
+    n_frames = metadata['n_frames']
+    capacity = metadata['capacity']
+    n_chunks = max(1, -(-n_frames // capacity))
+    trajectory = {}
+    for field in metadata['fields']:
+        chunks = []
+        for chunk in range(n_chunks):
+            frames = min(capacity, n_frames - chunk * capacity)
+            chunks.append(np.load(os.path.join(path, '{0}.{1:05d}.npy'.format(field, chunk)), mmap_mode=mmap_mode)[:frames])
+        if len(chunks) == 1:
+            trajectory[field] = chunks[0]
+        else:
+            trajectory[field] = np.concatenate(chunks)
+    return trajectory
+
+
+class RunningStatistics(object):
+    """
+    Mean and variance of a stream of values, updated in constant time and memory per value with Welford's algorithm.
+    Values may be arrays, in which case the statistics of each element are kept separately.
+    """
+    @property
+    def variance(self):
+        """Unbiased estimate of the variance of the values, 0 until two values have been added."""
+        if self.count < 2:
+            return 0. * self.mean
+        return self._sum_squares / (self.count - 1)
+
+    @property
+    def std(self):
+        """Standard deviation of the values."""
+        return np.sqrt(self.variance)
+
+    @property
+    def standard_error(self):
+        """Standard error of the mean, assuming the values are independent."""
+        if not self.count:
+            return 0. * self.mean
+        return np.sqrt(self.variance / self.count)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets all the values added so far.
+        """
+        self.count = 0
+        self.mean = 0.
+        self._sum_squares = 0.
+
+    def add(self, value):
+        """
+        Adds a value.
+        Parameters
+        ----------
+        value: float or numpy array
+            Value to add
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.count
+        self._sum_squares = self._sum_squares + delta * (value - self.mean)
+
+
+class ExponentialMovingAverage(object):
+    """
+    Average of a stream of values in which older values are given exponentially less weight,
+    so it follows changes of the values while smoothing out fluctuations.
+    """
+    def __init__(self, smoothing=0.01):
+        """
+        Parameters
+        ----------
+        smoothing: float
+            Weight given to each new value, between 0 and 1. The average covers roughly the last 1/smoothing values.
+        """
+        self.smoothing = smoothing
+        self.value = None
+
+    def add(self, value):
+        """
+        Adds a value, returning the new average.
+        Parameters
+        ----------
+        value: float or numpy array
+            Value to add
+        """
+        if self.value is None:
+            self.value = value
+        else:
+            self.value = self.value + self.smoothing * (value - self.value)
+        return self.value
+
+
+class StreamingHistogram(object):
+    """
+    Histogram with fixed bins, to which values can be added in batches as they are produced,
+    for example to build up the distribution of speeds of the particles over a run.
+    """
+    @property
+    def edges(self):
+        """Edges of the bins, None until the range is known."""
+        if self.limits is None:
+            return None
+        return np.linspace(self.limits[0], self.limits[1], self.bins + 1)
+
+    @property
+    def centres(self):
+        """Centres of the bins, None until the range is known."""
+        edges = self.edges
+        if edges is None:
+            return None
+        return 0.5 * (edges[1:] + edges[:-1])
+
+    @property
+    def density(self):
+        """Counts normalised so that they integrate to 1 over the bins, counting values outside the range as well."""
+        total = self.counts.sum() + self.underflow + self.overflow
+        if not total:
+            return np.zeros(self.bins)
+        return self.counts / (total * (self.limits[1] - self.limits[0]) / self.bins)
+
+    def __init__(self, bins=50, limits=None):
+        """
+        Parameters
+        ----------
+        bins: integer
+            Number of bins
+        limits: tuple of two floats
+            Lower and upper edges of the histogram. If None, they are taken from the first values added,
+            from 0 (or the smallest value if it is negative) to twice the largest value.
+        """
+        self.bins = bins
+        self.limits = limits
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.underflow = 0  # Number of values below the lowest bin
+        self.overflow = 0   # Number of values above the highest bin
+
+    def add(self, values):
+        """
+        Adds an array of values.
+        Parameters
+        ----------
+        values: numpy array
+            Values to add
+        """
+        values = np.asarray(values).ravel()
+        if not len(values):
+            return
+        if self.limits is None:
+            lower = min(values.min(), 0.)
+            upper = 2 * values.max() - lower
+            if upper <= lower:
+                upper = lower + 1.
+            self.limits = (lower, upper)
+        lower, upper = self.limits
+        index = np.floor((values - lower) * (self.bins / (upper - lower))).astype(np.intp)
+        index[values == upper] = self.bins - 1
+        below = index < 0
+        above = index >= self.bins
+        self.underflow += int(below.sum())
+        self.overflow += int(above.sum())
+        self.counts += np.bincount(index[~(below | above)], minlength=self.bins)
+
+
+class Observables(object):
+    """
+    Statistics of the state of a System, accumulated after every step once the system has equilibrated,
+    in constant time and memory per step. Pass one to a System with its observables argument.
+    """
+    def __init__(self, every=1, speed_bins=50, max_speed=None, smoothing=0.01, potential_energy=True):
+        """
+        Parameters
+        ----------
+        every: integer
+            Statistics are taken every this many steps
+        speed_bins: integer
+            Number of bins of the histogram of speeds
+        max_speed: float
+            Upper edge of the histogram of speeds. If None, twice the largest speed when statistics are first taken
+        smoothing: float
+            Weight given to each new value by the exponential moving averages
+        potential_energy: boolean
+            Whether to take statistics of the potential energy, which needs the interactions to be computed again
+        """
+        self.every = every
+        self.kinetic_energy = RunningStatistics()
+        self.potential_energy = RunningStatistics() if potential_energy else None
+        self.temperature = RunningStatistics()
+        self.smoothed_kinetic_energy = ExponentialMovingAverage(smoothing)
+        self.smoothed_temperature = ExponentialMovingAverage(smoothing)
+        self.speeds = StreamingHistogram(speed_bins, None if max_speed is None else (0., max_speed))
+
+    def update(self, system):
+        """
+        Called by the system after every step once it has equilibrated, takes statistics if the step is a multiple of every.
+        Parameters
+        ----------
+        system: System
+            System whose statistics are taken
+        """
+        if system.steps % self.every:
+            return
+        kinetic_energy = system.kinetic_energy
+        self.kinetic_energy.add(kinetic_energy)
+        self.smoothed_kinetic_energy.add(kinetic_energy)
+        temperature = system.temperature
+        self.temperature.add(temperature)
+        self.smoothed_temperature.add(temperature)
+        if self.potential_energy is not None:
+            self.potential_energy.add(system.potential_energy)
+        store = system.store
+        self.speeds.add(system.speeds[store.movable])
+
+
+class OscillationTracker(object):
+    """
+    Follows the oscillations of every particle along every axis from the arrays of their positions and velocities after each step.
+    Turning points, where a component of the velocity changes sign, give the amplitude and period of each component,
+    and crossings of the initial state in the direction the particle first moved give when each component has completed a cycle.
+    A System makes one when it stops on cycles or records amplitudes.
+    """
+    @property
+    def amplitudes(self):
+        """N x 3 array of the amplitude of each component of the position, half the distance between its last maximum and minimum"""
+        return (self.maxima - self.minima) / 2.
+
+    def __init__(self, tolerance=1e-6):
+        """
+        Parameters
+        ----------
+        tolerance: float
+            Components which have moved less than this fraction of the largest distance any component has moved from its initial value
+            aren't counted as oscillating when deciding whether a cycle is completed
+        """
+        self.tolerance = tolerance
+        self.n = None
+
+    def start(self, pos, v, time):
+        """
+        Starts following particles from the given state, forgetting anything found so far.
+        Parameters
+        ----------
+        pos, v: numpy array
+            N x 3 arrays of the positions and velocities of the particles
+        time: float
+            Time of the state
+        """
+        n = len(pos)
+        self.n = n
+        self.time = time
+        self.initial_pos = np.array(pos, dtype=float)
+        self.initial_v = np.array(v, dtype=float)
+        self.prev_pos = self.initial_pos.copy()
+        self.prev_v = self.initial_v.copy()
+        # Last maximum and minimum of each component, the times they were reached, and the time between the last two of a kind
+        self.maxima = np.full((n, 3), np.nan)
+        self.minima = np.full((n, 3), np.nan)
+        self.max_times = np.full((n, 3), np.nan)
+        self.min_times = np.full((n, 3), np.nan)
+        self.periods = np.full((n, 3), np.nan)
+        # Positions at the largest and smallest turning points along the last axis each particle turned on, as Particle.amplitude uses
+        self.max_point = np.full((n, 3), np.nan)
+        self.min_point = np.full((n, 3), np.nan)
+        # Components moving at the start complete a cycle when their displacement from the start crosses 0 in the direction they moved in,
+        # components at rest when their velocity crosses 0 in the direction they first moved in.
+        self._from_rest = self.initial_v == 0
+        self._direction = np.sign(self.initial_v)
+        self._reach = np.zeros((n, 3))
+        self.cycles = np.zeros((n, 3), dtype=np.intp)
+
+    def update(self, pos, v, time):
+        """
+        Finds the turning points and crossings of the initial state between the last state and the given one.
+        Parameters
+        ----------
+        pos, v: numpy array
+            N x 3 arrays of the positions and velocities of the particles
+        time: float
+            Time of the state
+        """
+        prev_v = self.prev_v
+        turning = prev_v * v < 0
+        if turning.any():
+            rows, axes = np.nonzero(turning)
+            before = prev_v[rows, axes]
+            after = v[rows, axes]
+            # The velocity is taken to change linearly over the step, so the turning point is half the distance the component
+            # has moved since it, at the average velocity, back from where it is now
+            turn_time = self.time + (time - self.time) * before / (before - after)
+            extreme = pos[rows, axes] - after * (time - turn_time) / 2.
+            for kind, values, times in ((before > 0, self.maxima, self.max_times), (before < 0, self.minima, self.min_times)):
+                kind_rows, kind_axes = rows[kind], axes[kind]
+                last = times[kind_rows, kind_axes]
+                known = ~np.isnan(last)
+                self.periods[kind_rows[known], kind_axes[known]] = turn_time[kind][known] - last[known]
+                times[kind_rows, kind_axes] = turn_time[kind]
+                values[kind_rows, kind_axes] = extreme[kind]
+            self._turning_points(pos, turning)
+        # Components starting at rest move off in the direction of the force on them
+        undecided = self._from_rest & (self._direction == 0)
+        if undecided.any():
+            self._direction[undecided] = np.sign(v[undecided])
+        displacement = pos - self.initial_pos
+        before = np.where(self._from_rest, prev_v, self.prev_pos - self.initial_pos) * self._direction
+        after = np.where(self._from_rest, v, displacement) * self._direction
+        self.cycles += (before < 0) & (after >= 0)
+        np.maximum(self._reach, np.abs(displacement), out=self._reach)
+        self.prev_pos[...] = pos
+        self.prev_v[...] = v
+        self.time = time
+
+    def _turning_points(self, pos, turning):
+        """
+        Keeps the positions of the particles at their largest and smallest turning points along the last axis on which they turned.
+        """
+        rows = np.flatnonzero(turning.any(axis=1))
+        axes = 2 - np.argmax(turning[rows, ::-1], axis=1)
+        first = np.isnan(self.max_point[rows, 0])
+        self.max_point[rows[first]] = pos[rows[first]]
+        self.min_point[rows[first]] = pos[rows[first]]
+        rows, axes = rows[~first], axes[~first]
+        value = pos[rows, axes]
+        above = value > self.max_point[rows, axes]
+        below = ~above & (value < self.min_point[rows, axes])
+        self.max_point[rows[above]] = pos[rows[above]]
+        self.min_point[rows[below]] = pos[rows[below]]
+
+    def cycle_completed(self, movable=None):
+        """
+        Returns whether every oscillating component of the particles has completed at least one cycle. For a normal mode,
+        all of them complete their cycles at the same time.
+        Parameters
+        ----------
+        movable: numpy array of booleans
+            Which particles count, by default all of them
+        """
+        if self.n is None:
+            return False
+        oscillating = self._reach > self.tolerance * self._reach.max() if self.n else self._reach > 0
+        if movable is not None:
+            oscillating &= movable[:, np.newaxis]
+        return bool(oscillating.any()) and bool((self.cycles[oscillating] > 0).all())
+
+
+class NormalModes(object):
+    """
+    Normal modes of the springs of a System about its current configuration, found from the eigenvectors of the stiffness
+    (Hessian) matrix of the springs weighted by the inverse masses of the particles, rather than by running the system until it
+    completes a cycle. Fixed particles and particles with no inverse mass don't move in any mode. Damping, interactions between
+    particles and applied forces are left out, so the modes are those of small, undamped oscillations of the springs alone.
+    """
+    @property
+    def periods(self):
+        """Period of each mode, inf for modes of zero frequency"""
+        with np.errstate(divide='ignore'):
+            return 2 * np.pi / self.frequencies
+
+    def __init__(self, system, number=None, sparse=None):
+        """
+        Parameters
+        ----------
+        system: System
+            System whose springs and particles the modes are found for, about the current positions of its particles
+        number: integer
+            Number of modes found, those of lowest frequency, by default all of them
+        sparse: boolean
+            Whether the modes are found by a sparse eigensolver, which is much faster for the lowest few modes of large lattices.
+            By default it is used when fewer than half of the modes of a system with more than 1000 degrees of freedom are asked for.
+            The dense solver is used whenever all the modes, or all but one, are asked for
+        """
+        import scipy.sparse
+        self.system = system
+        store = system.store
+        self.equilibrium = store.pos.copy()
+        stiffness, __ = system.spring_network.jacobians()
+        # Degrees of freedom which can move, with the square roots of their inverse masses
+        self._free = store.movable & (store.inv_mass > 0)
+        dof = np.flatnonzero(np.repeat(self._free, 3))
+        root_w = np.sqrt(np.repeat(store.inv_mass, 3)[dof])
+        weights = scipy.sparse.diags(root_w)
+        # The stiffness matrix is minus the derivative of the spring forces with respect to the positions
+        hessian = -weights.dot(stiffness[dof][:, dof]).dot(weights)
+        size = len(dof)
+        if number is None or number > size:
+            number = size
+        if sparse is None:
+            sparse = size > 1000 and number < size // 2
+        # The sparse solver can't find all the modes, or all but one, so those come from the dense one
+        sparse = sparse and number < size - 1
+        if number == 0:
+            values, vectors = np.zeros(0), np.zeros((size, 0))
+        elif sparse:
+            import scipy.sparse.linalg
+            hessian = hessian.tocsc()
+            # Shifted just below zero, so that shift-invert finds the lowest modes even when the network is free to move as a whole
+            sigma = -1e-6 * max(abs(hessian).max(), 1.)
+            values, vectors = scipy.sparse.linalg.eigsh(hessian, k=number, sigma=sigma, which='LM')
+        else:
+            values, vectors = np.linalg.eigh(hessian.toarray())
+        order = np.argsort(values)[:number]
+        values = values[order]
+        vectors = vectors[:, order]
+        # Displacements of the particles in each mode, scaled so that the largest component of any of them is 1
+        shapes = np.zeros((number, 3 * store.n))
+        shapes[:, dof] = (vectors * root_w[:, np.newaxis]).T
+        if number:
+            largest = shapes[np.arange(number), np.argmax(np.abs(shapes), axis=1)]
+            shapes /= largest[:, np.newaxis]
+        self.eigenvalues = values
+        self.frequencies = np.sqrt(np.clip(values, 0., None))
+        self.shapes = shapes.reshape(number, store.n, 3)
+
+    def __len__(self):
+        return len(self.frequencies)
+
+    def excite(self, mode, amplitude=1., phase=0.):
+        """
+        Puts the system in a normal mode, displacing its particles from the configuration the modes were found about
+        and giving them the velocities of the mode. Particles which don't move in any mode are left where they are.
+        Parameters
+        ----------
+        mode: integer
+            Index of the mode, counting from the lowest frequency
+        amplitude: float
+            Largest displacement of any component of the position of any particle during the oscillation
+        phase: float
+            Phase of the oscillation, 0 starting at rest at the largest displacement
+        """
+        system = self.system
+        store = system.store
+        shape = self.shapes[mode]
+        moving = self._free
+        store.pos[moving] = self.equilibrium[moving] + amplitude * np.cos(phase) * shape[moving]
+        store.v[moving] = -amplitude * self.frequencies[mode] * np.sin(phase) * shape[moving]
+        store.has_prev_force[...] = False
+        # Oscillations are followed afresh from the excited state
+        system.oscillations = None
+
+
+# Monotonic clock in integer nanoseconds, used to time the phases of steps
+if hasattr(time, 'perf_counter_ns'):
+    _clock_ns = time.perf_counter_ns
+else:
+    _clock_ns = lambda: int(timeit.default_timer() * 1e9)
+
+
+class SimulationStats(object):
+    """
+    Timings of the phases of each step of a System, counters of the collisions, and periodic reports of how far the energy,
+    momentum and angular momentum have drifted from their values when the stats started. Pass one to a System with its
+    stats argument. Systems without stats skip all of this.
+    """
+    # Phases of System.simulate which are timed. Forces found by integrators during a step, as in "rk4", count as integration.
+    phases = ('forces', 'collisions', 'walls', 'integration', 'visualization', 'recording')
+
+    @property
+    def step_time(self):
+        """Mean time taken by each step in seconds, over the timed phases."""
+        if not self.steps:
+            return 0.
+        return sum(self.times.values()) * 1e-9 / self.steps
+
+    @property
+    def fractions(self):
+        """Dictionary of the fraction of the time of the timed phases spent in each phase."""
+        total = sum(self.times.values())
+        return dict((phase, self.times[phase] / total if total else 0.) for phase in self.phases)
+
+    def __init__(self, every=100, conservation=True, potential_energy=True):
+        """
+        Parameters
+        ----------
+        every: integer
+            A report is added every this many steps
+        conservation: boolean
+            Whether reports include the drift of the energy, momentum and angular momentum
+        potential_energy: boolean
+            Whether the energy includes the potential energy, which needs the interactions to be computed again
+        """
+        self.every = every
+        self.conservation = conservation
+        self.include_potential_energy = potential_energy
+        self.reset()
+
+    def reset(self):
+        """
+        Zeroes the timings and counters, clears the reports, and takes the next conserved quantities as the reference.
+        """
+        self.steps = 0
+        self.times = dict((phase, 0) for phase in self.phases)
+        self.pair_checks = 0
+        self.collisions = 0
+        self.wall_collisions = 0
+        self.reports = []
+        self.reference = None
+
+    def lap(self, phase, start):
+        """
+        Adds the time since start, as given by the previous lap, to the time of the phase, and returns the current time.
+        Parameters
+        ----------
+        phase: string
+            One of phases
+        start: integer
+            Time in nanoseconds at which the phase started
+        """
+        now = _clock_ns()
+        self.times[phase] += now - start
+        return now
+
+    def conserved_quantities(self, system):
+        """
+        Gives a dictionary of the energy, momentum and angular momentum of the system.
+        Parameters
+        ----------
+        system: System
+            System whose conserved quantities are found
+        """
+        energy = system.kinetic_energy
+        if self.include_potential_energy:
+            energy += system.potential_energy
+        return {'energy': energy, 'momentum': system.momentum, 'angular_momentum': system.angular_momentum}
+
+    def update(self, system):
+        """
+        Called by the system after every step, adds a report if the number of steps is a multiple of every.
+        Parameters
+        ----------
+        system: System
+            System whose stats are taken
         """
-        _BaseObject.__init__(self)
-        self.particle_1 = particle_1
-        self.particle_2 = particle_2
-        self.k = k
-        self._alpha = alpha
-        if color is not None:
-            self._color = color
-        else:
-            self._color = [1, 1, 1]
-        self._visualized = False
-        self._radius = radius
-        if l0:
-            self.l0 = l0
-        else:
-            self.l0 = np.linalg.norm(self.particle_1.pos - self.particle_2.pos)
+        self.steps += 1
+        if self.conservation and self.reference is None:
+            self.reference = self.conserved_quantities(system)
+        if self.steps % self.every == 0:
+            self.reports.append(self.report(system))
 
-    def force_on(self, particle, if_at=np.array([None])):
+    def report(self, system):
         """
-        Given an arbitary particle, gives the force on that particle. No force if the spring isn't connected to that particle.
+        Gives a dictionary of the state of the stats: the time, the number of steps, the mean time per step in seconds,
+        the fraction of the time spent in each phase, the counters, and if conservation is True the conserved quantities
+        and their drifts. The energy drift is relative to the reference energy, unless that is 0,
+        while the momentum and angular momentum drifts are the magnitudes of their changes.
         Parameters
         ----------
-        particle: Particle object
-            Particle which feels the force
-        if_at: NumPy Array
-            If this parameter is used, this gives the force felt if the particle were at this position.
+        system: System
+            System whose stats are taken
         """
-        if not if_at.any():
-            if_at = particle.pos
-        if particle == self.particle_1:
-            x = np.linalg.norm(if_at - self.particle_2.pos) - self.l0
-            return normalized(self.particle_2.pos - if_at) * self.k * x
-        elif particle == self.particle_2:
-            x = np.linalg.norm(if_at - self.particle_1.pos) - self.l0
-            return normalized(self.particle_1.pos - if_at) * self.k * x
-        return np.array([0, 0, 0])
+        report = {'time': system.time, 'steps': self.steps, 'step_time': self.step_time, 'fractions': self.fractions,
+                  'pair_checks': self.pair_checks, 'collisions': self.collisions, 'wall_collisions': self.wall_collisions}
+        if self.conservation:
+            quantities = self.conserved_quantities(system)
+            if self.reference is None:
+                self.reference = quantities
+            reference = self.reference
+            energy_change = quantities['energy'] - reference['energy']
+            report.update(quantities)
+            report['energy_drift'] = energy_change / abs(reference['energy']) if reference['energy'] else energy_change
+            report['momentum_drift'] = np.linalg.norm(quantities['momentum'] - reference['momentum'])
+            report['angular_momentum_drift'] = np.linalg.norm(quantities['angular_momentum'] - reference['angular_momentum'])
+        return report
+
+    def summary(self):
+        """
+        Gives a table of the time spent in each phase, as a string.
+        """
+        lines = ['{0:<15}{1:>12}{2:>10}'.format('phase', 'seconds', 'fraction')]
+        fractions = self.fractions
+        for phase in self.phases:
+            lines.append('{0:<15}{1:>12.4f}{2:>10.1%}'.format(phase, self.times[phase] * 1e-9, fractions[phase]))
+        lines.append('{0} steps, {1:.3g} s per step, {2} pair checks, {3} collisions, {4} wall collisions'.format(
+            self.steps, self.step_time, self.pair_checks, self.collisions, self.wall_collisions))
+        return '\n'.join(lines)
 
 
-class PointerArrow(_BaseObject):
+class RenderScheduler(object):
     """
-    Class representing an arrow/pointer, that isn't tied to any specific visualization method/library.
+    Decides which steps of a System are drawn, so that drawing doesn't limit how fast the simulation runs,
+    and keeps the last drawn state of each object so that only objects which have changed are redrawn.
     """
+    def __init__(self, substeps=1, fps=None, rate=150):
+        """
+        Parameters
+        ----------
+        substeps: integer
+            A frame is drawn every substeps steps
+        fps: float
+            If given, frames are drawn at most this many times per second of real time, however many steps that takes,
+            and the simulation is never slowed down to wait for drawing
+        rate: float
+            Largest number of frames drawn per second by run_for, passed to vpython.rate. None for no limit. Ignored if fps is given
+        """
+        self.substeps = substeps
+        self.fps = fps
+        self.rate = rate
+        self._last_frame = None
+        self._frame_drawn = True
+        self._drawn = {}
 
-    @property
-    def shaftwidth(self):
-        return self._shaftwidth
-    @shaftwidth.setter
-    def shaftwidth(self, shaftwidth):
-        self._shaftwidth = shaftwidth
-        self.notification_center.post_notification(sender=self,
-                                                  with_name="shaftwidth_changed")
+    def frame_due(self, system):
+        """
+        Returns whether the step the system is on should be drawn.
+        Parameters
+        ----------
+        system: System
+            System being drawn
+        """
+        due = system.steps % self.substeps == 0
+        if due and self.fps is not None:
+            now = timeit.default_timer()
+            if self._last_frame is not None and now - self._last_frame < 1. / self.fps:
+                due = False
+            else:
+                self._last_frame = now
+        self._frame_drawn = due
+        return due
 
-    def __init__(self, pos, axis, shaftwidth=1, color=None, alpha=1):
+    def throttle(self, system):
         """
+        Called by run_for before every step. Limits the number of frames drawn per second to rate, if the last step was drawn.
         Parameters
         ----------
-        pos: numpy array
-            Location of tail end of pointer
-        axis: numpy array
-            A vector giving the length and orientation of the pointer
-        shaftwidth: float
-            The width of the pointer's shaft
-        color: array
-            Color of particle, given in form [R G B], default 1, 1, 1
-        alpha: float
-            Alpha of particle, 1 is completely opaque, 0 is completely transparent, used in visualisation
+        system: System
+            System being drawn
         """
-        _BaseObject.__init__(self)
-        self.pos = pos
-        self.axis = axis
-        self._shaftwidth = shaftwidth
-        self._alpha = alpha
-        if color is not None:
-            self._color = color
+        if self._frame_drawn and self.fps is None and self.rate is not None and system.visualizer_type == "vpython":
+            vpython.rate(self.rate)
+
+    def changed(self, key, values):
+        """
+        Returns the indices of the rows of values which differ from when this was last called with the same key,
+        and remembers the values for next time. Every row has changed the first time, or if the number of rows changes.
+        Parameters
+        ----------
+        key: string
+            Name of the kind of object the values describe, e.g. "spheres"
+        values: numpy array
+            Array with a row describing the drawn state of each object
+        """
+        values = np.asarray(values, dtype=float)
+        previous = self._drawn.get(key)
+        if previous is None or previous.shape != values.shape:
+            changed = np.arange(len(values))
         else:
-            self._color = [1, 1, 1]
-        self._visualized = False
+            changed = np.flatnonzero((values != previous).any(axis=tuple(range(1, values.ndim))))
+        self._drawn[key] = values.copy()
+        return changed
+
+    def reset(self):
+        """
+        Forgets what was last drawn, so that every object is redrawn in the next frame.
+        """
+        self._drawn = {}
 
 
 class System(object):
@@ -505,26 +3569,98 @@ class System(object):
         """
         Property giving 1d velocity distribution of system as unsorted array.
         """
-        self._one_d_velocities = np.zeros(len(self.particles))
-        for index, particle in enumerate(self.particles):
-            self._one_d_velocities[index] = particle.v[0]
-        return self._one_d_velocities
+        return self.store.v[:, 0].copy()
+
+    @property
+    def store(self):
+        """
+        ParticleStore holding the state of the particles in this system as contiguous arrays.
+        """
+        return self._sync_store()
+
+    @property
+    def spring_network(self):
+        """
+        SpringNetwork holding the springs in this system as an edge list.
+        """
+        store = self._sync_store()
+        springs = self.springs
+        if not isinstance(springs, list):
+            springs = list(springs)
+        if self._spring_network is None or self._spring_network.springs != springs or self._spring_network.store is not store:
+            old_network = self._spring_network
+            self._spring_network = SpringNetwork(springs, store)
+            if old_network is not None:
+                # Springs which have left the system keep their constants.
+                old_network.release()
+        self._spring_network.container = self.container
+        return self._spring_network
+
+    @property
+    def kinetic_energy(self):
+        """
+        Property giving the total kinetic energy of the particles which can move and have a finite mass.
+        """
+        store = self.store
+        massive = store.movable & (store.inv_mass > 0)
+        return 0.5 * np.sum(np.einsum('ij,ij->i', store.v[massive], store.v[massive]) / store.inv_mass[massive])
+
+    @property
+    def potential_energy(self):
+        """
+        Property giving the total potential energy stored in the springs of the system,
+        and in the interactions between particles if they interact.
+        """
+        energy = self.spring_network.potential_energy()
+        if self.interacts:
+            energy += self._interaction_engine().potential_energy(self)
+        return energy
+
+    @property
+    def momentum(self):
+        """
+        Property giving the total momentum of the particles which can move and have a finite mass.
+        """
+        store = self.store
+        massive = store.movable & (store.inv_mass > 0)
+        return np.sum(store.v[massive] / store.inv_mass[massive, np.newaxis], axis=0)
+
+    @property
+    def angular_momentum(self):
+        """
+        Property giving the total angular momentum about the origin of the particles which can move and have a finite mass.
+        """
+        store = self.store
+        massive = store.movable & (store.inv_mass > 0)
+        return np.sum(np.cross(store.pos[massive], store.v[massive]) / store.inv_mass[massive, np.newaxis], axis=0)
+
+    @property
+    def temperature(self):
+        """
+        Property giving the temperature of the particles which can move and have a finite mass,
+        from the equipartition of their kinetic energy, in units where Boltzmann's constant is 1.
+        """
+        store = self.store
+        count = np.count_nonzero(store.movable & (store.inv_mass > 0))
+        if not count:
+            return 0.
+        return 2 * self.kinetic_energy / (3 * count)
 
     @property
     def speeds(self):
         """
         Property giving 3d speed distribution of system as unsorted array.
         """
-        self._speeds = np.zeros(len(self.particles))
-        for index, particle in enumerate(self.particles):
-            self._speeds[index] = np.sqrt(np.inner(particle.v, particle.v))
-        return self._speeds
+        v = self.store.v
+        return np.sqrt(np.einsum('ij,ij->i', v, v))
 
     def __init__(self, collides, interacts, visualize,
         particles=None, springs=None, container=None,
         visualizer_type="vpython", canvas=None,
         stop_on_cycle=False, record_amplitudes=False, display_forces=False,
-        record_pressure=False):
+        record_pressure=False, integrator="verlet", force_engine=None, recorder=None,
+        observables=None, equilibration_steps=200, render_scheduler=None, threads=1, deterministic=True, stats=None,
+        batch_notifications=False):
         """
         Parameters
         ----------
@@ -546,17 +3682,61 @@ class System(object):
         canvas: some view
             Some view to draw everything into. By default, a vpython canvas. Depends upon visualization method used.
         stop_on_cycle: boolean
-            Whether the system stops running when a full cycle is done. Only tested on relatively simple 1-D systems, but seems to work.
+            Whether the system stops running when a full cycle is done, that is when every oscillating component of the motion
+            of every particle which can move has completed a cycle. Works for normal modes in any number of dimensions.
         record_amplitudes: boolean
-            Whether the system records the amplitudes of oscillations. Only works on simple 1-D systems going along the x-axis.
+            Whether the system records the amplitudes and periods of the oscillations of every particle along every axis,
+            in its oscillations attribute.
         display_forces: boolean
             Whether the forces applied onto a particle are displayed.
             By default, these vectors are displaced from the particles by 2*particle radius in y-direction.
             Look in simulate method to change this.
         record_pressure: boolean
             Whether to record pressure on walls or not
+        integrator: string or Integrator
+            Integrator used to advance the particles each step, either an Integrator instance or one of the names in INTEGRATORS:
+            "verlet" (default), "leapfrog", "symplectic_euler", "rk4" or "implicit_euler" (for stiff springs).
+        force_engine: string or ForceEngine
+            How forces between particles are computed when interacts is True, either a ForceEngine instance
+            or one of the names in FORCE_ENGINES: "direct", "barnes_hut" or "pairwise".
+            By default, "direct" is used unless some particle overrides Particle.force_on, in which case "pairwise" is used.
+        recorder: TrajectoryRecorder
+            Recorder which records the state of the system after every step, None to not record.
+        observables: Observables
+            Statistics of the system taken after every step once it has equilibrated, None to not take any.
+        equilibration_steps: integer
+            Number of steps taken before the system is treated as being in equilibrium,
+            after which the pressure is recorded and the observables are updated.
+        render_scheduler: RenderScheduler
+            Decides which steps are drawn when visualize is True. By default every step is drawn, at most 150 times a second.
+        threads: integer
+            Number of threads used to compute forces, collisions and steps, None for one per core.
+            Compiled loops only run in parallel if the module was built with OpenMP.
+        deterministic: boolean
+            Whether forces are summed in the same order whatever the number of threads, so results can be reproduced exactly.
+        stats: SimulationStats
+            Timings of the phases of each step, collision counters and conservation reports, None to not take any.
+        batch_notifications: boolean
+            Whether changes to the properties of the visualized objects, e.g. their color, are collected and shown once per frame drawn,
+            instead of being posted to the notification center as they are made. Much faster when changing many objects every step.
         """
         self.visualize = visualize
+        self.integrator = _make_integrator(integrator)
+        self.force_engine = _make_force_engine(force_engine)
+        self._default_force_engine = None
+        self.recorder = recorder
+        self.observables = observables
+        self.equilibration_steps = equilibration_steps
+        if threads is None:
+            import multiprocessing
+            threads = multiprocessing.cpu_count()
+        self.threads = threads
+        self.deterministic = deterministic
+        self.stats = stats
+        if render_scheduler is not None:
+            self.render_scheduler = render_scheduler
+        else:
+            self.render_scheduler = RenderScheduler()
         self.interacts = interacts
         if particles is not None:
             self.particles = particles
@@ -577,17 +3757,24 @@ class System(object):
         self.box = None
         self.scene = None
         self.stop_on_cycle = stop_on_cycle
-        self.domains = []
         self.record_amplitudes = record_amplitudes
+        self.oscillations = None    # OscillationTracker, made when the system stops on cycles or records amplitudes
         self.time = 0.
+        self.dt = None  # Size of the last step chosen by run_for
         self.display_forces = display_forces
         self.record_pressure = record_pressure
         self.pressure = 0           # Pressure is set to 0 at the start
         self.steps = 0              # Number of steps taken, is set to 0 at the start
-        self.pressure_history = []  # History of instantaneous values of pressure
+        self.pressure_statistics = RunningStatistics()  # Statistics of the instantaneous values of pressure
+        self.wall_force_statistics = RunningStatistics()  # Statistics of the force on each wall and partition
         self.notification_center = nc.NotificationCenter()
         self.observers = []
-        self._container_dimension_observer = None
+        self.batch_notifications = batch_notifications
+        self._pending_changes = []  # Objects with batched changes which haven't been dispatched yet
+        self._observer_blocks = {}  # Functions called for each batched change of each object, by object and notification name
+        self._cell_list = _CellList()
+        self._store = None
+        self._spring_network = None
         if display_forces:
             self._assign_pointers()
         if visualize:
@@ -603,8 +3790,6 @@ class System(object):
     def __del__(self):
         for observer in self.observers:
             self.notification_center.remove_observer(observer)
-        if self._container_dimension_observer is not None:
-            self.notification_center.remove_observer(self._container_dimension_observer)
         object.__del__()
 
     def create_vis(self, canvas=None):
@@ -655,18 +3840,10 @@ class System(object):
                     sphere.make_trail = particle.make_trail
 
                 # Add observers to the notification center
-                self.observers.append(self.notification_center.add_observer(with_block=on_update_opacity,
-                                        for_name="alpha_changed",
-                                        for_sender=particle))
-                self.observers.append(self.notification_center.add_observer(with_block=on_update_radius,
-                                        for_name="radius_changed",
-                                        for_sender=particle))
-                self.observers.append(self.notification_center.add_observer(with_block=on_update_color,
-                                        for_name="color_changed",
-                                        for_sender=particle))
-                self.observers.append(self.notification_center.add_observer(with_block=on_update_trail,
-                                        for_name="make_trail_changed",
-                                        for_sender=particle))
+                self._observe(on_update_opacity, "alpha_changed", particle)
+                self._observe(on_update_radius, "radius_changed", particle)
+                self._observe(on_update_color, "color_changed", particle)
+                self._observe(on_update_trail, "make_trail_changed", particle)
                 particle._visualized = True
         # Draw springs if they aren't drawn yet
         for spring in self.springs:
@@ -690,18 +3867,12 @@ class System(object):
 
                 def on_update_color(sender, with_name, with_info, self=self,
                                     spring=spring, helix=self.helices[-1]):
-                    helix.color = vector_from(helices.color)
+                    helix.color = vector_from(spring.color)
 
                 # Add observers to the notification center
-                self.observers.append(self.notification_center.add_observer(with_block=on_update_opacity,
-                                        for_name="alpha_changed",
-                                        for_sender=spring))
-                self.observers.append(self.notification_center.add_observer(with_block=on_update_radius,
-                                        for_name="radius_changed",
-                                        for_sender=spring))
-                self.observers.append(self.notification_center.add_observer(with_block=on_update_color,
-                                        for_name="color_changed",
-                                        for_sender=spring))
+                self._observe(on_update_opacity, "alpha_changed", spring)
+                self._observe(on_update_radius, "radius_changed", spring)
+                self._observe(on_update_color, "color_changed", spring)
                 spring._visualized = True
         # Draw pointers if they aren't drawn yet
         for pointer in self.pointerarrows:
@@ -721,31 +3892,46 @@ class System(object):
 
                 def on_update_sw(sender, with_name, with_info, self=self,
                                     pointer=pointer, arrow=self.arrows[-1]):
-                    arrow.radius = pointer.radius
+                    arrow.shaftwidth = pointer.shaftwidth
 
                 def on_update_color(sender, with_name, with_info, self=self,
                                     pointer=pointer, arrow=self.arrows[-1]):
                     arrow.color = vector_from(pointer.color)
 
                 # Add observers to the notification center
-                self.observers.append(self.notification_center.add_observer(with_block=on_update_opacity,
-                                        for_name="alpha_changed",
-                                        for_sender=self.arrows[-1]))
-                self.observers.append(self.notification_center.add_observer(with_block=on_update_sw,
-                                        for_name="shaftwidth_changed",
-                                        for_sender=self.arrows[-1]))
-                self.observers.append(self.notification_center.add_observer(with_block=on_update_color,
-                                        for_name="color_changed",
-                                        for_sender=self.arrows[-1]))
+                self._observe(on_update_opacity, "alpha_changed", pointer)
+                self._observe(on_update_sw, "shaftwidth_changed", pointer)
+                self._observe(on_update_color, "color_changed", pointer)
                 pointer._visualized = True
         # Draw container if exists
         if not self.box and self.container:
-            self.box = vpython.box(pos=vector_from(self.container.pos),
-                length=self.container.dimension,
-                width=self.container.dimension,
-                height=self.container.dimension,
-                color=vector_from(self.container.color),
-                opacity=self.container.alpha)
+            if isinstance(self.container, SphericalContainer):
+                self.box = vpython.sphere(pos=vector_from(self.container.pos),
+                    radius=self.container.radius,
+                    color=vector_from(self.container.color),
+                    opacity=self.container.alpha)
+            elif isinstance(self.container, CylindricalContainer):
+                self.box = vpython.cylinder(pos=vector_from(self._container_vis_pos()),
+                    axis=vector_from(self.container.axis * self.container.length),
+                    radius=self.container.radius,
+                    color=vector_from(self.container.color),
+                    opacity=self.container.alpha)
+            else:
+                self.box = vpython.box(pos=vector_from(self.container.pos),
+                    length=self.container.dimension,
+                    width=self.container.dimension,
+                    height=self.container.dimension,
+                    color=vector_from(self.container.color),
+                    opacity=self.container.alpha)
+            # Partitions are drawn as thin plates across the container
+            for partition in self.container.partitions:
+                vpython.box(pos=vector_from(partition.point),
+                    axis=vector_from(partition.normal),
+                    length=self.container.dimension / 100.,
+                    width=self.container.dimension,
+                    height=self.container.dimension,
+                    color=vector_from(self.container.color),
+                    opacity=self.container.alpha)
 
             # We will create functions so that we can update visualization properties only when needed using pynotificationcenter
             # For more detail on how this is done, read the documentation for that library.
@@ -754,22 +3940,54 @@ class System(object):
                 box.opacity = self.container.alpha
             def on_update_dimensions(sender, with_name, with_info, self=self,
                                 container=self.container, box=self.box):
-                box.width = self.container.dimension
-                box.length = self.container.dimension
-                box.height = self.container.dimension
+                if isinstance(container, SphericalContainer):
+                    box.radius = container.radius
+                elif isinstance(container, CylindricalContainer):
+                    box.pos = vector_from(self._container_vis_pos())
+                    box.axis = vector_from(container.axis * container.length)
+                    box.radius = container.radius
+                else:
+                    box.width = self.container.dimension
+                    box.length = self.container.dimension
+                    box.height = self.container.dimension
             def on_update_color(sender, with_name, with_info, self=self,
                                 container=self.container, box=self.box):
                 box.color = vector_from(self.container.color)
             # Add observers to the notification center
-            self.observers.append(self.notification_center.add_observer(with_block=on_update_opacity,
-                                    for_name="alpha_changed",
-                                    for_sender=self.container))
-            self.observers.append(self.notification_center.add_observer(with_block=on_update_dimensions,
-                                    for_name="dimension_changed",
-                                    for_sender=self.container))
-            self.observers.append(self.notification_center.add_observer(with_block=on_update_color,
-                                    for_name="color_changed",
-                                    for_sender=self.container))
+            self._observe(on_update_opacity, "alpha_changed", self.container)
+            self._observe(on_update_dimensions, "dimension_changed", self.container)
+            self._observe(on_update_color, "color_changed", self.container)
+
+    def _observe(self, block, name, sender):
+        """
+        Calls block when the sender posts a notification of the given name, straight away,
+        or when the next frame is drawn if the system batches notifications.
+        """
+        if self.batch_notifications:
+            sender._pending_changes = self._pending_changes
+            self._observer_blocks.setdefault(sender, {}).setdefault(name, []).append(block)
+        else:
+            self.observers.append(self.notification_center.add_observer(with_block=block, for_name=name, for_sender=sender))
+
+    def flush_notifications(self):
+        """
+        Dispatches the changes to the properties of the objects made since the last time, if the system batches notifications.
+        Each object's changes are dispatched once, however many times they were made, to the visualisation
+        and then to the notification center. Called whenever a frame is drawn.
+        """
+        if not self._pending_changes:
+            return
+        changed = list(self._pending_changes)
+        # The objects hold on to the list, so it is emptied rather than replaced
+        del self._pending_changes[:]
+        for sender in changed:
+            names = sender._changes
+            sender._changes = None
+            blocks = self._observer_blocks.get(sender, {})
+            for name in names:
+                for block in blocks.get(name, ()):
+                    block(sender, name, None)
+                sender.notification_center.post_notification(sender=sender, with_name=name)
 
     def update_vis(self):
         """
@@ -778,22 +3996,77 @@ class System(object):
         global vpython
         if vpython is None:
             import vpython
-        # For each type of object, only updates certain properties if they have changed.
+        self.flush_notifications()
+        # For each type of object, only objects which have moved since they were last drawn are updated.
+        # Positions are taken from the store in bulk, as lists of floats, which are much faster to make vectors from.
+        scheduler = self.render_scheduler
+        store = self.store
         # Update display of particles(rendered as spheres)
-        for (index, __) in enumerate(self.spheres):
-            self.spheres[index].pos = vector_from(self.particles[index].pos)
+        pos = store.pos[:len(self.spheres)]
+        changed = scheduler.changed("spheres", pos)
+        for index, sphere_pos in zip(changed, pos[changed].tolist()):
+            self.spheres[index].pos = vpython.vector(*sphere_pos)
         # Update display of springs(rendered as helices)
-        for (index, __) in enumerate(self.helices):
-            self.helices[index].pos = vector_from(self.springs[index].pos)
-            self.helices[index].axis = vector_from(self.springs[index].axis)
+        if self.helices:
+            network = self.spring_network
+            ends = np.hstack((store.pos[network.first], store.pos[network.second] - store.pos[network.first]))[:len(self.helices)]
+            changed = scheduler.changed("helices", ends)
+            for index, (x, y, z, axis_x, axis_y, axis_z) in zip(changed, ends[changed].tolist()):
+                self.helices[index].pos = vpython.vector(x, y, z)
+                self.helices[index].axis = vpython.vector(axis_x, axis_y, axis_z)
         # Update display of pointers(rendered as arrows)
-        for (index, __) in enumerate(self.arrows):
-            self.arrows[index].pos = vector_from(self.pointerarrows[index].pos)
-            self.arrows[index].axis = vector_from(self.pointerarrows[index].axis)
-        if self.box:
-            self.box.pos = vector_from(self.container.pos)
+        if self.arrows:
+            ends = np.array([np.append(pointer.pos, pointer.axis) for pointer in self.pointerarrows[:len(self.arrows)]])
+            changed = scheduler.changed("arrows", ends)
+            for index, (x, y, z, axis_x, axis_y, axis_z) in zip(changed, ends[changed].tolist()):
+                self.arrows[index].pos = vpython.vector(x, y, z)
+                self.arrows[index].axis = vpython.vector(axis_x, axis_y, axis_z)
+        if self.box and len(scheduler.changed("box", [self.container.pos])):
+            self.box.pos = vector_from(self._container_vis_pos())
+
+    def _container_vis_pos(self):
+        """
+        Gives the position at which the container is drawn, its centre except for cylinders, which are drawn from one end.
+        """
+        if isinstance(self.container, CylindricalContainer):
+            return self.container.pos - self.container.axis * self.container.length / 2.
+        return self.container.pos
+
+    def replay(self, trajectory, rate=30, on_frame=None):
+        """
+        Draws a trajectory recorded by a TrajectoryRecorder, e.g. from a run with visualize set to False,
+        by setting the positions of the particles from each frame in turn. The positions are restored afterwards.
+        Parameters
+        ----------
+        trajectory: TrajectoryRecorder or dictionary returned by load_trajectory
+            Trajectory to replay, in which the positions of every particle of this system were recorded
+        rate: float
+            Number of frames drawn per second, None to draw them as fast as possible
+        on_frame: function taking one unnamed argument of System
+            This system is passed to the function after every frame is drawn
+        """
+        global vpython
+        frames = trajectory['pos']
+        store = self.store
+        if frames.ndim != 3 or frames.shape[1] != store.n:
+            raise ValueError("Trajectory doesn't hold the positions of the {0} particles of this system".format(store.n))
+        self.create_vis()
+        if vpython is None:
+            import vpython
+        saved_pos = store.pos.copy()
+        try:
+            for frame in frames:
+                store.pos[...] = frame
+                self.update_vis()
+                if rate is not None and self.visualizer_type in (None, "vpython"):
+                    vpython.rate(rate)
+                if on_frame is not None:
+                    on_frame(self)
+        finally:
+            store.pos[...] = saved_pos
+            self.update_vis()
 
-    def run_for(self, time, dt=0.01, on_step=None):
+    def run_for(self, time, dt=0.01, on_step=None, adaptive=False, tolerance=1e-3, dt_min=0., dt_max=None):
         """
         Run simulation for a certain amount of time(as measured in the simulated system's time).
         Recommended to use this instead of simulate(dt) for most situations.
@@ -802,10 +4075,19 @@ class System(object):
         time: float
             Time for which the simulation will go on for in the system's time
         dt: float
-            Time steps taken.
+            Time steps taken. If adaptive is True, this is the size of the first step.
         on_step: function taking one unnamed argument of System
             This system is passed to the function,
             and the defined function will be performed at the end of every step
+        adaptive: boolean
+            Whether to choose the size of each step from an estimate of the error of the integration,
+            and from the speeds and radii of the particles if they collide. The last step is shortened to end exactly at time.
+        tolerance: float
+            Largest error allowed in the change of the velocity of a particle each step, relative to its speed, when adaptive is True
+        dt_min: float
+            Smallest step taken when adaptive is True
+        dt_max: float
+            Largest step taken when adaptive is True, None for no limit
         """
         # Make pointer objects if not already created
         if self.display_forces:
@@ -818,22 +4100,120 @@ class System(object):
             global vpython
             if vpython is None:
                 import vpython
+        self.dt = dt
+        previous_step = None
         # Simulate for given time
-        while self.time < time:
-            if self.visualize and self.visualizer_type == "vpython":
-                vpython.rate(150)
-            self.simulate(dt)
+        try:
+            while self.time < time:
+                if self.visualize:
+                    self.render_scheduler.throttle(self)
+                if adaptive:
+                    step = min(self.dt, time - self.time)
+                    self.simulate(step)
+                    previous_step = self._adapt_time_step(step, previous_step, tolerance, dt_min, dt_max)
+                else:
+                    self.simulate(dt)
+                if on_step is not None:
+                    on_step(self)
+                if self.stop_on_cycle:
+                    if self._cycle_completed():
+                        break
+        finally:
+            # Frames recorded to disk can be read back however the run ends
+            if self.recorder is not None:
+                self.recorder.flush()
+
+    def run_event_driven(self, time, frame_dt=None, on_step=None):
+        """
+        Run simulation of hard spheres for a certain amount of time(as measured in the simulated system's time),
+        using event-driven dynamics rather than fixed time steps: collisions between particles and with the walls of the container
+        happen at exactly their predicted times. Only for systems without springs, applied forces or interactions.
+        Returns the EventDriven engine used, which counts the collisions.
+        Parameters
+        ----------
+        time: float
+            Time for which the simulation will go on for in the system's time
+        frame_dt: float
+            Interval between frames, at which the visualization is updated and on_step is called. If None, only at the end.
+        on_step: function taking one unnamed argument of System
+            This system is passed to the function, and the defined function will be performed at every frame.
+            It must not change the particles.
+        """
+        # Create visualization if necessary
+        if self.visualize:
+            self.create_vis()
+        # Import vpython if necessary
+        if self.visualize and self.visualizer_type == "vpython":
+            global vpython
+            if vpython is None:
+                import vpython
+
+        def on_frame(system):
+            if system.visualize:
+                system.render_scheduler.throttle(system)
             if on_step is not None:
-                on_step(self)
-            if self.stop_on_cycle:
-                if self._cycle_completed():
-                    break
-                for particle in self.particles:
-                    particle.prev_pos = _duplicate_vector(particle.pos)
+                on_step(system)
+
+        engine = EventDriven()
+        try:
+            engine.run(self, time, frame_dt, on_frame)
+        finally:
+            if self.recorder is not None:
+                self.recorder.flush()
+        return engine
 
-    def create_particles_in_container(self, number=0, speed=0, radius=0, inv_mass=1.):
+    def _adapt_time_step(self, step, previous_step, tolerance, dt_min, dt_max):
         """
-        Creates the given number of particles, with the given parameters, in random locations within the container.
+        Chooses the size of the next step, self.dt, after a step of the given size has been taken.
+        The change of the forces between the starts of the last two steps gives the rate of change of the acceleration
+        of each particle, from which the error of the velocity Verlet velocity update is estimated as 0.5 dt^2 |da/dt|.
+        The step is the largest for which this is within tolerance times the speed of every particle, and if particles collide,
+        small enough that no particle moves more than a quarter of the smallest radius. It grows by at most a factor of 2 per step.
+        Parameters
+        ----------
+        step: float
+            Size of the step just taken
+        previous_step: tuple of numpy array and float
+            Forces at the start of the step before and its size, as returned by the previous call, None if this is the first step
+        tolerance: float
+            Largest error allowed in the change of the velocity of a particle, relative to its speed
+        dt_min: float
+            Smallest step allowed
+        dt_max: float
+            Largest step allowed, None for no limit
+        """
+        store = self.store
+        new_dt = 2 * self.dt
+        if previous_step is not None and len(previous_step[0]) == store.n > 0:
+            previous_force, previous_dt = previous_step
+            w = store.inv_mass * store.movable
+            jerk = np.sqrt(np.einsum('ij,ij->i', store.force - previous_force, store.force - previous_force)) * w / previous_dt
+            speed = np.sqrt(np.einsum('ij,ij->i', store.v, store.v))
+            # Speeds are measured against the rms speed, so that particles which are nearly at rest don't force tiny steps
+            scale = tolerance * (speed + np.sqrt(np.mean(speed**2)))
+            changing = jerk > 0
+            if changing.any():
+                new_dt = min(new_dt, 0.9 * np.sqrt(2 * scale[changing] / jerk[changing]).min())
+        if self.collides and store.n:
+            max_speed = np.sqrt(np.einsum('ij,ij->i', store.v, store.v).max())
+            radii = store.radius[store.radius > 0]
+            if max_speed > 0 and len(radii):
+                new_dt = min(new_dt, 0.25 * radii.min() / max_speed)
+        if dt_max is not None:
+            new_dt = min(new_dt, dt_max)
+        self.dt = max(new_dt, dt_min)
+        if previous_step is not None and len(previous_step[0]) == store.n:
+            previous_force = previous_step[0]
+            previous_force[...] = store.force
+        else:
+            previous_force = store.force.copy()
+        return previous_force, step
+
+    def create_particles_in_container(self, number=0, speed=0, radius=0, inv_mass=1., random_state=None,
+                                      method="poisson", jitter=1., temperature=None):
+        """
+        Creates the given number of particles, with the given parameters, in random locations within the container,
+        none of them overlapping each other or the particles already in the system.
         If the system has no container, this method will raise an error.
         Parameters
         ----------
@@ -845,23 +4225,323 @@ class System(object):
             The radius of these particles
         inv_mass: float
             The inverse mass of these particles.
+        random_state: numpy RandomState or integer
+            Generator, or seed for one, from which the positions and velocities are drawn. If None, numpy's global generator is used.
+        method: string
+            How positions are chosen. "poisson" places particles uniformly at random, throwing candidates in batches and keeping
+            those which don't overlap, found with a cell list. It fills up to roughly a third of the volume of the container.
+            "lattice" places particles on randomly chosen sites of a cubic lattice filling the container, for denser packings.
+        jitter: float
+            For "lattice", how far each particle is moved randomly from its site,
+            as a fraction of the furthest it can move without overlapping its neighbours or the walls.
+        temperature: float
+            If given, velocities are drawn from the Maxwell-Boltzmann distribution at this temperature,
+            in units where Boltzmann's constant is 1, and shifted and scaled to give zero total momentum and exactly this temperature.
+            Otherwise, every particle moves at the given speed in a random direction.
         """
         if not self.container:
             raise RuntimeError("No container in system")
+        if random_state is None:
+            random_state = np.random
+        elif not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+        if number <= 0:
+            return
+        if method == "poisson":
+            positions = self._poisson_positions(number, radius, random_state)
+        elif method == "lattice":
+            positions = self._lattice_positions(number, radius, random_state, jitter)
+        else:
+            raise ValueError("Unknown method '{0}', choose \"poisson\" or \"lattice\"".format(method))
+        if temperature is not None:
+            velocities = random_state.normal(scale=np.sqrt(temperature * inv_mass), size=(number, 3))
+            velocities -= velocities.mean(axis=0)
+            sum_squares = np.sum(velocities**2)
+            if sum_squares > 0:
+                velocities *= np.sqrt(3 * number * temperature * inv_mass / sum_squares)
+        else:
+            directions = random_state.normal(size=(number, 3))
+            velocities = speed * directions / np.sqrt(np.einsum('ij,ij->i', directions, directions))[:, np.newaxis]
+        for position, velocity in zip(positions, velocities):
+            self.particles.append(Particle(pos=position, v=velocity, inv_mass=inv_mass, radius=radius, visualize=self.visualize))
+
+    def _overlapping(self, pos, radii, first_new):
+        """
+        Returns the indices, counted from first_new, of the points from first_new on which overlap an earlier point,
+        given the positions and radii of all the points. Points overlap periodic images of each other in a periodic container.
+        """
+        reach = 2 * radii.max() if len(radii) else 0.
+        if reach <= 0:
+            return np.zeros(0, dtype=np.intp)
+        container = self.container
+        if container.periodic:
+            lower = container._origin_pos
+            i, j = self._cell_list.pairs(pos, reach, lower, lower + container.dimension, periodic=True)
+        else:
+            i, j = self._cell_list.pairs(pos, reach)
+        diff = container.minimum_image(pos[i] - pos[j])
+        overlapping = np.einsum('ij,ij->i', diff, diff) < (radii[i] + radii[j])**2
+        later = np.maximum(i[overlapping], j[overlapping])
+        return np.unique(later[later >= first_new]) - first_new
+
+    def _poisson_positions(self, number, radius, random_state, max_rounds=200):
+        """
+        Gives positions for the given number of particles uniformly at random in the container, not overlapping each other,
+        the particles in the system or the walls. Candidates are drawn in batches, and the candidates overlapping any earlier point are dropped.
+        Batches grow as fewer candidates are kept, so the container can be filled close to the densest random packing.
+        """
+        store = self.store
+        if self.container.periodic:
+            # No walls to keep away from
+            lower = self.container._origin_pos
+            side = self.container.dimension
+        else:
+            lower = self.container._origin_pos + radius
+            side = self.container.dimension - 2 * radius
+        if side < 0:
+            raise RuntimeError("Particles of radius {0} don't fit in the container".format(radius))
+        accepted = np.zeros((0, 3))
+        kept_fraction = 1.
+        for __ in range(max_rounds):
+            remaining = number - len(accepted)
+            batch = int(min(2 * remaining / max(kept_fraction, 1e-3), 10 * number + 1024))
+            candidates = lower + side * random_state.random_sample((batch, 3))
+            # Drop the candidates outside containers which aren't cubes, or overlapping partitions
+            candidates = candidates[self.container.fits(candidates, radius)]
+            pos = np.concatenate((store.pos, accepted, candidates))
+            radii = np.concatenate((store.radius, np.full(len(accepted) + len(candidates), float(radius))))
+            keep = np.ones(len(candidates), dtype=bool)
+            keep[self._overlapping(pos, radii, len(store.pos) + len(accepted))] = False
+            kept_fraction = np.count_nonzero(keep) / float(batch)
+            accepted = np.concatenate((accepted, candidates[keep][:remaining]))
+            if len(accepted) == number:
+                return accepted
+        raise RuntimeError("Couldn't fit {0} particles of radius {1} into the container without overlaps, "
+                           "try method=\"lattice\"".format(number, radius))
+
+    def _lattice_positions(self, number, radius, random_state, jitter):
+        """
+        Gives positions for the given number of particles on randomly chosen sites of a cubic lattice filling the container,
+        moved randomly from their sites by up to jitter times the furthest they can move without overlapping.
+        Sites which are outside the container or overlap its walls are skipped.
+        Sites where a particle would overlap the particles in the system are skipped, using a finer lattice if needed.
+        """
+        store = self.store
+        dimension = self.container.dimension
+        per_side = int(np.ceil(number**(1. / 3)))
+        while True:
+            spacing = dimension / per_side
+            if spacing < 2 * radius:
+                raise RuntimeError("Couldn't fit {0} particles of radius {1} into the container".format(number, radius))
+            sites = random_state.permutation(per_side**3)
+            cells = np.column_stack(np.unravel_index(sites, (per_side, per_side, per_side)))
+            positions = self.container._origin_pos + (cells + 0.5) * spacing
+            positions += jitter * (spacing / 2 - radius) * random_state.uniform(-1., 1., size=positions.shape)
+            positions = positions[self.container.fits(positions, radius)]
+            if store.n:
+                pos = np.concatenate((store.pos, positions))
+                radii = np.concatenate((store.radius, np.full(len(positions), float(radius))))
+                free = np.ones(len(positions), dtype=bool)
+                free[self._overlapping(pos, radii, store.n)] = False
+                positions = positions[free]
+            if len(positions) >= number:
+                return positions[:number]
+            per_side += 1
+
+    def normal_modes(self, number=None, sparse=None):
+        """
+        Finds the normal modes of the springs of the system about the current positions of its particles,
+        giving a NormalModes object whose excite function puts the system in one of them.
+        Parameters
+        ----------
+        number, sparse:
+            Passed on to NormalModes
+        """
+        return NormalModes(self, number, sparse)
+
+    def save_checkpoint(self, path):
+        """
+        Saves the state of the system into a directory, as a .npy file for each array of the particles and springs,
+        system.json for the time, container and settings, and statistics.pickle for the accumulated pressure and observables.
+        The run can be carried on later with restore, or from_checkpoint. Applied forces, force engines and
+        the visualisation are not saved.
+        Parameters
+        ----------
+        path: string
+            Directory to save into, created if it doesn't exist
+        """
+        import json
+        import os
+        import pickle
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        store = self.store
+        network = self.spring_network
+        arrays = {'particles.has_prev_force': store.has_prev_force,
+                  'particles.color': np.array([particle.color for particle in self.particles], dtype=float).reshape(-1, 3),
+                  'particles.alpha': np.array([particle.alpha for particle in self.particles], dtype=float),
+                  'springs.first': network.first,
+                  'springs.second': network.second,
+                  'springs.radius': np.array([spring.radius for spring in network.springs], dtype=float),
+                  'springs.color': np.array([spring.color for spring in network.springs], dtype=float).reshape(-1, 3),
+                  'springs.alpha': np.array([spring.alpha for spring in network.springs], dtype=float)}
+        for field in ParticleStore._fields:
+            arrays['particles.' + field] = getattr(store, field)
+        for field in SpringNetwork._fields:
+            arrays['springs.' + field] = getattr(network, field)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+        if self.container:
+            container = {'dimension': float(self.container.dimension),
+                         'pos': [float(x) for x in self.container.pos],
+                         'color': [float(x) for x in self.container.color],
+                         'alpha': float(self.container.alpha),
+                         'periodic': bool(self.container.periodic),
+                         'shape': type(self.container).__name__,
+                         'partitions': [{'point': [float(x) for x in partition.point],
+                                         'normal': [float(x) for x in partition.normal],
+                                         'area': None if partition.area is None else float(partition.area),
+                                         'hole_radius': float(partition.hole_radius)}
+                                        for partition in self.container.partitions]}
+            if isinstance(self.container, SphericalContainer):
+                container['radius'] = float(self.container.radius)
+            elif isinstance(self.container, CylindricalContainer):
+                container['radius'] = float(self.container.radius)
+                container['length'] = float(self.container.length)
+                container['axis'] = [float(x) for x in self.container.axis]
         else:
-            for i in range(0, number):
-                l = self.container.dimension - radius * 2
-                position = np.array([l * random() - l / 2, l * random() - l / 2, l * random() - l / 2]) + self.container.pos
-                there_is = self._has_a_particle_at(position, radius)
-                while there_is:
-                    position = np.array([l * random() - l / 2, l * random() - l / 2, l * random() - l / 2]) + self.container.pos
-                    there_is = self._has_a_particle_at(position, radius)
-                velocity = speed * normalized(np.array([1 * random() - 0.5, 1 * random() - 0.5, 1 * random() - 0.5]))
-                particle = Particle(pos=position, v=velocity, inv_mass=inv_mass, radius=radius)
-                self.particles.append(particle)
-            if self.collides and self.container:
-                self._setup_domains()
-                self._assign_particles_to_domains()
+            container = None
+        previous_dt = self.integrator._previous_dt
+        metadata = {'version': 1,
+                    'time': float(self.time),
+                    'steps': int(self.steps),
+                    'dt': None if self.dt is None else float(self.dt),
+                    'pressure': float(self.pressure),
+                    'collides': bool(self.collides),
+                    'interacts': bool(self.interacts),
+                    'record_pressure': bool(self.record_pressure),
+                    'equilibration_steps': int(self.equilibration_steps),
+                    'integrator': type(self.integrator).__name__,
+                    'previous_dt': None if previous_dt is None else float(previous_dt),
+                    'container': container}
+        with open(os.path.join(path, 'system.json'), 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+        with open(os.path.join(path, 'statistics.pickle'), 'wb') as statistics_file:
+            pickle.dump({'pressure_statistics': self.pressure_statistics, 'wall_force_statistics': self.wall_force_statistics,
+                         'observables': self.observables}, statistics_file, protocol=2)
+
+    @staticmethod
+    def _load_checkpoint(path, mmap):
+        """
+        Loads the metadata and the arrays of a checkpoint, memory mapping the arrays if mmap is True.
+        """
+        import json
+        import os
+        with open(os.path.join(path, 'system.json')) as metadata_file:
+            metadata = json.load(metadata_file)
+        arrays = {}
+        for file_name in os.listdir(path):
+            if file_name.endswith('.npy'):
+                arrays[file_name[:-4]] = np.load(os.path.join(path, file_name), mmap_mode='r' if mmap else None)
+        return metadata, arrays
+
+    def restore(self, path, mmap=True):
+        """
+        Restores the state saved by save_checkpoint into this system, which must have the same particles and springs,
+        in the same order, as the system that was saved. Positions, velocities, forces, masses, charges, spring constants, the time,
+        the number of steps, the pressure and the observables are restored, while applied forces and the visualisation are kept.
+        Cycles and amplitudes of oscillation are followed afresh from the restored state.
+        Parameters
+        ----------
+        path: string
+            Directory the checkpoint was saved into
+        mmap: boolean
+            Whether the arrays are memory mapped rather than read, which is faster for large systems
+        """
+        import os
+        import pickle
+        metadata, arrays = self._load_checkpoint(path, mmap)
+        store = self.store
+        network = self.spring_network
+        if (len(arrays['particles.pos']) != store.n or len(arrays['springs.first']) != network.n
+                or not np.array_equal(arrays['springs.first'], network.first) or not np.array_equal(arrays['springs.second'], network.second)):
+            raise ValueError("Checkpoint has {0} particles and {1} springs, which don't match the {2} particles and {3} springs of this system".format(
+                len(arrays['particles.pos']), len(arrays['springs.first']), store.n, network.n))
+        for field in ParticleStore._fields:
+            getattr(store, field)[...] = arrays['particles.' + field]
+        store.has_prev_force[...] = arrays['particles.has_prev_force']
+        for field in SpringNetwork._fields:
+            getattr(network, field)[...] = arrays['springs.' + field]
+        self.time = metadata['time']
+        self.steps = metadata['steps']
+        self.dt = metadata['dt']
+        self.pressure = metadata['pressure']
+        self.integrator._previous_dt = metadata['previous_dt']
+        with open(os.path.join(path, 'statistics.pickle'), 'rb') as statistics_file:
+            statistics = pickle.load(statistics_file)
+        self.pressure_statistics = statistics['pressure_statistics']
+        self.wall_force_statistics = statistics.get('wall_force_statistics', RunningStatistics())
+        if statistics['observables'] is not None:
+            self.observables = statistics['observables']
+        # Oscillations are followed afresh from the restored state
+        self.oscillations = None
+
+    @classmethod
+    def from_checkpoint(cls, path, visualize=False, mmap=True, **kwargs):
+        """
+        Creates a system from a checkpoint saved by save_checkpoint, with new particles, springs and container.
+        Particles have no applied force, and interactions use the default force engine, unless given in kwargs.
+        Parameters
+        ----------
+        path: string
+            Directory the checkpoint was saved into
+        visualize: boolean
+            Whether the system visualizes itself
+        mmap: boolean
+            Whether the arrays are memory mapped rather than read, which is faster for large systems
+        kwargs:
+            Any other arguments passed on to System, e.g. force_engine or observables
+        """
+        metadata, arrays = cls._load_checkpoint(path, mmap)
+        particles = [Particle(pos=pos, v=v, radius=radius, inv_mass=inv_mass, color=list(color), alpha=alpha, fixed=fixed, q=q,
+                              visualize=visualize)
+                     for pos, v, radius, inv_mass, color, alpha, fixed, q in
+                     zip(arrays['particles.pos'], arrays['particles.v'], arrays['particles.radius'].tolist(),
+                         arrays['particles.inv_mass'].tolist(), arrays['particles.color'].tolist(), arrays['particles.alpha'].tolist(),
+                         arrays['particles.fixed'].tolist(), arrays['particles.q'].tolist())]
+        springs = [Spring(particles[first], particles[second], k=k, l0=l0, radius=radius, color=color, alpha=alpha, damping=damping,
+                          visualize=visualize)
+                   for first, second, k, l0, radius, color, alpha, damping in
+                   zip(arrays['springs.first'].tolist(), arrays['springs.second'].tolist(), arrays['springs.k'].tolist(),
+                       arrays['springs.l0'].tolist(), arrays['springs.radius'].tolist(), arrays['springs.color'].tolist(),
+                       arrays['springs.alpha'].tolist(), arrays['springs.damping'].tolist())]
+        container = None
+        if metadata['container'] is not None:
+            saved = metadata['container']
+            partitions = [Partition(partition['point'], partition['normal'], partition['area'], partition['hole_radius'])
+                          for partition in saved.get('partitions', [])]
+            shape = saved.get('shape')
+            if shape == 'SphericalContainer':
+                container = SphericalContainer(saved['radius'], pos=np.array(saved['pos']), color=saved['color'],
+                                               alpha=saved['alpha'], partitions=partitions, visualize=visualize)
+            elif shape == 'CylindricalContainer':
+                container = CylindricalContainer(saved['radius'], saved['length'], pos=np.array(saved['pos']),
+                                                 axis=np.array(saved['axis']), color=saved['color'], alpha=saved['alpha'],
+                                                 partitions=partitions, visualize=visualize)
+            else:
+                container = Container(saved['dimension'], pos=np.array(saved['pos']), color=saved['color'],
+                                      alpha=saved['alpha'], periodic=saved.get('periodic', False), partitions=partitions,
+                                      visualize=visualize)
+        if 'integrator' not in kwargs:
+            for integrator in INTEGRATORS.values():
+                if integrator.__name__ == metadata['integrator']:
+                    kwargs['integrator'] = integrator()
+        kwargs.setdefault('record_pressure', metadata['record_pressure'])
+        kwargs.setdefault('equilibration_steps', metadata['equilibration_steps'])
+        system = cls(collides=metadata['collides'], interacts=metadata['interacts'], visualize=visualize,
+                     particles=particles, springs=springs, container=container, **kwargs)
+        system.restore(path, mmap)
+        return system
 
     def simulate(self, dt=0.01):
         """
@@ -871,15 +4551,21 @@ class System(object):
         dt: float
             Size of time step taken
         """
+        self._sync_store()
         # Set up system if only just starting, in case things have changed since system was created.
         if self.time == 0 or self.steps == 0:
             if self.display_forces:
                 self._assign_pointers()
             if self.visualize:
                 self.create_vis()
-            if self.collides and self.container:
-                self._setup_domains()
-                self._assign_particles_to_domains()
+        if self.stop_on_cycle or self.record_amplitudes:
+            # Oscillations are followed from the state before the first step, or before the step after particles are added
+            self._track_oscillations()
+
+        # Phases are only timed if the system has stats.
+        stats = self.stats
+        if stats is not None:
+            tick = _clock_ns()
 
         # Make pointers appropriate sizes according to forces on particles.
         if self.display_forces:
@@ -887,215 +4573,168 @@ class System(object):
                 pointer.pos = self.particles[index].pos + np.array([0., self.particles[index].radius + self.particles[index].radius, 0.])
                 # Add radius to itself as slightly faster performance that way than doing 2*
                 pointer.axis = self.particles[index].applied_force(self.particles[index], self.time)
+            if stats is not None:
+                tick = stats.lap('visualization', tick)
 
-        # Forces on particles depending on their applied force
-        for particle in self.particles:
-            if not particle.fixed:
-                particle.total_force = particle.applied_force(particle, self.time)
-                for spring in self.springs:
-                    particle.total_force += spring.force_on(particle)
-            else:
-                particle.total_force = np.array([0., 0., 0.])
-        # If particles interact with each other, add forces from fields.
-        if self.interacts:
-            for particle in self.particles:
-                if not particle.fixed:
-                    for other_particle in self.particles:
-                        if particle != other_particle:
-                            particle.total_force += other_particle.force_on(particle)
+        self.compute_forces(self.time)
+        if stats is not None:
+            tick = stats.lap('forces', tick)
 
-        if self.container:
-            # Collision detection between particles using domains if has container.
-            if self.collides:
-                self._collision_detection_with_domains()
+        # Collision detection between particles, using a cell list.
+        virial = 0.
+        if self.collides:
+            pair_checks, collisions, virial = self._collision_detection()
+            if stats is not None:
+                stats.pair_checks += pair_checks
+                stats.collisions += collisions
+                tick = stats.lap('collisions', tick)
 
+        if self.container and self.container.periodic:
+            # No walls, the pressure comes from the kinetic energy and the virial of the collisions.
+            if self.record_pressure and self.steps > self.equilibration_steps:
+                self._update_pressure((2 * self.kinetic_energy + virial / dt) / (3 * self.container.volume))
+        elif self.container:
             # Collision detection with walls of container if has one.
-            momenta_change = 0.
-            # Go through all the particles
-            for (index, particle) in enumerate(self.particles):
-                # Check for collisions with walls
-                wall_collision_index = self.container.contains(particle)
-                if wall_collision_index is not True:
-                    particle.v[wall_collision_index] = -particle.v[wall_collision_index]
-                    if particle.pos[wall_collision_index] > 0:
-                        particle.pos[wall_collision_index] = particle.pos[wall_collision_index] - (particle.radius / 10)
-                    else:
-                        particle.pos[wall_collision_index] = particle.pos[wall_collision_index] + particle.radius / 10
-                        momenta_change += abs(particle.v[wall_collision_index] / particle.inv_mass)
+            container_type = type(self.container)
+            wall_forces = None
+            if container_type.contains is Container.contains or container_type.walls is not Container.walls:
+                # All the particles at once against each wall, from the signed distance of the particles from the walls
+                impulses, wall_collisions = self._wall_collisions()
+                momenta_change = impulses[:len(self.container.walls)].sum()
+                wall_forces = impulses / dt
+            else:
+                # Containers which override contains go through all the particles
+                momenta_change = 0.
+                wall_collisions = 0
+                for (index, particle) in enumerate(self.particles):
+                    # Check for collisions with walls
+                    wall_collision_index = self.container.contains(particle)
+                    if wall_collision_index is not True:
+                        wall_collisions += 1
+                        particle.v[wall_collision_index] = -particle.v[wall_collision_index]
+                        if particle.pos[wall_collision_index] > 0:
+                            particle.pos[wall_collision_index] = particle.pos[wall_collision_index] - (particle.radius / 10)
+                        else:
+                            particle.pos[wall_collision_index] = particle.pos[wall_collision_index] + particle.radius / 10
+                            momenta_change += abs(particle.v[wall_collision_index] / particle.inv_mass)
             # Record the pressure, but only after a certain number of steps have been taken, when the system will be in equilibrium
-            if self.record_pressure and self.steps > 200:
+            if self.record_pressure and self.steps > self.equilibration_steps:
                 instantaneous_pressure = (momenta_change / dt) / self.container.surface_area
-                self._update_pressure(instantaneous_pressure)
-
-        else:
-            # If the system does not have a container, still does collision detection, but a lot less efficient.
-            # (O(n^2) as opposed to O(nlog(n)))
-            if self.collides:
-                self._collision_detection()
+                self._update_pressure(instantaneous_pressure, wall_forces)
+            if stats is not None:
+                stats.wall_collisions += wall_collisions
+                tick = stats.lap('walls', tick)
         # Update particle positions according to the forces.
-        for particle in self.particles:
-            particle.update(dt)
-        # record amplitudes/visualize if required.
-        if self.record_amplitudes:
-            self._get_amplitudes()
-        # Update visualisation
-        if self.visualize:
+        self.integrator.step(self, dt)
+        if self.container:
+            # Particles leaving a periodic container come back in on the opposite side.
+            self.container.wrap(self.store.pos)
+        if stats is not None:
+            tick = stats.lap('integration', tick)
+        # Follow the oscillations of the particles if required.
+        if self.stop_on_cycle or self.record_amplitudes:
+            self.oscillations.update(self.store.pos, self.store.v, self.time + dt)
+        # Update visualisation, if this step is to be drawn
+        if self.visualize and self.render_scheduler.frame_due(self):
             self.update_vis()
+        if stats is not None:
+            tick = stats.lap('visualization', tick)
         self.time += dt
         self.steps += 1
+        self._record_step()
+        if stats is not None:
+            stats.lap('recording', tick)
+            stats.update(self)
 
-    def _setup_domains(self):
-        """
-        Sets up domains in the container.
-        So that the more efficient collision detection algorithm functions:
-        don't make the domain_size any less than 2r,
-        and the step should be smaller than domain_size by at least 1 particle_radius.
-        The actual values chosen here are just what seem to work well, do tinker with them
-        """
-        if self._container_dimension_observer is None:
-                    def domains_update(sender, notification_name, info, self=self):
-                        self._setup_domains()
-                        self._assign_particles_to_domains()
-                    self._container_dimension_observer = self.notification_center.add_observer(with_block=domains_update,
-                                                              for_name="dimension_changed",
-                                                              for_sender=self.container)
-        self.domain_size = self.particles[0].radius * 17
-        step = self.particles[0].radius * 15.5
-        x1 = np.arange(- self.container.dimension/2 + self.container.pos[0], (1.05 * self.container.dimension + self.container.pos[0])/2, step)
-        x2 = np.arange(- self.container.dimension/2 + self.container.pos[1], (1.05 * self.container.dimension + self.container.pos[1])/2, step)
-        x3 = np.arange(- self.container.dimension/2 + self.container.pos[2], (1.05 * self.container.dimension + self.container.pos[2])/2, step)
-        x, y, z = np.meshgrid(x1, x2, x3)
-        self._setup_domains_helper(self,x,y,z)
-        self._assign_particles_to_domains()
-
-    @np.vectorize
-    def _setup_domains_helper(self, x, y, z):
-        """
-        Helper function for setup_domains(), made so that @np.vectorize can be used for faster execution
-        """
-        pos = np.array([x, y, z])
-        self.domains.append(_Domain(pos, self.domain_size))
-
-    def _assign_particles_to_domains(self):
+    def _record_step(self):
         """
-        Assigns a list of particles that are in each domain to the list of domains.
+        Records the state of the system after a step, if it has a recorder or observables.
         """
-        for domain in self.domains:
-            domain.particles = []
-            for particle in self.particles:
-                if domain.contains(particle) is True:
-                    domain.particles.append(particle)
+        if self.recorder is not None:
+            self.recorder.record(self)
+        if self.observables is not None and self.steps > self.equilibration_steps:
+            self.observables.update(self)
 
-    def _collided(self, particle_1, particle_2):
+    def compute_forces(self, time):
         """
-        Checks if two particles have collided, returns true if they have, false if they haven't.
+        Sets the total force on each particle, given the current positions and velocities of the particles.
+        Extend this when adding new types of forces, it is also called by integrators that need forces at intermediate states.
         Parameters
         ----------
-        particle_1: Particle
-            First particle that is being checked for collision
-        particle_2: Particle
-            The particle that particle_1 is being checked for a collision with
+        time: float
+            Time at which the forces are felt
         """
-        diff = particle_2.pos - particle_1.pos
-        distance = np.sqrt(np.inner(diff, diff))  # more efficient than np.linalg.norm()
-        # If the two particles overlap, then a collision is detected:
-        if distance <= particle_2.radius + particle_1.radius:
-            return True
-        return False
+        store = self.store
+        store.force[...] = 0.
+        # Forces on particles depending on their applied force
+        for index, particle in enumerate(self.particles):
+            if particle.applied_force is not no_force:
+                store.force[index] = particle.applied_force(particle, time)
+        # Forces from all the springs at once
+        self.spring_network.add_forces(store.force, self.threads)
+        # If particles interact with each other, add forces from fields.
+        if self.interacts:
+            self._interaction_engine().add_forces(self, store.force)
+        store.force[store.fixed] = 0.
 
-    def _collision(self, particle_1, particle_2):
+    def _interaction_engine(self):
         """
-        Defines how to change velocities when two particles, particle_1 and particle_2 collide.
-        Parameters
-        ----------
-        particle_1: Particle
-            One of the particles that has collided
-        particle_2: Particle
-            The other particle that has collided
+        Gives the force engine used for interactions, choosing the default one if none was given.
         """
-        diff = particle_1.pos - particle_2.pos
-        axis_1 = normalized(diff)
-        particle_1.pos += axis_1 * np.sqrt(np.inner(diff,diff)) / 20    # more efficient than np.linalg.norm()
-        axis_2 = normalized(_perpendicular_vector(axis_1))
-        axis_3 = normalized(_cross(axis_1, axis_2))
-        axes = [axis_1, axis_2, axis_3]
-        particle_1_v_after = np.array([0., 0., 0.])
-        particle_2_v_after = np.array([0., 0., 0.])
-        for i in range(1, 3):
-            particle_1_v_after += np.dot(particle_1.v, axes[i]) * axes[i]
-            particle_2_v_after += np.dot(particle_2.v, axes[i]) * axes[i]
-        u1_parallel_axis_1 = np.dot(particle_1.v, axes[0])
-        u2_parallel_axis_1 = np.dot(particle_2.v, axes[0])
-        Z = (((u1_parallel_axis_1 * particle_2.inv_mass) + (u2_parallel_axis_1 * particle_1.inv_mass))
-            / (particle_1.inv_mass + particle_2.inv_mass))
-        particle_1_v_after += axes[0] * (-1* u1_parallel_axis_1 + Z*2)
-        particle_1.v = particle_1_v_after
-        axis_1 = normalized(particle_1.pos - particle_2.pos)
-        particle_2_v_after += axes[0] * (-1* u2_parallel_axis_1 + Z*2)
-        particle_2.v = particle_2_v_after
+        if self.force_engine is not None:
+            return self.force_engine
+        store = self.store
+        if self._default_force_engine is None or self._default_force_engine[0] is not store:
+            if all(type(particle).force_on is Particle.force_on for particle in self.particles):
+                engine = DirectSummation()
+            else:
+                engine = PairwiseForces()
+            self._default_force_engine = (store, engine)
+        return self._default_force_engine[1]
 
-    def _has_a_particle_at(self, pos, radius):
+    def _sync_store(self):
         """
-        Checks whether a particle alread exists at a certain position.
-        Parameters
-        ----------
-        pos: vector
-            Position that is being checked for the existence of a particle
+        Makes sure the particle store holds exactly the particles in self.particles, in the same order,
+        rebuilding it if particles have been added, removed or reordered since it was last built.
         """
-        diam = radius * 2
-        for particle in self.particles:
-            diff = particle.pos - pos
-            distance = np.sqrt(np.inner(diff, diff))    # more efficient than np.linalg.norm()
-            if distance <= diam:
-                return True
-        return False
+        particles = self.particles
+        if not isinstance(particles, list):
+            particles = list(particles)
+        if self._store is None or self._store.particles != particles:
+            old_store = self._store
+            self._store = ParticleStore(particles)
+            if old_store is not None:
+                # Particles which have left the system keep their state.
+                old_store.release()
+        return self._store
 
-    def _cycle_completed(self):
+    def _track_oscillations(self):
         """
-        Function to see if an oscillation cycle has been completed. Only should work for normal modes.
+        Starts following the oscillations of the particles from their current state, unless they are already followed.
+        Each particle's initial_pos, initial_v, prev_pos, prev_v, max_point and min_point become views of its rows of the tracker's arrays.
         """
-        if self.time == 0:
-            for particle in self.particles:
-                particle.initial_v = _duplicate_vector(particle.v)
-                particle.initial_pos = _duplicate_vector(particle.pos)
-                particle.prev_pos = _duplicate_vector(particle.pos)
-        if self.time <= 0.01:
-            # Don't expect any oscillations to finish faster than 0.01 seconds. Change if necessary.
-            return False
-        # If any of the particles have gone past their original position/are on their original positions,
-        # and the velocity is in the same direction as originally, then cycle is completed.
-        for particle in self.particles:
-            if not particle.fixed:
-                diff = element_mult(particle.pos - particle.initial_pos,
-                    particle.prev_pos - particle.initial_pos)
-                if (diff[0] <= 0. and diff[1] <= 0. and diff[2] <= 0.):
-                    vel_diff = element_mult(particle.initial_v, particle.v)
-                    if vel_diff[0] < 0. or vel_diff[1] < 0. or vel_diff[2] < 0.:
-                        return False
-                    return True
-                return False
-        return False
+        store = self.store
+        if self.oscillations is None:
+            self.oscillations = OscillationTracker()
+        elif self.oscillations.n == store.n:
+            return
+        tracker = self.oscillations
+        tracker.start(store.pos, store.v, self.time)
+        for index, particle in enumerate(self.particles):
+            particle.initial_pos = tracker.initial_pos[index]
+            particle.initial_v = tracker.initial_v[index]
+            particle.prev_pos = tracker.prev_pos[index]
+            particle.prev_v = tracker.prev_v[index]
+            particle.max_point = tracker.max_point[index]
+            particle.min_point = tracker.min_point[index]
 
-    def _get_amplitudes(self):
+    def _cycle_completed(self):
         """
-        Gets the amplitudes for all the particles system. Only works for 1D oscillations.
+        Function to see if an oscillation cycle has been completed, by every component of the motion of every particle which can move.
+        Works for normal modes in any number of dimensions.
         """
-        for particle in self.particles:
-            vel_diff = element_mult(particle.v, particle.prev_v)
-            index = None
-            for i, diff in enumerate(vel_diff):
-                if diff < 0.:
-                    index = i
-            if index is not None:
-                if not particle.max_point.any() and not particle.min_point.any():
-                    particle.max_point = _duplicate_vector(particle.pos)
-                    particle.min_point = _duplicate_vector(particle.pos)
-                else:
-                    if particle.pos[index] > particle.max_point[index]:
-                        particle.max_point = _duplicate_vector(particle.pos)
-                    elif particle.pos[index] < particle.min_point[index]:
-                        particle.min_point = _duplicate_vector(particle.pos)
-            particle.prev_v = _duplicate_vector(particle.v)
+        self._track_oscillations()
+        return self.oscillations.cycle_completed(self.store.movable)
 
     def _assign_pointers(self):
         """
@@ -1104,42 +4743,188 @@ class System(object):
         for particle in self.particles:
             if not particle._pointer_assigned:
                 self.pointerarrows.append(PointerArrow(pos=particle.pos,
-                    axis=particle.applied_force(particle, 0)))
+                    axis=particle.applied_force(particle, 0), visualize=self.visualize))
                 particle._pointer_assigned = True
 
     def _collision_detection(self):
         """
-        Inefficient collision detection algorithm that works by checking each particle with all other particles after it in particles.
+        Collision detection between all the particles. Candidate pairs come from a cell list over the container,
+        or over the bounding box of the particles if there is no container,
+        and are then tested and responded to one after another in a compiled loop.
+        Particles collide with the nearest periodic image of each other in a periodic container.
+        Returns the number of candidate pairs tested, the number of collisions and their virial, as given by _collision.
         """
-        for index1, particle in enumerate(self.particles):
-            for index2, other_particle in enumerate(self.particles):
-                if index2 > index1:
-                    if self._collided(particle, other_particle):
-                        self._collision(particle, other_particle)
+        store = self.store
+        if store.n < 2:
+            return 0, 0, 0.
+        max_radius = store.radius.max()
+        if max_radius <= 0:
+            return 0, 0, 0.
+        periodic = False
+        if self.container:
+            lower = self.container._origin_pos
+            upper = lower + self.container.dimension
+            periodic = self.container.periodic
+        else:
+            lower = upper = None
+        i, j = self._cell_list.pairs(store.pos, 2 * max_radius, lower, upper, periodic)
+        # The narrow phase and the response are done in compiled loops.
+        collisions, virial = self._collision(i, j)
+        return len(i), collisions, virial
 
-    def _collision_detection_with_domains(self):
-        # Assign particles to domains every 3 steps.
-        # (Don't need to do every step, as particles are unlikely to move to different domains in 3 steps time.
-        # Should be fine as if particles are moving so quickly, simulation is inacurrate anyway.)
-        if self.steps % 3 == 0:
-            self._assign_particles_to_domains()
+    def _collision(self, i, j):
+        """
+        Tests the given candidate pairs of particles for overlap, and changes the velocities of overlapping pairs as in an elastic
+        collision, separating them so they no longer overlap. Fixed particles are treated as having infinite mass.
+        The overlapping pairs are handled in order, so a particle can take part in several collisions in one step.
+        Pairs not sharing a particle are handled at the same time when using several threads, giving the same result.
+        Returns the number of collisions, and the sum over the collisions of the separation of the particles dotted with
+        the momentum given to the first particle, which gives their contribution to the pressure.
+        Parameters
+        ----------
+        i: numpy array of integers
+            Indices of the first particle of each candidate pair
+        j: numpy array of integers
+            Indices of the second particle of each candidate pair
+        """
+        store = self.store
+        cdef double[:, ::1] pos = store.pos
+        cdef double[:, ::1] v = store.v
+        cdef double[::1] radius = store.radius
+        cdef double[::1] w = store.inv_mass * store.movable
+        cdef int num_threads = self.threads
+        cdef double box = 0.
+        if self.container and self.container.periodic:
+            box = self.container.dimension
+        first_array = np.ascontiguousarray(i, dtype=np.intp)
+        second_array = np.ascontiguousarray(j, dtype=np.intp)
+        touching_array = np.zeros(len(first_array), dtype=np.uint8)
+        cdef Py_ssize_t[::1] first = first_array
+        cdef Py_ssize_t[::1] second = second_array
+        cdef unsigned char[::1] touching = touching_array
+        with nogil:
+            _touching_kernel(pos, radius, w, first, second, box, touching, num_threads)
+        touching_pairs = np.flatnonzero(touching_array)
+        if not len(touching_pairs):
+            return 0, 0.
+        first_array = first_array[touching_pairs]
+        second_array = second_array[touching_pairs]
+        rounds_array = np.empty(len(touching_pairs), dtype=np.intp)
+        first = first_array
+        second = second_array
+        cdef Py_ssize_t[::1] next_round = np.zeros(store.n, dtype=np.intp)
+        cdef Py_ssize_t[::1] rounds = rounds_array
+        cdef Py_ssize_t n_rounds
+        with nogil:
+            n_rounds = _collision_rounds(first, second, next_round, rounds)
+        order = np.argsort(rounds_array, kind='mergesort')
+        first = first_array[order]
+        second = second_array[order]
+        cdef Py_ssize_t[::1] round_start = np.zeros(n_rounds + 1, dtype=np.intp)
+        np.cumsum(np.bincount(rounds_array, minlength=n_rounds), out=np.asarray(round_start)[1:])
+        cdef double[::1] virial = np.zeros(len(touching_pairs))
+        cdef Py_ssize_t collisions
+        with nogil:
+            collisions = _collision_kernel(pos, v, radius, w, first, second, round_start, box, virial, num_threads)
+        return collisions, np.asarray(virial).sum()
 
-        # The actual collision detection
-        for domain in self.domains:
-            for index_1, particle_1 in enumerate(domain.particles):
-                for index_2, particle_2 in enumerate(domain.particles):
-                    if (index_2 > index_1):
-                        collided = self._collided(particle_1, particle_2)
-                        if collided:
-                            self._collision(particle_1, particle_2)
+    def _wall_collisions(self):
+        """
+        Reflects the particles off the walls and partitions of the container, testing all the particles against each wall at once,
+        so particles overlapping several walls are reflected off each of them.
+        Returns the momentum given to each wall, in the order of the container's walls followed by its partitions,
+        and the number of times particles were reflected.
+        """
+        store = self.store
+        movable = store.movable
+        mass = _masses(store.inv_mass)
+        walls = self.container.walls + self.container.partitions
+        impulses = np.zeros(len(walls))
+        reflected = 0
+        for index, wall in enumerate(walls):
+            impulses[index], wall_reflected = wall.reflect(store.pos, store.v, store.radius, movable, mass, self.threads)
+            reflected += wall_reflected
+        return impulses, reflected
 
-    def _update_pressure(self, instantaneous_pressure):
+    def _update_pressure(self, instantaneous_pressure, wall_forces=None):
         """
         Updates pressure of system.
         Parameters
         ----------
         instantaneous_pressure: float
             Pressure at a certain time
+        wall_forces: numpy array
+            Force on each wall and partition of the container at that time, if known
+        """
+        self.pressure_statistics.add(instantaneous_pressure)
+        self.pressure = self.pressure_statistics.mean
+        if wall_forces is not None:
+            self.wall_force_statistics.add(wall_forces)
+
+    @property
+    def wall_forces(self):
         """
-        self.pressure_history.append(instantaneous_pressure)
-        self.pressure = np.mean(self.pressure_history)
+        Mean force on each wall of the container followed by each of its partitions, over the steps the pressure was recorded.
+        """
+        return np.atleast_1d(self.wall_force_statistics.mean)
+
+    @property
+    def wall_pressures(self):
+        """
+        Mean pressure on each wall of the container followed by each of its partitions, nan for walls whose area isn't known.
+        Partitions are pushed from both sides, so this is the pressure on one side plus the pressure on the other.
+        """
+        walls = self.container.walls + self.container.partitions
+        areas = np.array([np.nan if wall.area is None else wall.area for wall in walls], dtype=float)
+        return self.wall_forces / areas
+
+
+def _run_replica(task):
+    """
+    Builds and runs one replica of an ensemble, returning what observe gives for it. Runs in a worker process.
+    """
+    make_system, parameter, replica_seed, observe, time, dt = task
+    system = make_system(parameter, np.random.RandomState(replica_seed))
+    system.run_for(time, dt)
+    return observe(system)
+
+
+def run_ensemble(make_system, parameters, observe, time, dt=0.01, processes=None, seed=None):
+    """
+    Runs independent replicas of a system in a pool of processes, and collects an observation of each into one array.
+    Every replica gets its own seeded random number generator, so ensembles are reproducible.
+    Parameters
+    ----------
+    make_system: function taking arguments of: parameter and random_state. Returns a System
+        Builds the system of one replica, for one of the parameters, drawing any random numbers it needs from random_state,
+        a numpy RandomState, as the global generators of random and numpy aren't seeded. It should create the system with visualize set to False.
+        Must be defined at the top level of a module, so that it can be sent to other processes.
+    parameters: array
+        Parameter of each replica, e.g. the number of particles, or the same value repeated to run identical replicas with different seeds
+    observe: function taking one unnamed argument of System
+        Gives the observation of a replica once it has run, e.g. its pressure, as a number or numpy array.
+        Must also be defined at the top level of a module.
+    time: float
+        Time each replica is run for in the system's time
+    dt: float
+        Time steps taken
+    processes: integer
+        Number of processes used, by default the number of cores. 1 runs every replica in this process
+    seed: integer
+        Seed from which the seeds of the replicas are drawn, None for a different ensemble every time
+    """
+    parameters = list(parameters)
+    replica_seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, size=len(parameters))
+    tasks = [(make_system, parameter, int(replica_seed), observe, time, dt)
+             for parameter, replica_seed in zip(parameters, replica_seeds)]
+    if processes == 1:
+        results = [_run_replica(task) for task in tasks]
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_run_replica, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    return np.array(results)
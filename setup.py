@@ -2,6 +2,7 @@ import versioneer
 from setuptools import setup, find_packages, Extension
 from codecs import open
 from os import path
+import sys
 have_cython = False
 try:
     from Cython.Distutils import build_ext
@@ -9,14 +10,20 @@ try:
 except ImportError:
     from distutils.command.build_ext import build_ext
 
+# The compiled loops of mechanics are split between threads with OpenMP where the compiler supports it,
+# elsewhere they run on one thread.
+openmp = {}
+if sys.platform.startswith('linux'):
+    openmp = dict(extra_compile_args=['-fopenmp'], extra_link_args=['-fopenmp'])
+
 mechanics = None
 if have_cython:
-    mechanics = Extension('pycav.mechanics', ['pycav/mechanics.pyx'])
+    mechanics = Extension('pycav.mechanics', ['pycav/mechanics.pyx'], **openmp)
     optics = Extension('pycav.optics', ['pycav/optics.pyx'])
     pde = Extension('pycav.pde', ['pycav/pde.pyx'])
     quantum = Extension('pycav.quantum', ['pycav/quantum.pyx'])
 else:
-    mechanics = Extension('pycav.mechanics', ['pycav/mechanics.c'])
+    mechanics = Extension('pycav.mechanics', ['pycav/mechanics.c'], **openmp)
     optics = Extension('pycav.optics', ['pycav/optics.c'])
     pde = Extension('pycav.pde', ['pycav/pde.c'])
     quantum = Extension('pycav.quantum', ['pycav/quantum.c'])